@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.history_buff.instrumentation import percentile
+
+# Written into a topic's output directory once its run has finished
+DONE_MARKER = "result.json"
+
+
+def topic_id_for(record: dict, topic: str) -> str:
+    """Use the record's own id if it has one, otherwise a slug plus a short hash of the topic."""
+    explicit = record.get("id") or record.get("request_id")
+    if explicit:
+        return re.sub(r"[^\w.-]+", "_", str(explicit))
+    slug = re.sub(r"[^a-z0-9]+", "-", topic.lower()).strip("-")[:48] or "topic"
+    return f"{slug}-{hashlib.sha1(topic.encode('utf-8')).hexdigest()[:8]}"
+
+
+def read_topics(path: str):
+    """
+    Stream (topic_id, topic) pairs from a JSONL file without loading it whole.
+    Ids must be unique, since each one names an output directory; a repeated id
+    is skipped with a warning.
+    """
+    # Only the ids are kept, so this stays small next to the file
+    seen = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Warning: Skipping line {line_number} of {path}: {e}")
+                continue
+            if isinstance(record, str):
+                record = {"topic": record}
+            topic = record.get("topic") or record.get("title")
+            if not topic:
+                print(f"Warning: Skipping line {line_number} of {path}: no 'topic' field")
+                continue
+            topic_id = topic_id_for(record, topic)
+            if topic_id in seen:
+                print(f"Warning: Skipping line {line_number} of {path}: "
+                      f"duplicate id '{topic_id}' (first used on line {seen[topic_id]})")
+                continue
+            seen[topic_id] = line_number
+            yield topic_id, topic
+
+
+def write_json_atomic(path: str, data: dict) -> None:
+    """Write JSON next to its final path and rename it into place."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class BatchRunner:
+    """
+    Runs many topics through one shared HistoryBuff with a bounded worker pool.
+    Each topic writes into its own directory under `output_dir`; topics that
+    already have a result marker are skipped, so an interrupted batch can be resumed.
+    """
+
+    def __init__(self, history_buff, output_dir: str = "batch_output", concurrency: int = 2,
+                 resume: bool = True, current_year: str = "2025"):
+        self.history_buff = history_buff
+        self.output_dir = output_dir
+        self.concurrency = max(1, concurrency)
+        self.resume = resume
+        self.current_year = current_year
+        self.latencies = []
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def run(self, path: str) -> dict:
+        """Run every topic in the JSONL file and return a summary."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        # Keep at most `concurrency` topics in flight so the file is streamed, not preloaded
+        slots = threading.BoundedSemaphore(self.concurrency)
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for topic_id, topic in read_topics(path):
+                topic_dir = os.path.join(self.output_dir, topic_id)
+                if self.resume and os.path.exists(os.path.join(topic_dir, DONE_MARKER)):
+                    print(f"Skipping completed topic: {topic_id}")
+                    self.skipped += 1
+                    continue
+                slots.acquire()
+                future = pool.submit(self._run_topic, topic_id, topic, topic_dir)
+                future.add_done_callback(lambda f, topic_id=topic_id: self._finished(f, topic_id, slots))
+
+        return self.summary(time.perf_counter() - started)
+
+    def _finished(self, future, topic_id: str, slots) -> None:
+        slots.release()
+        # _run_topic records kickoff errors itself; this catches anything raised around it
+        # (e.g. an unwritable output directory), which would otherwise vanish with the future
+        error = future.exception()
+        if error is not None:
+            print(f"[{topic_id}] Error: {str(error)}")
+            with self._lock:
+                self.failed += 1
+
+    def _run_topic(self, topic_id: str, topic: str, topic_dir: str) -> None:
+        os.makedirs(topic_dir, exist_ok=True)
+        inputs = {"topic": topic, "current_year": self.current_year}
+        print(f"[{topic_id}] Starting: {topic}")
+        start = time.perf_counter()
+        try:
+            result = self.history_buff.kickoff(inputs, output_dir=topic_dir)
+        except Exception as e:
+            print(f"[{topic_id}] Error: {str(e)}")
+            write_json_atomic(os.path.join(topic_dir, "error.json"), {
+                "id": topic_id, "topic": topic, "error": str(e), "failed_at": time.time()
+            })
+            with self._lock:
+                self.failed += 1
+            return
+
+        latency = time.perf_counter() - start
+        with open(os.path.join(topic_dir, "result.md"), "w", encoding="utf-8") as f:
+            f.write(str(result))
+        write_json_atomic(os.path.join(topic_dir, DONE_MARKER), {
+            "id": topic_id, "topic": topic, "latency_seconds": round(latency, 3), "finished_at": time.time()
+        })
+        error_path = os.path.join(topic_dir, "error.json")
+        if os.path.exists(error_path):
+            os.remove(error_path)
+        with self._lock:
+            self.completed += 1
+            self.latencies.append(latency)
+        print(f"[{topic_id}] Finished in {latency:.1f}s")
+
+    def summary(self, elapsed: float) -> dict:
+        """Throughput and latency percentiles for the topics run in this session."""
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "elapsed_seconds": round(elapsed, 2),
+            "topics_per_minute": round(self.completed / elapsed * 60, 2) if elapsed else 0.0,
+            "p50_latency_seconds": round(percentile(self.latencies, 50), 2),
+            "p95_latency_seconds": round(percentile(self.latencies, 95), 2),
+        }
@@ -0,0 +1,357 @@
+import base64
+import json
+import math
+import os
+import random
+import re
+import resource
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from src.history_buff.batch import BatchRunner, read_topics
+from src.history_buff.cache import make_key
+from src.history_buff.instrumentation import get_tracer, percentile
+from src.history_buff.providers import provider_metrics, set_fixtures
+
+# Offline benchmark harness. Provider responses (Gemini, OpenAI, Serper, page
+# fetches) are recorded once into JSONL fixtures at the ProviderClient layer,
+# then replayed with a configurable latency distribution, so the full
+# HistoryBuff pipeline can be timed without network jitter or API spend.
+
+BENCHMARK_DIR = os.path.join(os.getcwd(), "benchmarks")
+CORPUS_PATH = os.path.join(BENCHMARK_DIR, "topics.jsonl")
+FIXTURES_DIR = os.path.join(BENCHMARK_DIR, "fixtures")
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+# Responses used when replay finds no fixture close enough (or there are none yet)
+SYNTHETIC_RESPONSES = {
+    "openai": "Thought: I now can give a great answer\nFinal Answer: Stand-in answer produced by the benchmark harness.",
+    "gemini": "{}",
+    "serper": {"organic": []},
+    "scrape": {"status": 404, "headers": {}, "extracted": {"title": "", "passages": [], "bytes": 0}, "truncated": False},
+}
+
+# (report field, direction): +1 when higher is better, -1 when lower is better
+COMPARED_METRICS = [
+    ("topics_per_minute", 1),
+    ("p50_topic_seconds", -1),
+    ("p95_topic_seconds", -1),
+    ("llm_calls", -1),
+    ("peak_traced_mb", -1),
+]
+
+
+class ReplayResponse:
+    """Stands in for a Gemini response: has .text and iterates as a stream of chunks."""
+
+    def __init__(self, text: str, chunk_chars: int = 80):
+        self.text = text
+        self._chunk_chars = chunk_chars
+
+    def __iter__(self):
+        for start in range(0, len(self.text), self._chunk_chars) or [0]:
+            yield ReplayResponse(self.text[start:start + self._chunk_chars])
+
+
+def encode_response(provider: str, request: dict, result):
+    """Turn a live provider result into JSON for the fixture file."""
+    if provider == "gemini":
+        if request.get("stream"):
+            return "".join(chunk.text for chunk in result)
+        return result.text
+    if provider == "scrape":
+        status, headers, extracted, truncated = result
+        return {"status": status, "headers": dict(headers), "extracted": extracted, "truncated": truncated}
+    if provider == "openai":
+        return result if isinstance(result, str) else str(result)
+    return result
+
+
+def decode_response(provider: str, data):
+    """Turn fixture JSON back into what the caller of ProviderClient.call expects."""
+    if provider == "gemini":
+        return ReplayResponse(data)
+    if provider == "scrape":
+        if "body" in data:
+            # Fixtures recorded before pages were extracted while downloading hold the raw body
+            from src.history_buff.scraper import PageExtractor
+            body = base64.b64decode(data["body"])
+            extractor = PageExtractor(data["headers"].get("Content-Type", ""))
+            extractor.feed(body)
+            title, passages = extractor.close()
+            return data["status"], data["headers"], {"title": title, "passages": passages, "bytes": len(body)}, \
+                data["truncated"]
+        return data["status"], data["headers"], data["extracted"], data["truncated"]
+    return data
+
+
+def parse_latency(spec: str):
+    """
+    Latency model from a spec string: "recorded[:SCALE]", "none", "fixed:SECONDS",
+    "uniform:LOW,HIGH" or "lognormal:MEDIAN,SIGMA". Returns f(rng, recorded_seconds) -> seconds.
+    """
+    name, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v.strip()]
+    if name == "recorded":
+        scale = values[0] if values else 1.0
+        return lambda rng, recorded: recorded * scale
+    if name == "none":
+        return lambda rng, recorded: 0.0
+    if name == "fixed" and len(values) == 1:
+        return lambda rng, recorded: values[0]
+    if name == "uniform" and len(values) == 2:
+        return lambda rng, recorded: rng.uniform(values[0], values[1])
+    if name == "lognormal" and len(values) == 2:
+        return lambda rng, recorded: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+def _words(request: dict) -> set:
+    return set(re.findall(r"[a-z0-9]+", json.dumps(request, sort_keys=True).lower()))
+
+
+class FixtureStore:
+    """
+    Recorded responses, one JSONL file per provider under `directory`.
+    In record mode live calls are made and saved; in replay mode the call
+    is answered from the fixture with the same request, or else the most
+    similar recorded request of that provider, after a simulated delay.
+    """
+
+    def __init__(self, directory: str = FIXTURES_DIR, record: bool = False, latency: dict = None,
+                 strict: bool = False, seed: int = 7):
+        self.directory = directory
+        self.record = record
+        self.strict = strict
+        self.latency = latency or {}
+        self.rng = random.Random(seed)
+        self.fixtures = {}
+        self.hits = 0
+        self.similar = 0
+        self.misses = 0
+        self.recorded = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".jsonl"):
+                continue
+            provider = name[:-len(".jsonl")]
+            entries = self.fixtures.setdefault(provider, {})
+            with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entry = json.loads(line)
+                        entries[entry["key"]] = entry
+
+    @staticmethod
+    def key_for(provider: str, request: dict) -> str:
+        # Streaming and non-streaming calls for the same prompt share a fixture
+        return make_key(provider, {k: v for k, v in request.items() if k != "stream"})
+
+    def handle(self, provider: str, request: dict, fn):
+        """Called by ProviderClient.call in place of fn()."""
+        if self.record:
+            return self._record(provider, request, fn)
+        return self._replay(provider, request)
+
+    def _record(self, provider: str, request: dict, fn):
+        start = time.perf_counter()
+        result = fn()
+        data = encode_response(provider, request, result)
+        entry = {"key": self.key_for(provider, request), "request": request, "response": data,
+                 "latency": round(time.perf_counter() - start, 4)}
+        with self._lock:
+            self.fixtures.setdefault(provider, {})[entry["key"]] = entry
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f"{provider}.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+            self.recorded += 1
+        return decode_response(provider, data)
+
+    def _replay(self, provider: str, request: dict):
+        entries = self.fixtures.get(provider, {})
+        entry = entries.get(self.key_for(provider, request))
+        with self._lock:
+            if entry is not None:
+                self.hits += 1
+            else:
+                if self.strict:
+                    raise KeyError(f"No {provider} fixture for request {json.dumps(request)[:200]}")
+                entry = self._most_similar(entries, request)
+                if entry is not None:
+                    self.similar += 1
+                else:
+                    self.misses += 1
+            model = self.latency.get(provider) or self.latency.get("default") or parse_latency("recorded")
+            delay = max(0.0, model(self.rng, entry["latency"] if entry else 0.0))
+        time.sleep(delay)
+        return decode_response(provider, entry["response"] if entry else SYNTHETIC_RESPONSES[provider])
+
+    @staticmethod
+    def _most_similar(entries: dict, request: dict):
+        """Fixture whose request shares the most words with this one (prompts drift when code changes)."""
+        if not entries:
+            return None
+        words = _words(request)
+        best, best_score = None, 0.0
+        for entry in entries.values():
+            other = entry.setdefault("_words", _words(entry["request"]))
+            score = len(words & other) / (len(words | other) or 1)
+            if score > best_score:
+                best, best_score = entry, score
+        return best
+
+    def stats(self) -> dict:
+        replayed = self.hits + self.similar + self.misses
+        return {"exact": self.hits, "similar": self.similar, "synthetic": self.misses, "recorded": self.recorded,
+                "synthetic_share": round(self.misses / replayed, 3) if replayed else 0.0}
+
+
+def _stage_latencies() -> dict:
+    stages = {}
+    for (kind, name), aggregate in get_tracer().aggregates.items():
+        if kind == "task":
+            stages[name] = {
+                "count": aggregate["count"],
+                "p50_seconds": round(percentile(aggregate["durations"], 50), 3),
+                "p95_seconds": round(percentile(aggregate["durations"], 95), 3),
+            }
+    return stages
+
+
+def _clear_caches() -> None:
+    """Empty the caches the warm-up filled, so the timed run starts as cold as the first one did."""
+    from src.history_buff.cache import get_llm_cache
+    from src.history_buff.knowledge import clear_knowledge_index
+    from src.history_buff.scraper import get_page_fetcher
+    from src.history_buff.search_cache import get_search_cache
+    get_llm_cache().clear()
+    get_search_cache().store.clear()
+    get_page_fetcher().cache.clear()
+    clear_knowledge_index()
+
+
+def _warm_up(history_buff, corpus_path: str, output_dir: str) -> None:
+    """Run the first topic once so one-off costs (imports, agent creation, tokenizer loading) are not timed."""
+    warm = getattr(history_buff, "warm", None)
+    if warm:
+        warm()
+    for record in read_topics(corpus_path):
+        history_buff.kickoff({"topic": record[1], "current_year": "2025"},
+                             output_dir=os.path.join(output_dir, "warmup"))
+        break
+
+
+def _traced_peak(history_buff, corpus_path: str, output_dir: str, concurrency: int, cold: bool) -> int:
+    """Peak traced bytes of one more run over the corpus, started from the same cache state as the timed one."""
+    if cold:
+        _clear_caches()
+    tracemalloc.start()
+    try:
+        runner = BatchRunner(history_buff, output_dir=os.path.join(output_dir, "memory"),
+                             concurrency=concurrency, resume=False)
+        runner.run(corpus_path)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(history_buff_factory, corpus_path: str = CORPUS_PATH, store: FixtureStore = None,
+                  concurrency: int = 2, warmup: bool = True, cold: bool = True, memory_pass: bool = True) -> dict:
+    """
+    Run every topic in the corpus through a fresh HistoryBuff and collect the report.
+    With `cold`, the LLM, search, page and knowledge caches are emptied after the
+    warm-up, so the timed topics do not read what the warm-up stored.
+    tracemalloc slows every allocation, so peak traced memory comes from a
+    second, untimed pass over the corpus (`memory_pass`, skipped when recording).
+    """
+    store = store or FixtureStore()
+    set_fixtures(store)
+    try:
+        history_buff = history_buff_factory()
+        # CrewAI resolves output_file paths relative to the working directory, so keep outputs under it
+        with tempfile.TemporaryDirectory(prefix=".history_buff_bench_", dir=os.getcwd()) as tmp_dir:
+            output_dir = os.path.relpath(tmp_dir)
+            if warmup:
+                _warm_up(history_buff, corpus_path, output_dir)
+                if cold:
+                    _clear_caches()
+            calls_before = {name: metrics["calls"] for name, metrics in provider_metrics().items()}
+            get_tracer().reset()
+            runner = BatchRunner(history_buff, output_dir=output_dir, concurrency=concurrency, resume=False)
+            summary = runner.run(corpus_path)
+            # Everything timed or counted is read before the memory pass adds to it
+            providers = {name: {**metrics, "calls": metrics["calls"] - calls_before.get(name, 0)}
+                         for name, metrics in provider_metrics().items()}
+            agent_steps = sum(a["count"] for (kind, _), a in get_tracer().aggregates.items() if kind == "agent_step")
+            stages = _stage_latencies()
+            fixtures = store.stats()
+            peak = None
+            if memory_pass and not store.record:
+                peak = _traced_peak(history_buff, corpus_path, output_dir, concurrency, cold)
+    finally:
+        set_fixtures(None)
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    max_rss_mb = max_rss / 1024 / 1024 if os.uname().sysname == "Darwin" else max_rss / 1024
+    return {
+        "mode": "record" if store.record else "replay",
+        "corpus": corpus_path,
+        "concurrency": concurrency,
+        "completed": summary["completed"],
+        "failed": summary["failed"],
+        "elapsed_seconds": summary["elapsed_seconds"],
+        "topics_per_minute": summary["topics_per_minute"],
+        "p50_topic_seconds": summary["p50_latency_seconds"],
+        "p95_topic_seconds": summary["p95_latency_seconds"],
+        "stages": stages,
+        "llm_calls": sum(providers.get(name, {}).get("calls", 0) for name in ("openai", "gemini")),
+        "agent_steps": agent_steps,
+        "provider_calls": {name: metrics["calls"] for name, metrics in providers.items()},
+        "fixtures": fixtures,
+        "peak_traced_mb": round(peak / 1024 / 1024, 2) if peak is not None else None,
+        "max_rss_mb": round(max_rss_mb, 1),
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.1) -> list:
+    """
+    Compare a report against a baseline. Returns one row per metric:
+    (metric, baseline, current, relative change, regressed).
+    """
+    rows = []
+    metrics = list(COMPARED_METRICS)
+    for stage in sorted(set(report.get("stages", {})) & set(baseline.get("stages", {}))):
+        metrics.append((f"stages.{stage}.p95_seconds", -1))
+    for metric, direction in metrics:
+        before, after = _lookup(baseline, metric), _lookup(report, metric)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else 0.0
+        rows.append((metric, before, after, change, change * direction < -tolerance))
+    return rows
+
+
+def _lookup(report: dict, path: str):
+    value = report
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def format_comparison(rows: list) -> str:
+    lines = [f"{'metric':<40}{'baseline':>12}{'current':>12}{'change':>10}"]
+    for metric, before, after, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        lines.append(f"{metric:<40}{before:>12.3f}{after:>12.3f}{change:>+10.1%}{flag}")
+    return "\n".join(lines)
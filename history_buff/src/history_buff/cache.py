@@ -0,0 +1,278 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: file_lock uses msvcrt byte-range locks instead
+    fcntl = None
+    import msvcrt
+
+from src.history_buff.instrumentation import span
+from src.history_buff.providers import estimate_tokens, get_client
+
+# Where persistent caches live (shared by every tool in the process)
+CACHE_DIR = os.getenv("HISTORY_BUFF_CACHE_DIR", os.path.join(os.getcwd(), ".history_buff_cache"))
+
+# LLM response cache defaults (override through the environment)
+LLM_CACHE_TTL = int(os.getenv("HISTORY_BUFF_LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("HISTORY_BUFF_LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def cache_enabled(env_var: str) -> bool:
+    """Return False when the given switch is set to 0/off/false/no."""
+    return os.getenv(env_var, "on").strip().lower() not in ("0", "off", "false", "no")
+
+
+@contextmanager
+def file_lock(path: str):
+    """Hold an exclusive advisory lock on `path` (created if missing) across processes."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            return
+        # LK_LOCK gives up after about 10 seconds, so keep trying until the lock is free
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                continue
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse indentation and whitespace so equivalent prompts share a key."""
+    lines = [re.sub(r"\s+", " ", line).strip() for line in str(prompt).strip().splitlines()]
+    return "\n".join(line for line in lines if line)
+
+
+def make_key(*parts) -> str:
+    """Build a content-addressed key from any JSON-serializable parts."""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent key/value cache backed by SQLite.
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted once the stored values exceed `max_bytes`.
+    """
+
+    def __init__(self, path: str, ttl: int = LLM_CACHE_TTL, max_bytes: int = LLM_CACHE_MAX_BYTES,
+                 enabled: bool = True):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_access)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str):
+        """Return the cached value for key, or None on a miss."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                if row is not None:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    conn.commit()
+                self.misses += 1
+                return None
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value) -> None:
+        """Store a JSON-serializable value and evict old entries if over budget."""
+        if not self.enabled:
+            return
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), now, now),
+            )
+            self.writes += 1
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn) -> None:
+        if self.ttl:
+            cur = conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,))
+            self.evictions += max(cur.rowcount, 0)
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def delete(self, key: str) -> None:
+        """Drop one entry (e.g. a cached reply that no longer passes validation)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            conn.commit()
+
+    def clear(self) -> None:
+        """Remove every entry from the cache."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM entries")
+            conn.commit()
+
+    def stats(self) -> dict:
+        """Return hit/miss counters for this process."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> ResponseCache:
+    """Return the process-wide LLM response cache."""
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = ResponseCache(
+                os.path.join(CACHE_DIR, "llm_responses.sqlite"),
+                ttl=LLM_CACHE_TTL,
+                max_bytes=LLM_CACHE_MAX_BYTES,
+                enabled=cache_enabled("HISTORY_BUFF_LLM_CACHE"),
+            )
+    return _llm_cache
+
+
+def cached_generate(model, prompt: str, generation_config: dict = None, bypass: bool = False,
+                    on_chunk=None, validate=None) -> str:
+    """
+    Call `model.generate_content` through the shared LLM cache and return the text.
+    The key covers the model name, the generation config and the normalized prompt.
+    With `on_chunk`, the response is streamed and each text chunk is passed to it
+    as it arrives (a cache hit is delivered as a single chunk).
+    With `validate`, a reply for which it raises ValueError is returned but not
+    cached, and a cached reply that fails it is dropped and asked for again.
+    """
+    with span("gemini", "request", model=getattr(model, "model_name", str(model))) as request:
+        text = _cached_generate(model, prompt, generation_config, bypass, on_chunk, request, validate)
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = estimate_tokens(text)
+        request.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        if not request.attributes.get("cache_hit"):
+            request.set(cost_usd=get_client("gemini").cost(prompt_tokens, completion_tokens),
+                        bytes=len(prompt.encode("utf-8")) + len((text or "").encode("utf-8")))
+        return text
+
+
+def _is_valid(text, validate) -> bool:
+    if validate is None:
+        return True
+    try:
+        validate(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _cached_generate(model, prompt, generation_config, bypass, on_chunk, request, validate=None) -> str:
+    cache = get_llm_cache()
+    model_name = getattr(model, "model_name", str(model))
+    key = make_key("gemini", model_name, generation_config or {}, normalize_prompt(prompt))
+
+    if not bypass:
+        cached = cache.get(key)
+        if cached is not None and not _is_valid(cached, validate):
+            cache.delete(key)
+            cached = None
+        if cached is not None:
+            request.set(cache_hit=1)
+            if on_chunk is not None:
+                on_chunk(cached)
+            return cached
+
+    def generate():
+        kwargs = {"stream": True} if on_chunk is not None else {}
+        if generation_config:
+            return model.generate_content(contents=prompt, generation_config=generation_config, **kwargs)
+        return model.generate_content(prompt, **kwargs)
+
+    def read(response):
+        if on_chunk is None:
+            return response.text
+        parts = []
+        try:
+            for chunk in response:
+                parts.append(chunk.text)
+                on_chunk(chunk.text)
+        except Exception as e:
+            if parts:
+                # A retry would send the already forwarded chunks to on_chunk a second time
+                raise RuntimeError(f"Gemini stream interrupted after {len(parts)} chunks: {str(e)}") from e
+            raise
+        return "".join(parts)
+
+    text = get_client("gemini").call(
+        generate,
+        tokens=estimate_tokens(prompt),
+        request={"model": model_name, "config": generation_config or {}, "prompt": prompt,
+                 "stream": on_chunk is not None},
+        consume=read
+    )
+    if text and _is_valid(text, validate):
+        cache.set(key, text)
+    return text
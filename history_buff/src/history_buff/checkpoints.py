@@ -0,0 +1,165 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+from src.history_buff.cache import CACHE_DIR, cache_enabled, make_key
+
+# Stage-level checkpoints for DAG runs. Each finished task's output is saved
+# under the run's inputs, keyed on the stage, a hash of its task and agent
+# config and the hashes of the upstream outputs it was given. A later run with
+# the same inputs takes every stage whose key still matches from disk, so a
+# failure in `reporting` does not cost the earlier stages again.
+
+CHECKPOINT_DIR = os.path.join(CACHE_DIR, "checkpoints")
+# Checkpoints of runs not touched for this long are removed
+CHECKPOINT_TTL = int(os.getenv("HISTORY_BUFF_CHECKPOINT_TTL", str(7 * 24 * 3600)))
+
+
+def checkpoints_enabled() -> bool:
+    return cache_enabled("HISTORY_BUFF_CHECKPOINTS")
+
+
+def run_key(inputs: dict) -> str:
+    """Checkpoint directory name for a run's inputs (topic, current_year)."""
+    return make_key("run", {k: str(v) for k, v in (inputs or {}).items()})[:24]
+
+
+def output_hash(text: str) -> str:
+    return make_key("output", text)[:16]
+
+
+class RunCheckpoints:
+    """
+    The checkpoints of one run. Passed to DagScheduler.run, which calls load()
+    before executing a stage and save() once it has finished.
+    """
+
+    def __init__(self, directory: str, inputs: dict, config_hashes: dict):
+        self.directory = directory
+        self.inputs = dict(inputs or {})
+        self.config_hashes = config_hashes
+        self.restored = []
+        self.saved = []
+        self._lock = threading.Lock()
+
+    def key(self, stage: str, upstream: list) -> str:
+        return make_key(stage, self.config_hashes.get(stage), [output_hash(text) for text in upstream])
+
+    def _path(self, stage: str) -> str:
+        return os.path.join(self.directory, f"{stage}.json")
+
+    def load(self, stage: str, upstream: list):
+        """The checkpointed output of a stage, or None when it is missing or was made from other inputs."""
+        try:
+            with open(self._path(stage), "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if checkpoint.get("key") != self.key(stage, upstream):
+            return None
+        with self._lock:
+            self.restored.append(stage)
+        return checkpoint["output"]
+
+    def save(self, stage: str, upstream: list, output: str) -> None:
+        checkpoint = {
+            "key": self.key(stage, upstream),
+            "stage": stage,
+            "config_hash": self.config_hashes.get(stage),
+            "upstream_hashes": [output_hash(text) for text in upstream],
+            "output_hash": output_hash(output),
+            "output": output,
+            "created": time.time(),
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._write_json(os.path.join(self.directory, "run.json"), {"inputs": self.inputs, "updated": time.time()})
+            self._write_json(self._path(stage), checkpoint)
+        except OSError as e:
+            print(f"Warning: Could not save checkpoint for {stage}: {str(e)}")
+            return
+        with self._lock:
+            self.saved.append(stage)
+
+    @staticmethod
+    def _write_json(path: str, data: dict) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def invalidate(self, stages) -> list:
+        """Drop the checkpoints of the given stages; returns the ones that existed."""
+        removed = []
+        for stage in stages:
+            try:
+                os.remove(self._path(stage))
+                removed.append(stage)
+            except FileNotFoundError:
+                continue
+        return removed
+
+    def stages(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len(".json")] for name in os.listdir(self.directory)
+                      if name.endswith(".json") and name != "run.json")
+
+
+class CheckpointStore:
+    """All checkpointed runs, one directory per run under `directory`."""
+
+    def __init__(self, directory: str = CHECKPOINT_DIR, ttl: int = CHECKPOINT_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.prune()
+
+    def for_run(self, inputs: dict, config_hashes: dict) -> RunCheckpoints:
+        return RunCheckpoints(os.path.join(self.directory, run_key(inputs)), inputs, config_hashes)
+
+    def runs(self) -> list:
+        """Checkpointed runs as {"inputs", "updated", "stages"}, most recent first."""
+        runs = []
+        if not os.path.isdir(self.directory):
+            return runs
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name, "run.json")
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    run = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            run["stages"] = RunCheckpoints(os.path.dirname(path), run["inputs"], {}).stages()
+            runs.append(run)
+        return sorted(runs, key=lambda run: -run["updated"])
+
+    def prune(self) -> int:
+        """Remove runs whose checkpoints are older than the TTL."""
+        if not self.ttl or not os.path.isdir(self.directory):
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    """Return the process-wide checkpoint store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CheckpointStore()
+    return _store
@@ -0,0 +1,238 @@
+import hashlib
+import math
+import re
+import threading
+from collections import Counter
+
+from src.history_buff.knowledge import tokenize
+from src.history_buff.providers import estimate_tokens
+from src.history_buff.timeline import format_date, parse_date
+
+# Keeps the context handed from one stage to the next within a token budget.
+# Upstream outputs are split into passages, near-duplicates are dropped, dated
+# facts are pulled out, and the remaining passages are ranked against the topic
+# with BM25. Only when the facts and relevant passages alone exceed the budget
+# is an LLM asked to summarize them.
+
+# Share of the budget reserved for the extracted dated facts
+FACTS_SHARE = 0.3
+# Word-shingle Jaccard similarity above which two passages count as duplicates
+DUPLICATE_SIMILARITY = 0.8
+SHINGLE_SIZE = 3
+
+K1 = 1.2
+B = 0.75
+
+FACTS_HEADING = "Key dated facts:"
+
+
+def split_passages(text: str) -> list:
+    """Paragraphs (or list items) of an upstream output, markdown kept as is."""
+    passages = []
+    for block in re.split(r"\n\s*\n", text or ""):
+        block = block.strip()
+        if not block:
+            continue
+        lines = block.splitlines()
+        # A list is split into its items so repeated bullets can be dropped one by one
+        if len(lines) > 1 and all(re.match(r"\s*(?:[-*+]|\d+[.)])\s", line) for line in lines[1:]):
+            passages.extend(line.strip() for line in lines if line.strip())
+        else:
+            passages.append(block)
+    return passages
+
+
+def _shingles(words: list) -> set:
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def dedupe_passages(passages: list) -> list:
+    """Drop exact and near-duplicate passages, keeping the first occurrence."""
+    kept = []
+    seen_hashes = set()
+    kept_shingles = []
+    for passage in passages:
+        words = re.findall(r"\w+", passage.lower())
+        if not words:
+            continue
+        digest = hashlib.sha1(" ".join(words).encode("utf-8")).hexdigest()
+        if digest in seen_hashes:
+            continue
+        shingles = _shingles(words)
+        if any(len(shingles & other) / len(shingles | other) >= DUPLICATE_SIMILARITY for other in kept_shingles):
+            continue
+        seen_hashes.add(digest)
+        kept_shingles.append(shingles)
+        kept.append(passage)
+    return kept
+
+
+def rank_passages(passages: list, query: str) -> list:
+    """BM25 score of every passage against the query, in passage order."""
+    docs = [tokenize(p) for p in passages]
+    terms = set(tokenize(query))
+    if not docs or not terms:
+        return [0.0] * len(passages)
+    avg_length = sum(len(d) for d in docs) / len(docs) or 1.0
+    df = Counter(term for doc in docs for term in set(doc) if term in terms)
+    scores = []
+    for doc in docs:
+        counts = Counter(doc)
+        score = 0.0
+        for term in terms:
+            tf = counts.get(term)
+            if not tf:
+                continue
+            idf = math.log(1 + (len(docs) - df[term] + 0.5) / (df[term] + 0.5))
+            score += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * len(doc) / avg_length))
+        scores.append(score)
+    return scores
+
+
+def _sentences(passage: str) -> list:
+    sentences = (re.sub(r"^[\s#>*+-]+|\*\*", "", s).strip() for s in re.split(r"(?<=[.!?])\s+|\n", passage))
+    return [s for s in sentences if s]
+
+
+def extract_dated_facts(passages: list) -> list:
+    """Sentences that carry a parseable date, as (EventDate, sentence), in chronological order."""
+    facts = []
+    seen = set()
+    for passage in passages:
+        for sentence in _sentences(passage):
+            if len(sentence) < 20 or len(sentence) > 400:
+                continue
+            date = parse_date(sentence)
+            if date is None:
+                continue
+            key = sentence.lower()
+            if key in seen:
+                continue
+            seen.add(key)
+            facts.append((date, sentence))
+    facts.sort(key=lambda fact: (fact[0].start, fact[0].month or 0, fact[0].day or 0))
+    return facts
+
+
+def _fact_line(date, sentence: str) -> str:
+    # "410 AD: Sack of Rome" becomes "- 410: Sack of Rome" rather than repeating the date
+    sentence = re.sub(r"^" + re.escape(date.text) + r"\s*[:\-–—]\s*", "", sentence)
+    return f"- {format_date(date)}: {sentence}"
+
+
+def _take(items: list, budget: int) -> tuple:
+    """Greedily keep items (strings) while they fit the budget."""
+    kept, used = [], 0
+    for item in items:
+        tokens = estimate_tokens(item)
+        if used + tokens > budget:
+            continue
+        kept.append(item)
+        used += tokens
+    return kept, used
+
+
+class ContextCompactor:
+    """Applies a token budget to a stage's upstream context and keeps per-stage savings."""
+
+    def __init__(self, summarize=None):
+        # summarize(text, topic, budget_tokens) -> str; defaults to Gemini on the routed tier, through the shared cache
+        self.summarize = summarize or summarize_with_gemini
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def compact(self, stage: str, texts: list, topic: str, budget: int, divider: str = "\n\n") -> str:
+        """Return the upstream texts joined with `divider`, or a compacted version if that is over budget."""
+        original = divider.join(t for t in texts if t)
+        before = estimate_tokens(original)
+        if not budget or before <= budget:
+            self._record(stage, before, before, "none")
+            return original
+
+        passages = dedupe_passages([p for text in texts for p in split_passages(text)])
+        dated = extract_dated_facts(passages)
+        facts = [_fact_line(date, sentence) for date, sentence in dated]
+        scores = rank_passages(passages, topic)
+
+        fact_lines, facts_used = _take(facts, int(budget * FACTS_SHARE))
+        heading_tokens = estimate_tokens(FACTS_HEADING) if fact_lines else 0
+        # Passages already fully listed as dated facts are not repeated
+        listed = {sentence.lower() for (_, sentence), line in zip(dated, facts) if line in set(fact_lines)}
+        covered = {i for i, p in enumerate(passages) if all(s.lower() in listed for s in _sentences(p))}
+        relevant = sorted((i for i, score in enumerate(scores) if score > 0 and i not in covered),
+                          key=lambda i: -scores[i])
+        chosen, _ = _take([passages[i] for i in relevant], budget - facts_used - heading_tokens)
+
+        required = estimate_tokens("\n".join(facts)) + sum(estimate_tokens(passages[i]) for i in relevant)
+        if required > budget:
+            # Even the relevant material does not fit: let the LLM condense it
+            material = "\n".join([FACTS_HEADING] + facts + [""] + [passages[i] for i in relevant])
+            summary = self._summarize(material, topic, budget)
+            if summary and estimate_tokens(summary) <= budget * 1.1:
+                self._record(stage, before, estimate_tokens(summary), "summary")
+                return summary
+
+        # Passages go back in their original order so the context still reads naturally
+        chosen_set = set(chosen)
+        ordered = [p for p in passages if p in chosen_set]
+        if not ordered and not fact_lines:
+            # Nothing matched the topic: keep the leading passages instead of returning nothing
+            ordered, _ = _take(passages, budget)
+        sections = ["\n".join([FACTS_HEADING] + fact_lines)] if fact_lines else []
+        result = "\n\n".join(sections + ordered)
+        self._record(stage, before, estimate_tokens(result), "extractive")
+        return result
+
+    def _summarize(self, material: str, topic: str, budget: int):
+        try:
+            return self.summarize(material, topic, budget)
+        except Exception as e:
+            print(f"Warning: Context summary failed, keeping extractive context: {str(e)}")
+            return None
+
+    def _record(self, stage: str, before: int, after: int, method: str) -> None:
+        if method != "none":
+            print(f"Context for {stage}: {before} -> {after} tokens ({before - after} saved, {method})")
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"runs": 0, "tokens_before": 0, "tokens_after": 0,
+                                                   "summaries": 0})
+            entry["runs"] += 1
+            entry["tokens_before"] += before
+            entry["tokens_after"] += after
+            if method == "summary":
+                entry["summaries"] += 1
+
+    def stats(self) -> dict:
+        """Tokens before and after compaction, and tokens saved, per stage."""
+        with self._lock:
+            return {stage: {**entry, "tokens_saved": entry["tokens_before"] - entry["tokens_after"]}
+                    for stage, entry in self.stages.items()}
+
+
+def summarize_with_gemini(material: str, topic: str, budget: int) -> str:
+    # Routed like the tools' Gemini calls, so the summary counts against the report budget
+    from src.history_buff.tools.custom_tool import generate
+
+    words = int(budget * 0.75)
+    prompt = (
+        f"Condense the research notes below about '{topic}' into at most {words} words. "
+        "Keep every date, name, number and source URL that matters for a historical report; "
+        "drop repetition and anything unrelated to the topic. Return plain markdown only.\n\n"
+        f"{material}"
+    )
+    return generate("ContextCompactor", prompt)
+
+
+_compactor = None
+_compactor_lock = threading.Lock()
+
+
+def get_compactor() -> ContextCompactor:
+    """Return the process-wide context compactor."""
+    global _compactor
+    with _compactor_lock:
+        if _compactor is None:
+            _compactor = ContextCompactor()
+    return _compactor
@@ -1,17 +1,19 @@
 import os
+import threading
+from contextlib import nullcontext
+from functools import lru_cache
+
 import yaml
-from crewai import Agent, Crew, Process, Task
 from dotenv import load_dotenv
 
-# Import custom tools
-from src.history_buff.tools.custom_tool import (
-    TimelineBuilderTool, 
-    EnhancedSerperTool, 
-    ChronoAPITool, 
-    IntentClassifierTool, 
-    MarkdownFormatterTool
+from src.history_buff.instrumentation import span
+from src.history_buff.streaming import StageStreamer, streaming_enabled, write_atomic
+from src.history_buff.scheduler import (
+    CONTEXT_DIVIDER, DagScheduler, ScheduleResult, ToolTask, is_static_graph, task_dependencies, topological_order
 )
-from crewai_tools import SerperDevTool, ScrapeWebsiteTool
+
+# crewai, crewai_tools and the tool modules are imported on first use: they dominate
+# startup time and short-lived commands (batch workers, index updates) may never need them
 
 # Load environment variables
 load_dotenv()
@@ -20,89 +22,137 @@ load_dotenv()
 os.environ["CREWAI_TELEMETRY"] = "False"
 os.environ["LANGCHAIN_TRACING"] = "false"
 
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+
+AGENT_NAMES = ['query_decipherer', 'researcher', 'timeline_agent', 'reporting_analyst']
+
+# Simplified task descriptions used if a description in tasks.yaml cannot be formatted
+FALLBACK_TASKS = {
+    'query_understanding': ("Analyze the historical query: '{topic}'", "JSON with query type, entities and timeframe"),
+    'research': ("Research: '{topic}'", "Historical data with sources"),
+    'timeline_creation': ("Create timeline for: '{topic}'", "Markdown timeline"),
+    'reporting': ("Create report about: '{topic}'", "Markdown report"),
+}
+
+
+@lru_cache(maxsize=32)
+def _parse_yaml(path, mtime_ns):
+    with open(path, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def load_config(name):
+    """Parsed config/<name>.yaml, cached until the file changes. Treat the result as read-only."""
+    path = os.path.join(CONFIG_DIR, f'{name}.yaml')
+    return _parse_yaml(path, os.stat(path).st_mtime_ns)
+
+
+def _custom_tool(class_name):
+    def factory():
+        from src.history_buff.tools import custom_tool
+        return getattr(custom_tool, class_name)()
+    return factory
+
+
+def _serper_tool(class_name):
+    def factory():
+        from src.history_buff.tools import serper_tool
+        return getattr(serper_tool, class_name)()
+    return factory
+
+
+def _scrape_website_tool():
+    from crewai_tools import ScrapeWebsiteTool
+    return ScrapeWebsiteTool()
+
+
+# Name used in agents.yaml -> factory for the tool instance
+TOOL_FACTORIES = {
+    "SerperDevTool": _serper_tool("CachedSerperDevTool"),
+    "EnhancedSerperTool": _serper_tool("EnhancedSerperTool"),
+    "ScrapeWebsiteTool": _scrape_website_tool,
+    "TimelineBuilderTool": _custom_tool("TimelineBuilderTool"),
+    "BatchScrapeTool": _custom_tool("BatchScrapeTool"),
+    "KnowledgeSearchTool": _custom_tool("KnowledgeSearchTool"),
+    "QueryUnderstandingTool": _custom_tool("QueryUnderstandingTool"),
+    "MarkdownFormatterTool": _custom_tool("MarkdownFormatterTool"),
+}
+
+
 class HistoryBuff:
     """
     HistoryBuff crew for historical Q&A with timeline generation.
     Uses OpenAI for CrewAI and Gemini for custom tools.
+    Tools and agents are created the first time a task needs them.
     """
     
-    def __init__(self):
-        # Fix paths using proper absolute path resolution
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        # Load configuration files
-        agents_config_path = os.path.join(base_dir, 'config', 'agents.yaml')
-        tasks_config_path = os.path.join(base_dir, 'config', 'tasks.yaml')
-        
-        print(f"Loading agents config from: {agents_config_path}")
-        print(f"Loading tasks config from: {tasks_config_path}")
+    def __init__(self, stream=None):
+        # Stream model output to the console and output files as it is generated
+        self.stream = streaming_enabled() if stream is None else stream
         
-        with open(agents_config_path, 'r') as f:
-            self.agents_config = yaml.safe_load(f)
-        with open(tasks_config_path, 'r') as f:
-            self.tasks_config = yaml.safe_load(f)
+        self.agents_config = load_config('agents')
+        self.tasks_config = load_config('tasks')
         
-        # Initialize tools
-        self.tools = self._initialize_tools()
+        # Created on first use by get_tool() / get_agent()
+        self._tools = {}
+        self._agents = {}
+        self._build_lock = threading.RLock()
         
-        # Create agents
-        self.agents = self._create_agents()
-        
-        # Tasks will be created later
-        self.tasks = {}
+        # One lock per agent so concurrent runs sharing this instance never use an agent twice at once
+        self.agent_locks = {name: threading.Lock() for name in AGENT_NAMES}
     
-    def _initialize_tools(self):
-        """Initialize all tools with proper error handling."""
-        tools = {}
-        
-        # Initialize standard tools
-        try:
-            tools["SerperDevTool"] = SerperDevTool()
-            print("Successfully initialized SerperDevTool")
-        except Exception as e:
-            print(f"Warning: Failed to initialize SerperDevTool: {str(e)}")
-            
-        try:
-            tools["ScrapeWebsiteTool"] = ScrapeWebsiteTool()
-            print("Successfully initialized ScrapeWebsiteTool")
-        except Exception as e:
-            print(f"Warning: Failed to initialize ScrapeWebsiteTool: {str(e)}")
-            
-        # Initialize custom tools
-        try:
-            tools["TimelineBuilderTool"] = TimelineBuilderTool()
-            tools["EnhancedSerperTool"] = EnhancedSerperTool()
-            tools["ChronoAPITool"] = ChronoAPITool()
-            tools["IntentClassifierTool"] = IntentClassifierTool()
-            tools["MarkdownFormatterTool"] = MarkdownFormatterTool()
-            print("Successfully initialized all custom tools")
-        except Exception as e:
-            print(f"Error initializing custom tools: {str(e)}")
-            raise
-        
-        return tools
+    @property
+    def tools(self):
+        """Every tool the agents use (builds any not created yet)."""
+        for agent_name in AGENT_NAMES:
+            for tool_name in self.agents_config[agent_name].get('tools', []):
+                self.get_tool(tool_name)
+        return dict(self._tools)
     
-    def _create_agents(self):
-        """Create all the agents for the crew."""
-        agents = {}
-        
-        # Create each agent
-        for agent_name in ['query_decipherer', 'temporal_specialist', 'researcher', 
-                           'timeline_agent', 'reporting_analyst']:
-            agents[agent_name] = self._create_agent(agent_name)
-            
-        return agents
+    @property
+    def agents(self):
+        """All agents (builds any not created yet)."""
+        return {name: self.get_agent(name) for name in AGENT_NAMES}
+    
+    def warm(self):
+        """Build every agent and tool now instead of on first use (for long-running services)."""
+        self.agents
+        return self
+    
+    def get_tool(self, tool_name):
+        """Return the named tool, creating it on first use; None if it is unknown or fails to initialize."""
+        with self._build_lock:
+            if tool_name not in self._tools:
+                factory = TOOL_FACTORIES.get(tool_name)
+                if factory is None:
+                    return None
+                try:
+                    self._tools[tool_name] = factory()
+                except Exception as e:
+                    print(f"Warning: Failed to initialize {tool_name}: {str(e)}")
+                    return None
+            return self._tools[tool_name]
+    
+    def get_agent(self, agent_name):
+        """Return the named agent, creating it (and its tools) on first use."""
+        with self._build_lock:
+            if agent_name not in self._agents:
+                self._agents[agent_name] = self._create_agent(agent_name)
+            return self._agents[agent_name]
     
     def _create_agent(self, agent_name):
         """Create a single agent with its tools."""
+        from crewai import Agent
+        from src.history_buff.llm import ThrottledLLM
+        
         config = self.agents_config[agent_name]
         
         # Get tools for this agent
         agent_tools = []
         for tool_name in config.get('tools', []):
-            if tool_name in self.tools:
-                agent_tools.append(self.tools[tool_name])
-                print(f"Added tool {tool_name} to agent {agent_name}")
+            tool = self.get_tool(tool_name)
+            if tool is not None:
+                agent_tools.append(tool)
             else:
                 print(f"Warning: Tool {tool_name} not found for agent {agent_name}")
         
@@ -112,119 +162,223 @@ class HistoryBuff:
             goal=config['goal'],
             backstory=config['backstory'],
             tools=agent_tools,
-            llm="gpt-3.5-turbo",  # Using OpenAI's GPT-3.5 Turbo
+            # Model chosen per call from the agent's tier (config/routing.yaml), rate limited
+            llm=ThrottledLLM(tier=config.get('tier', 'fast'), target=agent_name, stream=self.stream),
             verbose=True
         )
     
-    def _create_tasks(self, inputs=None):
-        """Create all the tasks for the crew with proper format string substitution."""
+    def _create_tasks(self, inputs=None, output_dir=None, write_files=True, direct_tools=False):
+        """
+        Create all the tasks for the crew with proper format string substitution.
+        Output files are written under output_dir when one is given; with
+        write_files=False the caller writes them instead (see _output_files).
+        With direct_tools=True, tasks that name a `tool` call it without an agent turn.
+        """
+        from crewai import Task
+        
         tasks = {}
         
         # Default inputs if none provided
         if inputs is None:
             inputs = {'topic': 'the historical topic', 'current_year': '2025'}
+        
+        # Upstream tasks must exist before the tasks that take them as context
+        for name in topological_order(task_dependencies(self.tasks_config)):
+            config = self.tasks_config[name]
+            try:
+                description = config['description'].format(**inputs)
+                expected_output = config['expected_output']
+            except KeyError as e:
+                print(f"Error formatting task description for {name}: {e}")
+                print("Using default task description instead")
+                description, expected_output = FALLBACK_TASKS[name]
+                description = description.format(topic=inputs.get('topic', 'historical topic'))
+            output_file = self._output_path(config.get('output_file'), output_dir) if write_files else None
             
-        try:
-            # Create query analysis task
-            tasks['query_analysis'] = Task(
-                description=self.tasks_config['query_analysis']['description'].format(**inputs),
-                expected_output=self.tasks_config['query_analysis']['expected_output'],
-                agent=self.agents['query_decipherer']
-            )
-            
-            # Create temporal context task
-            tasks['temporal_context'] = Task(
-                description=self.tasks_config['temporal_context']['description'].format(**inputs),
-                expected_output=self.tasks_config['temporal_context']['expected_output'],
-                agent=self.agents['temporal_specialist'],
-                context=[tasks['query_analysis']]
-            )
-            
-            # Create research task
-            tasks['research'] = Task(
-                description=self.tasks_config['research']['description'].format(**inputs),
-                expected_output=self.tasks_config['research']['expected_output'],
-                agent=self.agents['researcher'],
-                context=[tasks['temporal_context']]
-            )
-            
-            # Create timeline creation task
-            tasks['timeline_creation'] = Task(
-                description=self.tasks_config['timeline_creation']['description'].format(**inputs),
-                expected_output=self.tasks_config['timeline_creation']['expected_output'],
-                agent=self.agents['timeline_agent'],
-                context=[tasks['research']],
-                output_file='timeline.md'
-            )
-            
-            # Create reporting task
-            tasks['reporting'] = Task(
-                description=self.tasks_config['reporting']['description'].format(**inputs),
-                expected_output=self.tasks_config['reporting']['expected_output'],
-                agent=self.agents['reporting_analyst'],
-                context=[tasks['research'], tasks['timeline_creation']],
-                output_file='full_report.md'
-            )
-        except KeyError as e:
-            print(f"Error formatting task description: {e}")
-            print("Using default task descriptions instead")
+            tool = self.get_tool(config['tool']) if direct_tools and config.get('tool') else None
+            if tool is not None:
+                arguments = {key: str(value).format(**inputs) for key, value in (config.get('tool_args') or {}).items()}
+                tasks[name] = ToolTask(tool, arguments, output_file=output_file)
+                continue
             
-            # Create simplified tasks with fixed descriptions if there's an error
-            tasks['query_analysis'] = Task(
-                description=f"Analyze the historical query: '{inputs.get('topic', 'historical topic')}'",
-                expected_output="JSON with query type and key entities",
-                agent=self.agents['query_decipherer']
+            tasks[name] = Task(
+                description=description,
+                expected_output=expected_output,
+                agent=self.get_agent(config['agent']),
+                # The scheduler passes tool-task outputs in as context itself
+                context=[tasks[upstream] for upstream in config.get('depends_on') or []
+                         if not isinstance(tasks[upstream], ToolTask)],
+                output_file=output_file
             )
+        
+        # Not kept on the instance: concurrent kickoffs share it and each needs its own tasks
+        return tasks
+    
+    @staticmethod
+    def _output_path(output_file, output_dir):
+        if output_file and output_dir:
+            return os.path.join(output_dir, output_file)
+        return output_file
+    
+    def _output_files(self, output_dir=None):
+        """Map each task with an output file to the path it writes."""
+        return {
+            name: self._output_path(config['output_file'], output_dir)
+            for name, config in self.tasks_config.items() if config.get('output_file')
+        }
+    
+    def kickoff(self, inputs=None, output_dir=None):
+        """
+        Run the pipeline for the given inputs.
+        Uses the DAG scheduler when every task declares its dependencies in tasks.yaml,
+        otherwise (or when HISTORY_BUFF_SCHEDULER=hierarchical) falls back to the
+        hierarchical crew with a manager LLM.
+        """
+        from src.history_buff.memory import get_memory_tracker
+        from src.history_buff.routing import get_router
+        
+        topic = (inputs or {}).get('topic')
+        # Every model call made for this report draws on one cost/latency budget,
+        # and the pages and buffers it holds on one memory budget
+        with span("kickoff", "run", topic=topic), get_router().request_budget(), \
+                get_memory_tracker().run_budget():
+            return self._kickoff(inputs, output_dir)
+    
+    def _kickoff(self, inputs=None, output_dir=None):
+        mode = os.getenv("HISTORY_BUFF_SCHEDULER", "dag").lower()
+        if mode == "dag" and is_static_graph(self.tasks_config):
+            from src.history_buff.event_store import served_events
+            from src.history_buff.report_store import get_report_store, reuse_enabled
             
-            tasks['temporal_context'] = Task(
-                description=f"Establish historical timeframe for: '{inputs.get('topic', 'historical topic')}'",
-                expected_output="JSON timeline with dates",
-                agent=self.agents['temporal_specialist'],
-                context=[tasks['query_analysis']]
-            )
+            deps = task_dependencies(self.tasks_config)
+            topic = (inputs or {}).get('topic')
+            store = get_report_store() if topic and reuse_enabled() else None
+            match = store.find(topic) if store else None
+            if match and match.action == "reuse" and set(deps) <= set(match.outputs):
+                print(f"Reusing the stored report for '{match.topic}' (similarity {match.similarity})")
+                return self._stored_result(match.outputs, deps, output_dir)
+            precomputed = {name: text for name, text in match.outputs.items() if name in deps} if match else {}
+            if precomputed:
+                print(f"Seeding {', '.join(sorted(precomputed))} from the stored run for '{match.topic}' "
+                      f"(similarity {match.similarity})")
             
-            tasks['research'] = Task(
-                description=f"Research: '{inputs.get('topic', 'historical topic')}'",
-                expected_output="Historical data with sources",
-                agent=self.agents['researcher'],
-                context=[tasks['temporal_context']]
-            )
+            checkpoints = self._checkpoints(inputs)
             
-            tasks['timeline_creation'] = Task(
-                description=f"Create timeline for: '{inputs.get('topic', 'historical topic')}'",
-                expected_output="Markdown timeline",
-                agent=self.agents['timeline_agent'],
-                context=[tasks['research']],
-                output_file='timeline.md'
+            # When streaming, stage output is appended to temp files that are renamed into place at the end
+            tasks = self._create_tasks(inputs, output_dir, write_files=not self.stream, direct_tools=True)
+            streamer = StageStreamer(self._output_files(output_dir)) if self.stream else None
+            scheduler = DagScheduler(
+                max_workers=int(os.getenv("HISTORY_BUFF_MAX_PARALLEL_TASKS", "4")),
+                agent_locks={id(agent): self.agent_locks[name] for name, agent in list(self._agents.items())},
+                compact=self._context_compactor(inputs)
             )
-            
-            tasks['reporting'] = Task(
-                description=f"Create report about: '{inputs.get('topic', 'historical topic')}'",
-                expected_output="Markdown report",
-                agent=self.agents['reporting_analyst'],
-                context=[tasks['research'], tasks['timeline_creation']],
-                output_file='full_report.md'
-            )
-            
-        # Store tasks for use in crew
-        self.tasks = tasks
+            with self._prefetch(topic, precomputed) as prefetch, served_events() as served:
+                result = scheduler.run(tasks, deps, streamer=streamer, precomputed=precomputed,
+                                       checkpoints=checkpoints, on_finish=self._prefetch_hook(prefetch))
+            restored = {name: result.outputs[name] for name in (checkpoints.restored if checkpoints else [])}
+            self._write_outputs({**precomputed, **restored}, output_dir)
+            print(result.summary())
+            outputs = {name: getattr(output, "raw", str(output)) for name, output in result.outputs.items()}
+            if store:
+                store.add(topic, outputs)
+            self._record_events(topic, outputs, served)
+            return result
         
-        return tasks
+        tasks = self._create_tasks(inputs, output_dir)
+        return self.crew(tasks).kickoff(inputs=inputs)
+    
+    def _prefetch(self, topic, precomputed):
+        """Background searches for the research stage (a no-op context when there is nothing to prefetch)."""
+        from src.history_buff.prefetch import CONSUMER_STAGE, get_prefetcher, prefetch_enabled
+        
+        if not topic or CONSUMER_STAGE in precomputed or not prefetch_enabled():
+            return nullcontext()
+        tool = self.get_tool("SerperDevTool")
+        if tool is None:
+            return nullcontext()
+        return get_prefetcher().session(topic, tool.cached_request)
     
-    def crew(self):
-        """Create and return the crew instance."""
-        # Ensure we have tasks created
-        if not self.tasks:
-            self._create_tasks()
+    @staticmethod
+    def _prefetch_hook(session):
+        """Extends the prefetch plan once entities are known and cancels what is left after research."""
+        from src.history_buff.prefetch import CONSUMER_STAGE, PLANNING_STAGE
+        
+        def on_finish(name, output):
+            if session is None:
+                return
+            try:
+                if name == PLANNING_STAGE:
+                    session.plan_from_understanding(output)
+                elif name == CONSUMER_STAGE:
+                    session.cancel_pending()
+            except Exception as e:
+                print(f"Warning: Prefetch update after {name} failed: {str(e)}")
+        return on_finish
+    
+    @staticmethod
+    def _record_events(topic, outputs, served=()):
+        """Add the run's key events and timeline to the event store, leaving out the stored events it was served."""
+        from src.history_buff.event_store import event_store_enabled, get_event_store
+        
+        if not topic or not event_store_enabled():
+            return
+        try:
+            get_event_store().record_run(topic, outputs, served)
+        except Exception as e:
+            print(f"Warning: Could not store the events of this run: {str(e)}")
+    
+    def _checkpoints(self, inputs=None):
+        """Stage checkpoints for these inputs, keyed on each task's config (None when disabled)."""
+        from src.history_buff.cache import make_key
+        from src.history_buff.checkpoints import checkpoints_enabled, get_checkpoint_store
+        
+        if not checkpoints_enabled():
+            return None
+        config_hashes = {
+            name: make_key(config, self.agents_config.get(config.get('agent')))
+            for name, config in self.tasks_config.items()
+        }
+        return get_checkpoint_store().for_run(inputs or {}, config_hashes)
+    
+    def _stored_result(self, outputs, deps, output_dir=None):
+        """A ScheduleResult for a stored run, with its output files written as if the tasks had run."""
+        self._write_outputs(outputs, output_dir)
+        return ScheduleResult({name: outputs[name] for name in deps}, {}, deps, 0.0)
+    
+    def _write_outputs(self, outputs, output_dir=None):
+        """Write the output files of tasks whose outputs did not come from running them."""
+        for name, path in self._output_files(output_dir).items():
+            if name in outputs:
+                write_atomic(path, outputs[name])
+    
+    def _context_compactor(self, inputs=None):
+        """Context builder for the scheduler that applies each task's `context_token_budget`."""
+        from src.history_buff.compaction import get_compactor
+        
+        topic = (inputs or {}).get('topic', '')
+        budgets = {name: config.get('context_token_budget') for name, config in self.tasks_config.items()}
+        
+        def compact(name, upstream):
+            return get_compactor().compact(name, upstream, topic, budgets.get(name), divider=CONTEXT_DIVIDER)
+        return compact
+    
+    def crew(self, tasks=None):
+        """Create and return the crew instance for the given tasks (default-input tasks when None)."""
+        from crewai import Crew, Process
+        from src.history_buff.llm import ThrottledLLM
+        from src.history_buff.routing import get_router
+        
+        if tasks is None:
+            tasks = self._create_tasks()
             
         try:
             # Create the crew with OpenAI
             return Crew(
                 agents=list(self.agents.values()),
-                tasks=list(self.tasks.values()),
+                tasks=list(tasks.values()),
                 process=Process.hierarchical,
                 verbose=True,
-                manager_llm="gpt-3.5-turbo"  # Using OpenAI's GPT-3.5 Turbo
+                manager_llm=ThrottledLLM(tier=get_router().tier_for("manager"), target="manager")
             )
         except Exception as e:
             print(f"Error creating crew: {str(e)}")
@@ -232,6 +386,6 @@ class HistoryBuff:
             print("Attempting to create crew with simplified configuration...")
             return Crew(
                 agents=list(self.agents.values()),
-                tasks=list(self.tasks.values()),
+                tasks=list(tasks.values()),
                 verbose=True
             )
\ No newline at end of file
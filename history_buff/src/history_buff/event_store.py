@@ -0,0 +1,556 @@
+import contextvars
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from contextlib import contextmanager
+
+from src.history_buff.cache import CACHE_DIR, cache_enabled, file_lock
+from src.history_buff.search_cache import STOPWORDS
+from src.history_buff.timeline import MONTH_NAMES, EventDate, format_date, normalize_event
+
+# Persistent store of dated events taken from every run (the query-understanding
+# key events and the timeline bullets), deduplicated across runs with the
+# topics they came from. Events are kept in immutable segments sorted by
+# (start, end); each segment is a few flat binary files that are memory-mapped,
+# with the largest event span and the maximum end year per block of events so
+# a range query only reads the blocks that can overlap it. New events wait in
+# memory until the run ends (or FLUSH_EVENTS pile up) and are written as a new
+# segment; small segments are merged into larger ones as they accumulate.
+# Stored events served into a run's timeline are noted for that run, so they
+# are not recorded again as events the run's own topic found.
+
+EVENT_DIR = os.path.join(CACHE_DIR, "events")
+
+# Stages whose outputs are read for events
+UNDERSTANDING_STAGE = "query_understanding"
+TIMELINE_STAGE = "timeline_creation"
+
+FLUSH_EVENTS = 20000
+BLOCK_SIZE = 64
+
+# start, end, key, month, day, flags, text offset, text length, refs offset, source count, entity count
+EVENT_RECORD = struct.Struct("<iiQBBBxQIQHH")
+BLOCK_RECORD = struct.Struct("<i")        # maximum end year of the block
+REF_SIZE = 4                              # refs.bin: uint32 source ids, then uint32 entity ids
+
+APPROXIMATE, DECADE, CENTURY = 1, 2, 4
+
+NAME = re.compile(r"\b[A-Z][\w'’-]+(?:\s+(?:(?:of|de|von)\s+(?:the\s+)?)?[A-Z][\w'’-]*)*")
+CONNECTOR = re.compile(r"\s+(?:of|de|von)\s+(?:the\s+)?")
+NOT_NAMES = STOPWORDS | {m.lower() for m in MONTH_NAMES} | {"bc", "bce", "ad", "ce", "after", "before", "during", "undated"}
+
+
+def event_store_enabled() -> bool:
+    return cache_enabled("HISTORY_BUFF_EVENT_STORE")
+
+
+_served = contextvars.ContextVar("history_buff_served_events", default=None)
+
+
+@contextmanager
+def served_events():
+    """Keys of the stored events served inside the block (and threads started with its context)."""
+    served = set()
+    token = _served.set(served)
+    try:
+        yield served
+    finally:
+        _served.reset(token)
+
+
+def normalize_entity(name) -> str:
+    name = re.sub(r"\s+", " ", str(name).strip().lower())
+    return name[4:] if name.startswith("the ") else name
+
+
+def text_entities(text: str) -> list:
+    """
+    Capitalized names in an event's text, not months, eras or stopwords. Names
+    joined by "of" also count in parts: "Assassination of Franz Ferdinand"
+    gives "Franz Ferdinand" as well.
+    """
+    names = []
+    for match in NAME.finditer(text):
+        for name in dict.fromkeys([match.group(0)] + CONNECTOR.split(match.group(0))):
+            if not all(word.strip(".") in NOT_NAMES for word in name.lower().split()):
+                names.append(name)
+    return names
+
+
+def event_key(start: int, end: int, text: str) -> int:
+    """Identity of an event: its years and its words, ignoring case and punctuation."""
+    words = " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+    digest = hashlib.blake2b(f"{start}|{end}|{words}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class StoredEvent:
+    """One deduplicated event with the topics it was reported for."""
+
+    __slots__ = ("start", "end", "month", "day", "flags", "text", "sources", "entities", "key")
+
+    def __init__(self, start: int, end: int, text: str, month: int = 0, day: int = 0, flags: int = 0,
+                 sources=(), entities=(), key: int = None):
+        self.start = start
+        self.end = end
+        self.month = month
+        self.day = day
+        self.flags = flags
+        self.text = text
+        self.sources = list(dict.fromkeys(sources))
+        self.entities = list(dict.fromkeys(entities))
+        self.key = event_key(start, end, text) if key is None else key
+
+    @classmethod
+    def from_item(cls, item, sources=(), entities=()):
+        """Build from anything normalize_event accepts; None when it has no usable date or text."""
+        event = normalize_event(item)
+        if event.date is None or not event.title:
+            return None
+        date = event.date
+        text = f"{event.title} — {event.description}" if event.description else event.title
+        flags = (APPROXIMATE if date.approximate else 0) | \
+            {"decade": DECADE, "century": CENTURY}.get(date.kind, 0)
+        return cls(date.start, date.end, text.strip(), date.month, date.day, flags,
+                   sources, list(entities) + text_entities(text))
+
+    @property
+    def sort_key(self) -> tuple:
+        return (self.start, self.end, self.key)
+
+    @property
+    def date(self) -> EventDate:
+        kind = "decade" if self.flags & DECADE else "century" if self.flags & CENTURY else ""
+        return EventDate(self.start, self.end, self.month, self.day, bool(self.flags & APPROXIMATE), kind=kind)
+
+    def merge(self, other: "StoredEvent") -> None:
+        """Take in a duplicate: union of sources and entities, and the more precise month and day."""
+        self.sources = list(dict.fromkeys(self.sources + other.sources))
+        self.entities = list(dict.fromkeys(self.entities + other.entities))
+        if not self.month and other.month:
+            self.month, self.day = other.month, other.day
+
+    def to_item(self) -> dict:
+        """The event as TimelineBuilderTool input."""
+        return {"date": format_date(self.date), "event": self.text}
+
+    def to_dict(self) -> dict:
+        return {"start_year": self.start, "end_year": self.end, "date": format_date(self.date),
+                "event": self.text, "sources": self.sources, "entities": self.entities}
+
+
+class EventSegment:
+    """One immutable, memory-mapped run of events sorted by (start, end, key)."""
+
+    FILES = ("events.idx", "events.bin", "refs.bin", "blocks.idx")
+
+    def __init__(self, directory: str, name: str):
+        self.directory = directory
+        self.name = name
+        self._files = []
+        self._maps = {}
+        for suffix in self.FILES:
+            f = open(os.path.join(directory, f"{name}.{suffix}"), "rb")
+            self._files.append(f)
+            size = os.fstat(f.fileno()).st_size
+            self._maps[suffix] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        with open(os.path.join(directory, f"{name}.meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.sources = meta["sources"]
+        self.entities = meta["entities"]
+        self.max_span = meta["max_span"]
+        self.count = len(self._maps["events.idx"]) // EVENT_RECORD.size
+        self._entity_ids = None
+
+    def close(self) -> None:
+        for m in self._maps.values():
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in self._files:
+            f.close()
+
+    def _record(self, i: int) -> tuple:
+        return EVENT_RECORD.unpack_from(self._maps["events.idx"], i * EVENT_RECORD.size)
+
+    def _refs(self, record: tuple) -> tuple:
+        offset, count = record[8], record[9] + record[10]
+        return struct.unpack_from(f"<{count}I", self._maps["refs.bin"], offset) if count else ()
+
+    def event(self, i: int) -> StoredEvent:
+        record = self._record(i)
+        start, end, key, month, day, flags, text_offset, text_length, _, source_count, _ = record
+        text = bytes(self._maps["events.bin"][text_offset:text_offset + text_length]).decode("utf-8")
+        refs = self._refs(record)
+        return StoredEvent(start, end, text, month, day, flags,
+                           [self.sources[r] for r in refs[:source_count]],
+                           [self.entities[r] for r in refs[source_count:]], key)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.event(i)
+
+    def _bisect(self, target: tuple) -> int:
+        """First index whose (start, end, key) is not below target."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid)[:3] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, event: StoredEvent):
+        """The stored copy of an event, or None."""
+        i = self._bisect(event.sort_key)
+        if i < self.count and self._record(i)[:3] == event.sort_key:
+            return self.event(i)
+        return None
+
+    def entity_ids(self, names: set) -> set:
+        if self._entity_ids is None:
+            self._entity_ids = {normalize_entity(name): i for i, name in enumerate(self.entities)}
+        return {self._entity_ids[name] for name in names if name in self._entity_ids}
+
+    def overlapping(self, start: int = None, end: int = None, entities: set = None):
+        """Events that overlap [start, end] (either side open when None), optionally sharing an entity."""
+        wanted = None
+        if entities is not None:
+            wanted = self.entity_ids(entities)
+            if not wanted:
+                return
+        # An overlapping event starts at most max_span years before the range
+        first = self._bisect((start - self.max_span, -2 ** 31, 0)) if start is not None else 0
+        last = self._bisect((end + 1, -2 ** 31, 0)) if end is not None else self.count
+        i = first
+        while i < last:
+            block = i // BLOCK_SIZE
+            block_end = min(last, (block + 1) * BLOCK_SIZE)
+            if start is not None and BLOCK_RECORD.unpack_from(self._maps["blocks.idx"], block * BLOCK_RECORD.size)[0] < start:
+                i = block_end
+                continue
+            for j in range(i, block_end):
+                record = self._record(j)
+                if start is not None and record[1] < start:
+                    continue
+                if wanted is not None and not wanted.intersection(self._refs(record)[record[9]:]):
+                    continue
+                yield self.event(j)
+            i = block_end
+
+    @classmethod
+    def write(cls, directory: str, name: str, events) -> dict:
+        """Write events, already in (start, end, key) order, as a new segment; return its manifest entry."""
+        sources, source_ids = [], {}
+        entities, entity_ids = [], {}
+        count = max_span = 0
+        block_end = None
+        with open(os.path.join(directory, f"{name}.events.idx"), "wb") as index, \
+                open(os.path.join(directory, f"{name}.events.bin"), "wb") as texts, \
+                open(os.path.join(directory, f"{name}.refs.bin"), "wb") as refs, \
+                open(os.path.join(directory, f"{name}.blocks.idx"), "wb") as blocks:
+            text_offset = refs_offset = 0
+            for event in events:
+                ids = []
+                for table, lookup, values in ((sources, source_ids, event.sources[:0xFFFF]),
+                                              (entities, entity_ids, event.entities[:0xFFFF])):
+                    for value in values:
+                        if value not in lookup:
+                            lookup[value] = len(table)
+                            table.append(value)
+                        ids.append(lookup[value])
+                data = event.text.encode("utf-8")
+                texts.write(data)
+                refs.write(struct.pack(f"<{len(ids)}I", *ids))
+                index.write(EVENT_RECORD.pack(
+                    event.start, event.end, event.key, event.month, event.day, event.flags,
+                    text_offset, len(data), refs_offset, min(len(event.sources), 0xFFFF), min(len(event.entities), 0xFFFF)
+                ))
+                text_offset += len(data)
+                refs_offset += len(ids) * REF_SIZE
+                max_span = max(max_span, event.end - event.start)
+                block_end = event.end if block_end is None else max(block_end, event.end)
+                count += 1
+                if count % BLOCK_SIZE == 0:
+                    blocks.write(BLOCK_RECORD.pack(block_end))
+                    block_end = None
+            if block_end is not None:
+                blocks.write(BLOCK_RECORD.pack(block_end))
+
+        with open(os.path.join(directory, f"{name}.meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"sources": sources, "entities": entities, "max_span": max_span}, f)
+        return {"name": name, "count": count}
+
+
+def merge_sorted(streams):
+    """Merge (start, end, key)-ordered event streams, folding duplicates into one event."""
+    current = None
+    for event in heapq.merge(*streams, key=lambda e: e.sort_key):
+        if current is not None and current.key == event.key and current.sort_key == event.sort_key:
+            current.merge(event)
+            continue
+        if current is not None:
+            yield current
+        current = event
+    if current is not None:
+        yield current
+
+
+class EventStore:
+    """
+    Deduplicated events from every run, queried by year range and entity.
+    Memory use is bounded by FLUSH_EVENTS pending events plus the source and
+    entity tables of the open segments; the events themselves stay on disk.
+    """
+
+    def __init__(self, directory: str = EVENT_DIR):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._writing = 0
+        self._manifest_version = None
+        self.segments = []
+        self.manifest = {"segments": [], "next_segment": 0}
+        self.pending = {}
+        self.counters = {"added": 0, "duplicates": 0, "queries": 0, "served": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, "manifest.json")
+
+    def _load(self) -> None:
+        try:
+            stat = os.stat(self._manifest_path)
+        except FileNotFoundError:
+            stat = None
+        version = (stat.st_mtime_ns, stat.st_size) if stat else None
+        if version is not None and version == self._manifest_version:
+            return
+        if stat is not None:
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        self._manifest_version = version
+        self._open_segments()
+
+    @contextmanager
+    def _write_lock(self):
+        """
+        Serialize segment writes across threads and processes sharing the cache
+        directory. The manifest is reloaded once the lock is held, so segment
+        names continue from the latest one and no other process's segment is lost.
+        """
+        with self._lock:
+            if self._writing:
+                self._writing += 1
+                try:
+                    yield
+                finally:
+                    self._writing -= 1
+                return
+            with file_lock(os.path.join(self.directory, "manifest.lock")):
+                self._writing = 1
+                try:
+                    self._load()
+                    yield
+                finally:
+                    self._writing = 0
+
+    def _open_segments(self) -> None:
+        for segment in self.segments:
+            segment.close()
+        self.segments = [EventSegment(self.directory, s["name"]) for s in self.manifest["segments"]]
+
+    def _save_manifest(self) -> None:
+        tmp_path = f"{self._manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+        stat = os.stat(self._manifest_path)
+        self._manifest_version = (stat.st_mtime_ns, stat.st_size)
+
+    def __len__(self) -> int:
+        """Stored events, counting an event once per segment it is in until segments are merged."""
+        return sum(s["count"] for s in self.manifest["segments"]) + len(self.pending)
+
+    def add(self, items: list, source: str, entities=()) -> int:
+        """Add events (strings or dicts, as TimelineBuilderTool takes them) reported for `source`; returns how many were new."""
+        added = 0
+        with self._lock:
+            for item in items:
+                event = StoredEvent.from_item(item, [source], entities)
+                if event is None:
+                    continue
+                if event.key in self.pending:
+                    self.pending[event.key].merge(event)
+                    continue
+                if any(self._known(segment.find(event), event) for segment in self.segments):
+                    self.counters["duplicates"] += 1
+                    continue
+                self.pending[event.key] = event
+                added += 1
+            self.counters["added"] += added
+            if len(self.pending) >= FLUSH_EVENTS:
+                self.flush()
+        return added
+
+    @staticmethod
+    def _known(stored, event: StoredEvent) -> bool:
+        # Already stored with this source and these entities, so there is nothing to add
+        return stored is not None and set(event.sources) <= set(stored.sources) \
+            and set(event.entities) <= set(stored.entities)
+
+    def record_run(self, topic: str, outputs: dict, served=()) -> int:
+        """
+        Store the key events of a run's query understanding and the bullets of
+        its timeline. Timeline bullets whose keys are in `served` came from
+        the store itself and are skipped, so they do not gain `topic` as a source.
+        """
+        from src.history_buff.query_understanding import repair_json
+
+        added = 0
+        entities = []
+        understanding = outputs.get(UNDERSTANDING_STAGE)
+        if understanding:
+            try:
+                data = repair_json(understanding)
+            except ValueError:
+                data = None
+            if isinstance(data, dict) and not data.get("error"):
+                entities = [e for e in data.get("entities") or [] if isinstance(e, str)]
+                items = list(data.get("key_events") or [])
+                if isinstance(data.get("start_year"), int) and isinstance(data.get("end_year"), int):
+                    items.append({"event": topic, "start_year": data["start_year"], "end_year": data["end_year"]})
+                added += self.add(items, topic, entities)
+        timeline = outputs.get(TIMELINE_STAGE)
+        if timeline:
+            bullets = [re.sub(r"\*\*", "", line.strip()[2:]) for line in str(timeline).splitlines()
+                       if line.strip().startswith(("- ", "* "))]
+            if served:
+                bullets = [b for b in bullets if getattr(StoredEvent.from_item(b), "key", None) not in served]
+            added += self.add(bullets, topic, entities)
+        self.flush()
+        return added
+
+    def flush(self) -> None:
+        """Write pending events as a new segment and merge the newest segments while they are of similar size."""
+        with self._lock:
+            if not self.pending:
+                return
+        with self._write_lock():
+            if not self.pending:
+                return
+            events = sorted(self.pending.values(), key=lambda e: e.sort_key)
+            self.pending = {}
+            self.manifest["segments"].append(EventSegment.write(self.directory, self._next_name(), events))
+            segments = self.manifest["segments"]
+            merge = 1
+            while merge < len(segments) and segments[-merge - 1]["count"] <= 2 * sum(
+                    s["count"] for s in segments[-merge:]):
+                merge += 1
+            self._save_manifest()
+            self._open_segments()
+            if merge > 1:
+                self._merge(len(segments) - merge)
+
+    def compact(self) -> None:
+        """Merge every segment into one, folding duplicates together."""
+        with self._write_lock():
+            self.flush()
+            if len(self.segments) > 1:
+                self._merge(0)
+
+    def _next_name(self) -> str:
+        # Called under _write_lock, so next_segment is the latest of every process
+        name = f"seg{self.manifest['next_segment']:05d}"
+        self.manifest["next_segment"] += 1
+        return name
+
+    def _merge(self, first: int) -> None:
+        old = self.manifest["segments"][first:]
+        entry = EventSegment.write(self.directory, self._next_name(), merge_sorted(self.segments[first:]))
+        self.manifest["segments"] = self.manifest["segments"][:first] + [entry]
+        self._save_manifest()
+        self._open_segments()
+        for segment in old:
+            for suffix in EventSegment.FILES + ("meta.json",):
+                try:
+                    os.remove(os.path.join(self.directory, f"{segment['name']}.{suffix}"))
+                except OSError:
+                    pass
+
+    def query(self, start: int = None, end: int = None, entities: list = None, limit: int = None) -> list:
+        """
+        Events overlapping the years [start, end] in chronological order, with
+        duplicates across segments merged. With `entities`, only events linked
+        to at least one of them (by name, case-insensitive).
+        """
+        names = {normalize_entity(e) for e in entities} if entities else None
+        events = []
+        with self._lock:
+            # Segments are already in (start, end) order, so their streams are merged
+            # lazily and only the events up to `limit` are read. Pending events come
+            # last, so a duplicate is merged into the segment copy and not into them.
+            streams = [segment.overlapping(start, end, names) for segment in self.segments]
+            streams.append(sorted((e for e in self.pending.values()
+                                   if (start is None or e.end >= start) and (end is None or e.start <= end)
+                                   and (names is None or names & {normalize_entity(n) for n in e.entities})),
+                                  key=lambda e: e.sort_key))
+            year = []
+            for event in merge_sorted(streams):
+                if year and event.start != year[0].start:
+                    events.extend(sorted(year, key=lambda e: (e.month, e.day, e.end)))
+                    year = []
+                    if limit and len(events) >= limit:
+                        break
+                year.append(event)
+            else:
+                events.extend(sorted(year, key=lambda e: (e.month, e.day, e.end)))
+            self.counters["queries"] += 1
+        return events[:limit] if limit else events
+
+    def related(self, items: list, entities: list = None, limit: int = 15) -> list:
+        """
+        Stored events for a timeline: in the years the given events cover, sharing
+        their entities (or `entities`), and not already among them. Events sharing
+        more entities and reported for more topics come first.
+        """
+        given = [e for e in (StoredEvent.from_item(item) for item in items) if e is not None]
+        if not given:
+            return []
+        names = {normalize_entity(n) for n in (entities or [n for e in given for n in e.entities])}
+        if not names:
+            return []
+        known = {e.key for e in given}
+        candidates = [e for e in self.query(min(e.start for e in given), max(e.end for e in given), list(names))
+                      if e.key not in known]
+        candidates.sort(key=lambda e: (-len(names & {normalize_entity(n) for n in e.entities}), -len(e.sources)))
+        chosen = candidates[:limit]
+        served = _served.get()
+        if served is not None:
+            served.update(e.key for e in chosen)
+        with self._lock:
+            self.counters["served"] += len(chosen)
+        return chosen
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "events": len(self), "segments": len(self.segments)}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_event_store() -> EventStore:
+    """Return the process-wide event store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EventStore()
+    return _store
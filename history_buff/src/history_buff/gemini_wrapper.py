@@ -2,6 +2,9 @@ from dotenv import load_dotenv
 import os
 import google.generativeai as genai
 
+from src.history_buff.cache import cached_generate
+from src.history_buff.instrumentation import traced
+
 # Load environment variables
 load_dotenv()
 
@@ -37,14 +40,20 @@ class GeminiLLM:
         self._model = genai.GenerativeModel(model_name=model_name)
         print(f"Initialized GeminiLLM wrapper for custom tools with model: {model_name}")
     
-    def complete(self, prompt: str) -> str:
-        """Simple completion method for custom tools."""
+    @traced("tool", "GeminiLLM.complete")
+    def complete(self, prompt: str, use_cache: bool = True, on_chunk=None) -> str:
+        """
+        Simple completion method for custom tools (served from the shared LLM cache).
+        Pass on_chunk to receive the response piece by piece as it is generated.
+        """
         try:
-            response = self._model.generate_content(
-                contents=prompt,
-                generation_config={"temperature": self.temperature}
+            return cached_generate(
+                self._model,
+                prompt,
+                generation_config={"temperature": self.temperature},
+                bypass=not use_cache,
+                on_chunk=on_chunk
             )
-            return response.text
         except Exception as e:
             print(f"Error in GeminiLLM complete: {str(e)}")
             return f"Error: {str(e)}"
\ No newline at end of file
@@ -0,0 +1,295 @@
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+# Spans for every task, agent step, tool call and outbound request. Spans nest
+# per thread; each carries wall time plus whatever attributes its call site
+# knows: prompt/completion tokens, estimated cost, bytes, cache hits.
+# Finished spans can be written as a Chrome trace (chrome://tracing, Perfetto)
+# or as Prometheus text, and summarized as a table at the end of a run.
+
+MAX_SPANS = 100000
+MAX_DURATIONS_PER_KEY = 2000
+
+# Attributes that are summed in the per-(kind, name) aggregates
+SUMMED_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "cost_usd", "bytes", "cache_hit", "retries")
+
+KINDS = ("run", "task", "agent_step", "tool", "request")
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100.0 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class Span:
+    def __init__(self, name: str, kind: str, parent=None, **attributes):
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.attributes = dict(attributes)
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start)
+
+    def set(self, **attributes) -> "Span":
+        self.attributes.update(attributes)
+        return self
+
+    def add(self, **amounts) -> "Span":
+        """Add to numeric attributes (e.g. bytes read in several pieces)."""
+        for key, value in amounts.items():
+            self.attributes[key] = self.attributes.get(key, 0) + value
+        return self
+
+
+class _NullSpan:
+    """Returned by current_span() outside any span, so call sites never need to check."""
+
+    def set(self, **attributes):
+        return self
+
+    def add(self, **amounts):
+        return self
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """Collects finished spans and keeps running aggregates per (kind, name)."""
+
+    def __init__(self, max_spans: int = MAX_SPANS):
+        self.max_spans = max_spans
+        self.spans = []
+        self.dropped = 0
+        self.aggregates = {}
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self):
+        stack = self._stack()
+        return stack[-1] if stack else _NULL_SPAN
+
+    def span(self, name: str, kind: str, **attributes):
+        return _SpanContext(self, name, kind, attributes)
+
+    def _finish(self, span: Span) -> None:
+        span.end = time.perf_counter()
+        key = (span.kind, span.name)
+        with self._lock:
+            if len(self.spans) < self.max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+            aggregate = self.aggregates.get(key)
+            if aggregate is None:
+                aggregate = self.aggregates[key] = {"count": 0, "errors": 0, "seconds": 0.0, "durations": [],
+                                                    **{attr: 0 for attr in SUMMED_ATTRIBUTES}}
+            aggregate["count"] += 1
+            aggregate["seconds"] += span.duration
+            if span.error:
+                aggregate["errors"] += 1
+            durations = aggregate["durations"]
+            durations.append(span.duration)
+            if len(durations) > MAX_DURATIONS_PER_KEY:
+                del durations[:len(durations) - MAX_DURATIONS_PER_KEY]
+            for attr in SUMMED_ATTRIBUTES:
+                value = span.attributes.get(attr)
+                if value:
+                    aggregate[attr] += value
+
+    def reset(self) -> None:
+        with self._lock:
+            self.spans = []
+            self.dropped = 0
+            self.aggregates = {}
+            self.origin = time.perf_counter()
+
+    def chrome_trace(self) -> dict:
+        """Finished spans as Chrome trace "complete" events (microseconds since the tracer started)."""
+        with self._lock:
+            spans = list(self.spans)
+        events = []
+        for span in spans:
+            args = {k: v for k, v in span.attributes.items() if v is not None}
+            if span.error:
+                args["error"] = span.error
+            events.append({
+                "name": span.name,
+                "cat": span.kind,
+                "ph": "X",
+                "ts": round((span.start - self.origin) * 1e6, 1),
+                "dur": round(span.duration * 1e6, 1),
+                "pid": os.getpid(),
+                "tid": span.thread,
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"dropped_spans": self.dropped}}
+
+    def write_chrome_trace(self, path: str) -> None:
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+        os.replace(tmp_path, path)
+
+    def prometheus_text(self) -> str:
+        """Aggregates in the Prometheus text exposition format."""
+        metrics = [
+            ("history_buff_spans_total", "counter", "Completed spans", "count"),
+            ("history_buff_span_errors_total", "counter", "Spans that ended with an exception", "errors"),
+            ("history_buff_span_seconds_total", "counter", "Wall time spent in spans", "seconds"),
+            ("history_buff_prompt_tokens_total", "counter", "Estimated prompt tokens", "prompt_tokens"),
+            ("history_buff_completion_tokens_total", "counter", "Estimated completion tokens", "completion_tokens"),
+            ("history_buff_cost_usd_total", "counter", "Estimated cost in US dollars", "cost_usd"),
+            ("history_buff_bytes_total", "counter", "Bytes transferred", "bytes"),
+            ("history_buff_cache_hits_total", "counter", "Calls served from a cache", "cache_hit"),
+            ("history_buff_retries_total", "counter", "Transport-level retries", "retries"),
+        ]
+        with self._lock:
+            aggregates = {key: dict(value, durations=list(value["durations"]))
+                          for key, value in self.aggregates.items()}
+        lines = []
+        for metric, metric_type, help_text, field in metrics:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            for (kind, name), aggregate in sorted(aggregates.items()):
+                lines.append(f'{metric}{{kind="{kind}",name="{_escape(name)}"}} {_number(aggregate[field])}')
+        lines.append("# HELP history_buff_span_seconds Span wall time quantiles over recent spans")
+        lines.append("# TYPE history_buff_span_seconds summary")
+        for (kind, name), aggregate in sorted(aggregates.items()):
+            labels = f'kind="{kind}",name="{_escape(name)}"'
+            for quantile in (50, 95):
+                value = percentile(aggregate["durations"], quantile)
+                lines.append(f'history_buff_span_seconds{{{labels},quantile="{quantile / 100}"}} {_number(value)}')
+            lines.append(f"history_buff_span_seconds_sum{{{labels}}} {_number(aggregate['seconds'])}")
+            lines.append(f"history_buff_span_seconds_count{{{labels}}} {aggregate['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def summary_table(self) -> str:
+        """One row per (kind, name): calls, total and percentile wall time, tokens, cost, bytes, cache hits."""
+        with self._lock:
+            rows = sorted(self.aggregates.items(), key=lambda item: (KINDS.index(item[0][0])
+                                                                     if item[0][0] in KINDS else len(KINDS),
+                                                                     -item[1]["seconds"]))
+        header = (f"{'kind':<11}{'name':<30}{'calls':>6}{'total s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+                  f"{'tok in':>9}{'tok out':>9}{'cost $':>9}{'KB':>9}{'hits':>6}")
+        lines = [header, "-" * len(header)]
+        totals = {attr: 0 for attr in SUMMED_ATTRIBUTES}
+        for (kind, name), a in rows:
+            lines.append(
+                f"{kind:<11}{name[:29]:<30}{a['count']:>6}{a['seconds']:>9.2f}"
+                f"{percentile(a['durations'], 50) * 1000:>9.0f}{percentile(a['durations'], 95) * 1000:>9.0f}"
+                f"{a['prompt_tokens']:>9}{a['completion_tokens']:>9}{a['cost_usd']:>9.4f}"
+                f"{a['bytes'] / 1024:>9.1f}{a['cache_hit']:>6}"
+            )
+            # Requests and agent steps are the leaves that actually cost money
+            if kind in ("request", "agent_step"):
+                for attr in SUMMED_ATTRIBUTES:
+                    totals[attr] += a[attr]
+        lines.append("-" * len(header))
+        lines.append(f"Estimated cost: ${totals['cost_usd']:.4f}, tokens in/out: "
+                     f"{totals['prompt_tokens']}/{totals['completion_tokens']}, "
+                     f"{totals['bytes'] / 1024:.1f} KB transferred, {totals['cache_hit']} cache hits")
+        return "\n".join(lines)
+
+
+class _SpanContext:
+    def __init__(self, tracer: Tracer, name: str, kind: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.span = None
+
+    def __enter__(self) -> Span:
+        stack = self.tracer._stack()
+        self.span = Span(self.name, self.kind, parent=stack[-1] if stack else None, **self.attributes)
+        stack.append(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        stack = self.tracer._stack()
+        if stack and stack[-1] is self.span:
+            stack.pop()
+        if exc is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        self.tracer._finish(self.span)
+        return False
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _number(value) -> str:
+    return f"{value:.6g}" if isinstance(value, float) else str(value)
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """Return the process-wide tracer."""
+    return _tracer
+
+
+def span(name: str, kind: str, **attributes):
+    """Context manager recording a span on the process-wide tracer."""
+    return _tracer.span(name, kind, **attributes)
+
+
+def current_span():
+    """The innermost open span on this thread (a no-op span if there is none)."""
+    return _tracer.current()
+
+
+def traced(kind: str, name: str = None):
+    """Decorator for methods: record a span named after the object's `name` (tools) or the method."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with span(name or getattr(self, "name", None) or fn.__qualname__, kind):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export_from_env() -> None:
+    """Write the trace / metrics files named by HISTORY_BUFF_TRACE_FILE / HISTORY_BUFF_METRICS_FILE."""
+    trace_path = os.getenv("HISTORY_BUFF_TRACE_FILE")
+    if trace_path:
+        _tracer.write_chrome_trace(trace_path)
+        print(f"Trace written to {trace_path}")
+    metrics_path = os.getenv("HISTORY_BUFF_METRICS_FILE")
+    if metrics_path:
+        _tracer.write_prometheus(metrics_path)
+        print(f"Metrics written to {metrics_path}")
@@ -0,0 +1,217 @@
+import json
+import math
+import os
+import random
+import re
+import threading
+import zlib
+
+from src.history_buff.cache import CACHE_DIR
+
+# Local intent labels for QueryUnderstandingTool: a rule set plus a small linear
+# model over hashed word n-grams. Gemini is still called for entities and years;
+# confident local labels replace its labels, and are used alone when it fails.
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+MODEL_PATH = os.path.join(MODEL_DIR, "intent_model.json")
+SEED_PATH = os.path.join(MODEL_DIR, "intent_seed.jsonl")
+LABEL_LOG_PATH = os.path.join(CACHE_DIR, "intent_labels.jsonl")
+
+NUM_FEATURES = 2 ** 14
+CONFIDENCE_THRESHOLD = float(os.getenv("HISTORY_BUFF_INTENT_THRESHOLD", "0.8"))
+
+# Label pairs for the two heads: (label when the score is positive, label when negative)
+HEADS = {
+    "type": ("hypothetical", "factual"),
+    "intent": ("academic", "casual"),
+}
+
+# (head, label, pattern): an unambiguous phrase settles that head on its own
+RULES = [
+    ("type", "hypothetical", r"\bwhat if\b|\bwhat would\b|\bwould (?:have|history)\b|\bhad .{1,40} not\b|"
+                             r"\bif .{1,60} (?:had|hadn't|never|won|lost)\b|\bimagine\b|\bsuppose\b|"
+                             r"\balternate history\b|\bcounterfactual\b|\bcould have\b"),
+    ("type", "factual", r"\btimeline of\b|\bcauses? of\b|\bwhen did\b|\bwhen was\b|\bwho (?:was|were|led)\b|"
+                        r"\bhistory of\b|\bwhat happened\b|\bwhy did\b|\bconsequences of\b|\boverview of\b"),
+    ("intent", "academic", r"\bhistoriograph\w*|\banaly[sz]e\b|\bevaluate\b|\bassess\b|\bsignificance\b|"
+                           r"\bsocio-?economic\b|\bprimary sources?\b|\bscholar\w*|\bcritically\b|"
+                           r"\bcompare and contrast\b|\bthesis\b|\bdiscuss\b"),
+    ("intent", "casual", r"\bfun facts?\b|\btell me\b|\bquick\b|\bin a nutshell\b|\bcool\b|\bwhat's the deal\b|"
+                         r"\beli5\b|\bexplain like\b|\bjust curious\b|\bbriefly\b|\blol\b"),
+]
+_COMPILED_RULES = [(head, label, re.compile(pattern, re.I)) for head, label, pattern in RULES]
+RULE_CONFIDENCE = 0.97
+
+
+def features(query: str) -> list:
+    """Hashed word unigrams and bigrams plus a bias feature."""
+    words = re.findall(r"[a-z0-9']+", query.lower())
+    grams = ["__bias__"] + words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    return sorted({zlib.crc32(g.encode("utf-8")) % NUM_FEATURES for g in grams})
+
+
+def _sigmoid(x: float) -> float:
+    if x < -30:
+        return 0.0
+    if x > 30:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+class IntentModel:
+    """Two logistic-regression heads (type, intent) with sparse hashed weights."""
+
+    def __init__(self, weights: dict = None):
+        self.weights = weights or {head: {} for head in HEADS}
+
+    @classmethod
+    def load(cls, path: str = MODEL_PATH):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: Could not load intent model from {path}: {str(e)}")
+            return cls()
+        return cls({head: {int(k): v for k, v in data.get(head, {}).items()} for head in HEADS})
+
+    def save(self, path: str = MODEL_PATH) -> None:
+        data = {head: {str(k): round(v, 5) for k, v in sorted(w.items()) if abs(v) > 1e-4}
+                for head, w in self.weights.items()}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+
+    def probability(self, head: str, feats: list) -> float:
+        """Probability of the head's positive label."""
+        weights = self.weights.get(head, {})
+        return _sigmoid(sum(weights.get(i, 0.0) for i in feats))
+
+    def train(self, examples: list, epochs: int = 30, learning_rate: float = 0.5, l2: float = 1e-4,
+              seed: int = 13) -> None:
+        """Fit both heads with SGD on (query, {"type": ..., "intent": ...}) examples."""
+        rng = random.Random(seed)
+        data = [(features(query), labels) for query, labels in examples]
+        for head, (positive, negative) in HEADS.items():
+            weights = {}
+            rows = [(feats, 1.0 if labels[head] == positive else 0.0)
+                    for feats, labels in data if labels.get(head) in (positive, negative)]
+            for epoch in range(epochs):
+                rng.shuffle(rows)
+                rate = learning_rate / (1 + epoch * 0.1)
+                for feats, target in rows:
+                    error = target - _sigmoid(sum(weights.get(i, 0.0) for i in feats))
+                    for i in feats:
+                        w = weights.get(i, 0.0)
+                        weights[i] = w + rate * (error - l2 * w)
+            self.weights[head] = weights
+
+
+class IntentClassifier:
+    """Rules first, then the linear model; reports a confidence with every answer."""
+
+    def __init__(self, model: IntentModel = None, threshold: float = CONFIDENCE_THRESHOLD):
+        self.model = model or IntentModel.load()
+        self.threshold = threshold
+        self.local_answers = 0
+        self.gemini_answers = 0
+        self._lock = threading.Lock()
+
+    def classify(self, query: str) -> dict:
+        """Return {"type", "intent", "confidence", "source"} without any network call."""
+        feats = features(query)
+        result = {"source": "model"}
+        confidences = []
+        for head, (positive, negative) in HEADS.items():
+            rule_label = next((label for h, label, pattern in _COMPILED_RULES
+                               if h == head and pattern.search(query)), None)
+            if rule_label:
+                result[head] = rule_label
+                confidences.append(RULE_CONFIDENCE)
+                result["source"] = "rules"
+                continue
+            p = self.model.probability(head, feats)
+            result[head] = positive if p >= 0.5 else negative
+            confidences.append(max(p, 1.0 - p))
+        result["confidence"] = round(min(confidences), 3)
+        return result
+
+    def is_confident(self, result: dict) -> bool:
+        return result["confidence"] >= self.threshold
+
+    def record(self, local: bool) -> None:
+        with self._lock:
+            if local:
+                self.local_answers += 1
+            else:
+                self.gemini_answers += 1
+
+    def stats(self) -> dict:
+        """How many queries took the local path and how many went to Gemini."""
+        total = self.local_answers + self.gemini_answers
+        return {
+            "local": self.local_answers,
+            "gemini": self.gemini_answers,
+            "local_rate": round(self.local_answers / total, 3) if total else 0.0,
+        }
+
+
+def log_label(query: str, labels: dict, path: str = LABEL_LOG_PATH) -> None:
+    """Append a Gemini-provided label so the local model can be retrained on it later."""
+    if labels.get("type") not in HEADS["type"] or labels.get("intent") not in HEADS["intent"]:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"query": query, "type": labels["type"], "intent": labels["intent"]}) + "\n")
+
+
+def read_examples(path: str) -> list:
+    """Read (query, labels) pairs from a JSONL file of {"query", "type", "intent"} records."""
+    examples = []
+    if not os.path.exists(path):
+        return examples
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("query"):
+                examples.append((record["query"], {"type": record.get("type"), "intent": record.get("intent")}))
+    return examples
+
+
+def retrain(log_path: str = LABEL_LOG_PATH, model_path: str = MODEL_PATH, include_seed: bool = True) -> dict:
+    """Retrain the shipped model from the seed set plus logged Gemini labels."""
+    examples = read_examples(SEED_PATH) if include_seed else []
+    logged = read_examples(log_path)
+    examples.extend(logged)
+    model = IntentModel()
+    model.train(examples)
+    model.save(model_path)
+    classifier = IntentClassifier(model, threshold=0.0)
+    correct = sum(
+        1 for query, labels in examples
+        if all(classifier.classify(query)[head] == labels.get(head) for head in HEADS)
+    )
+    return {
+        "examples": len(examples),
+        "logged_examples": len(logged),
+        "training_accuracy": round(correct / len(examples), 3) if examples else 0.0,
+        "model_path": model_path,
+    }
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_intent_classifier() -> IntentClassifier:
+    """Return the process-wide local intent classifier."""
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            _classifier = IntentClassifier()
+    return _classifier
@@ -0,0 +1,513 @@
+import bisect
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import struct
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+
+from src.history_buff.cache import CACHE_DIR, file_lock
+from src.history_buff.search_cache import STOPWORDS
+
+# Local full-text index over the knowledge/ directory and cached scraped pages.
+# The index is a list of immutable segments; each segment is a handful of flat
+# binary files that are memory-mapped, so opening the index reads no postings.
+
+INDEX_DIR = os.path.join(CACHE_DIR, "knowledge_index")
+KNOWLEDGE_DIR = os.getenv("HISTORY_BUFF_KNOWLEDGE_DIR", os.path.join(os.getcwd(), "knowledge"))
+SUPPORTED_EXTENSIONS = (".txt", ".md", ".jsonl")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Passage sizing when splitting documents
+MIN_PASSAGE_CHARS = 400
+MAX_PASSAGE_CHARS = 1200
+
+# Merge everything into one segment once there are this many
+MAX_SEGMENTS = 8
+
+TERM_RECORD = struct.Struct("<QIQI")      # term offset, term length, postings offset, document frequency
+POSTING_RECORD = struct.Struct("<II")     # local passage id, term frequency
+PASSAGE_RECORD = struct.Struct("<QIII")   # text offset, text length, passage length in tokens, source index
+# The same records as numpy dtypes, to score postings straight from the mapped files
+POSTING_DTYPE = np.dtype([("id", "<u4"), ("tf", "<u4")])
+PASSAGE_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("tokens", "<u4"), ("source", "<u4")])
+
+
+def tokenize(text: str) -> list:
+    """Lowercased word tokens without stopwords."""
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def split_passages(text: str) -> list:
+    """Split a document into passages of roughly MIN..MAX_PASSAGE_CHARS characters on paragraph boundaries."""
+    return split_paragraphs(re.split(r"\n\s*\n", text))
+
+
+def split_paragraphs(paragraphs) -> list:
+    """Group paragraphs into passages of roughly MIN..MAX_PASSAGE_CHARS characters."""
+    passages = []
+    current = ""
+    for paragraph in paragraphs:
+        paragraph = re.sub(r"\s+", " ", paragraph).strip()
+        if not paragraph:
+            continue
+        # Very long paragraphs are cut on sentence boundaries
+        while len(paragraph) > MAX_PASSAGE_CHARS:
+            cut = paragraph.rfind(". ", 0, MAX_PASSAGE_CHARS)
+            cut = cut + 1 if cut > MIN_PASSAGE_CHARS else MAX_PASSAGE_CHARS
+            if current:
+                passages.append(current)
+                current = ""
+            passages.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        current = f"{current} {paragraph}".strip() if current else paragraph
+        if len(current) >= MIN_PASSAGE_CHARS:
+            passages.append(current)
+            current = ""
+    if current:
+        passages.append(current)
+    return passages
+
+
+def read_document(path: str) -> list:
+    """Return the passages of a txt/md/jsonl file."""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        if not path.endswith(".jsonl"):
+            return split_passages(f.read())
+        passages = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, str):
+                passages.extend(split_passages(record))
+                continue
+            text = record.get("text") or record.get("content") or record.get("body") or ""
+            title = record.get("title")
+            passages.extend(f"{title}: {p}" if title else p for p in split_passages(text))
+        return passages
+
+
+class Segment:
+    """One immutable, memory-mapped chunk of the index."""
+
+    FILES = ("terms.bin", "terms.idx", "postings.bin", "passages.bin", "passages.idx")
+
+    def __init__(self, directory: str, name: str, base_id: int):
+        self.directory = directory
+        self.name = name
+        self.base_id = base_id
+        self._files = []
+        self._maps = {}
+        for suffix in self.FILES:
+            path = os.path.join(directory, f"{name}.{suffix}")
+            f = open(path, "rb")
+            self._files.append(f)
+            size = os.fstat(f.fileno()).st_size
+            self._maps[suffix] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        with open(os.path.join(directory, f"{name}.sources.json"), "r", encoding="utf-8") as f:
+            self.sources = json.load(f)
+        self.num_terms = len(self._maps["terms.idx"]) // TERM_RECORD.size
+        self.count = len(self._maps["passages.idx"]) // PASSAGE_RECORD.size
+        # Passage lengths in tokens, a view over passages.idx (nothing is copied)
+        self.lengths = np.frombuffer(self._maps["passages.idx"], dtype=PASSAGE_DTYPE)["tokens"] \
+            if self.count else np.zeros(0, dtype="<u4")
+
+    def close(self) -> None:
+        # Views into the maps must go before the maps can be closed
+        self.lengths = None
+        for m in self._maps.values():
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in self._files:
+            f.close()
+
+    def _term_at(self, i: int) -> tuple:
+        record = TERM_RECORD.unpack_from(self._maps["terms.idx"], i * TERM_RECORD.size)
+        term = self._maps["terms.bin"][record[0]:record[0] + record[1]]
+        return term, record
+
+    def _find(self, term: str):
+        """Binary-search the term dictionary for the term's record."""
+        key = term.encode("utf-8")
+        lo, hi = 0, self.num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found, record = self._term_at(mid)
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return record
+        return None
+
+    def postings(self, term: str) -> list:
+        """Return [(local id, tf)] for a term."""
+        return [tuple(int(v) for v in entry) for entry in self.posting_array(term)]
+
+    def posting_array(self, term: str):
+        """The term's postings as a numpy record array mapped over postings.bin (fields id, tf)."""
+        record = self._find(term)
+        if record is None:
+            return np.zeros(0, dtype=POSTING_DTYPE)
+        return np.frombuffer(self._maps["postings.bin"], dtype=POSTING_DTYPE, count=record[3], offset=record[2])
+
+    def document_frequency(self, term: str) -> int:
+        record = self._find(term)
+        return record[3] if record else 0
+
+    def passage(self, local_id: int) -> tuple:
+        """Return (text, length in tokens, source)."""
+        offset, length, tokens, source = PASSAGE_RECORD.unpack_from(
+            self._maps["passages.idx"], local_id * PASSAGE_RECORD.size
+        )
+        text = bytes(self._maps["passages.bin"][offset:offset + length]).decode("utf-8")
+        return text, tokens, self.sources[source]
+
+    def doc_length(self, local_id: int) -> int:
+        return PASSAGE_RECORD.unpack_from(self._maps["passages.idx"], local_id * PASSAGE_RECORD.size)[2]
+
+    @classmethod
+    def write(cls, directory: str, name: str, passages: list) -> int:
+        """Write [(source, text)] as a new segment; return the total length in tokens."""
+        sources = []
+        source_ids = {}
+        inverted = {}
+        total_tokens = 0
+        with open(os.path.join(directory, f"{name}.passages.bin"), "wb") as texts, \
+                open(os.path.join(directory, f"{name}.passages.idx"), "wb") as index:
+            offset = 0
+            for local_id, (source, text) in enumerate(passages):
+                if source not in source_ids:
+                    source_ids[source] = len(sources)
+                    sources.append(source)
+                tokens = tokenize(text)
+                total_tokens += len(tokens)
+                for term, tf in Counter(tokens).items():
+                    inverted.setdefault(term, []).append((local_id, min(tf, 0xFFFFFFFF)))
+                data = text.encode("utf-8")
+                texts.write(data)
+                index.write(PASSAGE_RECORD.pack(offset, len(data), len(tokens), source_ids[source]))
+                offset += len(data)
+
+        with open(os.path.join(directory, f"{name}.terms.bin"), "wb") as terms, \
+                open(os.path.join(directory, f"{name}.terms.idx"), "wb") as term_index, \
+                open(os.path.join(directory, f"{name}.postings.bin"), "wb") as postings:
+            term_offset = 0
+            post_offset = 0
+            for term in sorted(inverted, key=lambda t: t.encode("utf-8")):
+                key = term.encode("utf-8")
+                entries = inverted[term]
+                terms.write(key)
+                postings.write(b"".join(POSTING_RECORD.pack(*entry) for entry in entries))
+                term_index.write(TERM_RECORD.pack(term_offset, len(key), post_offset, len(entries)))
+                term_offset += len(key)
+                post_offset += len(entries) * POSTING_RECORD.size
+
+        with open(os.path.join(directory, f"{name}.sources.json"), "w", encoding="utf-8") as f:
+            json.dump(sources, f)
+        return total_tokens
+
+
+class KnowledgeIndex:
+    """
+    Persistent BM25 index with incremental updates.
+    New or changed documents are written as a new segment; the passages of
+    changed or removed documents are tombstoned until the next compaction.
+    """
+
+    def __init__(self, directory: str = INDEX_DIR):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._writing = 0
+        self._manifest_version = None
+        self.segments = []
+        self.manifest = {"segments": [], "sources": {}, "deleted": [], "next_id": 0, "next_segment": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, "manifest.json")
+
+    def _load(self) -> None:
+        try:
+            stat = os.stat(self._manifest_path)
+        except FileNotFoundError:
+            stat = None
+        version = (stat.st_mtime_ns, stat.st_size) if stat else None
+        if version is not None and version == self._manifest_version:
+            return
+        if stat is not None:
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        self._manifest_version = version
+        self._open_segments()
+
+    @contextmanager
+    def _write_lock(self):
+        """
+        Serialize index changes across threads and processes (several workers
+        may share one cache directory). The manifest is reloaded once the lock
+        is held, so segment names and passage ids continue from the latest one.
+        """
+        with self._lock:
+            if self._writing:
+                self._writing += 1
+                try:
+                    yield
+                finally:
+                    self._writing -= 1
+                return
+            with file_lock(os.path.join(self.directory, "index.lock")):
+                self._writing = 1
+                try:
+                    self._load()
+                    yield
+                finally:
+                    self._writing = 0
+
+    def _open_segments(self) -> None:
+        for segment in self.segments:
+            segment.close()
+        self.segments = [Segment(self.directory, s["name"], s["base_id"]) for s in self.manifest["segments"]]
+        self._deleted = sorted(tuple(r) for r in self.manifest["deleted"])
+        self._deleted_starts = [r[0] for r in self._deleted]
+        live = sum(s["count"] for s in self.manifest["segments"]) - sum(e - s for s, e in self._deleted)
+        tokens = sum(s["tokens"] for s in self.manifest["segments"])
+        total = sum(s["count"] for s in self.manifest["segments"])
+        self.num_passages = max(live, 0)
+        self._df_cache = {}
+        self.avg_length = tokens / total if total else 0.0
+
+    def _save_manifest(self) -> None:
+        tmp_path = f"{self._manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+        stat = os.stat(self._manifest_path)
+        self._manifest_version = (stat.st_mtime_ns, stat.st_size)
+
+    def _is_deleted(self, passage_id: int) -> bool:
+        i = bisect.bisect_right(self._deleted_starts, passage_id) - 1
+        return i >= 0 and self._deleted[i][0] <= passage_id < self._deleted[i][1]
+
+    def update(self, documents: dict) -> dict:
+        """
+        Bring the index in line with `documents`: {source: (version, passages loader)}.
+        Only sources whose version changed are re-read; sources no longer present are removed.
+        """
+        with self._write_lock():
+            known = self.manifest["sources"]
+            removed = [s for s in known if s not in documents]
+            changed = [s for s, (version, _) in documents.items() if known.get(s, {}).get("version") != version]
+            if not removed and not changed:
+                return {"added": 0, "removed": 0, "passages": self.num_passages}
+
+            for source in removed + [s for s in changed if s in known]:
+                entry = known.pop(source)
+                self.manifest["deleted"].append([entry["start"], entry["end"]])
+
+            passages = []
+            next_id = self.manifest["next_id"]
+            for source in changed:
+                version, loader = documents[source]
+                try:
+                    texts = loader()
+                except (OSError, ValueError) as e:
+                    print(f"Warning: Could not index {source}: {str(e)}")
+                    continue
+                start = next_id + len(passages)
+                passages.extend((source, text) for text in texts)
+                known[source] = {"version": version, "start": start, "end": next_id + len(passages)}
+
+            if passages:
+                name = f"seg{self.manifest['next_segment']:05d}"
+                self.manifest["next_segment"] += 1
+                tokens = Segment.write(self.directory, name, passages)
+                self.manifest["segments"].append(
+                    {"name": name, "base_id": next_id, "count": len(passages), "tokens": tokens}
+                )
+                self.manifest["next_id"] = next_id + len(passages)
+
+            self._save_manifest()
+            self._open_segments()
+            if len(self.segments) > MAX_SEGMENTS or self._deleted_fraction() > 0.3:
+                self.compact()
+            return {"added": len(changed), "removed": len(removed), "passages": self.num_passages}
+
+    def _deleted_fraction(self) -> float:
+        total = sum(s["count"] for s in self.manifest["segments"])
+        deleted = sum(e - s for s, e in self._deleted)
+        return deleted / total if total else 0.0
+
+    def compact(self) -> None:
+        """Rewrite all live passages into a single segment and drop tombstones."""
+        with self._write_lock():
+            old_segments = list(self.manifest["segments"])
+            passages = []
+            sources = {}
+            for segment in self.segments:
+                for local_id in range(segment.count):
+                    if self._is_deleted(segment.base_id + local_id):
+                        continue
+                    text, _, source = segment.passage(local_id)
+                    entry = sources.setdefault(source, {"start": len(passages)})
+                    passages.append((source, text))
+                    entry["end"] = len(passages)
+
+            name = f"seg{self.manifest['next_segment']:05d}"
+            self.manifest["next_segment"] += 1
+            tokens = Segment.write(self.directory, name, passages)
+            for source, entry in sources.items():
+                version = self.manifest["sources"].get(source, {}).get("version")
+                self.manifest["sources"][source] = {"version": version, **entry}
+            self.manifest["segments"] = [{"name": name, "base_id": 0, "count": len(passages), "tokens": tokens}]
+            self.manifest["deleted"] = []
+            self.manifest["next_id"] = len(passages)
+            self._save_manifest()
+            self._open_segments()
+
+            for segment in old_segments:
+                for suffix in Segment.FILES + ("sources.json",):
+                    try:
+                        os.remove(os.path.join(self.directory, f"{segment['name']}.{suffix}"))
+                    except OSError:
+                        pass
+
+    def search(self, query: str, top_k: int = 5) -> list:
+        """Return the top_k passages by BM25 score as dicts with text, source and score."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.num_passages:
+            return []
+        with self._lock:
+            idf = {}
+            for term in terms:
+                df = self._document_frequency(term)
+                if df:
+                    idf[term] = math.log(1 + (self.num_passages - df + 0.5) / (df + 0.5))
+            best = []
+            for segment in self.segments:
+                best.extend(self._search_segment(segment, idf, top_k))
+
+            results = []
+            for score, segment, local_id in heapq.nlargest(top_k, best, key=lambda item: item[0]):
+                text, _, source = segment.passage(local_id)
+                results.append({"text": text, "source": source, "score": round(score, 3)})
+            return results
+
+    def _search_segment(self, segment: Segment, idf: dict, top_k: int) -> list:
+        """Score one segment's postings with numpy; return its top_k as (score, segment, local id)."""
+        scores = None
+        length_norm = K1 * B / (self.avg_length or 1)
+        for term, weight in idf.items():
+            postings = segment.posting_array(term)
+            if not len(postings):
+                continue
+            if scores is None:
+                scores = np.zeros(segment.count)
+            ids = postings["id"]
+            tf = postings["tf"].astype(np.float64)
+            norm = tf + K1 * (1 - B) + length_norm * segment.lengths[ids]
+            # Each passage appears once per term, so the fancy-indexed add is safe
+            scores[ids] += weight * tf * (K1 + 1) / norm
+        if scores is None:
+            return []
+        for start, end in self._deleted:
+            lo, hi = max(start - segment.base_id, 0), min(end - segment.base_id, segment.count)
+            if lo < hi:
+                scores[lo:hi] = 0.0
+        matched = np.flatnonzero(scores)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(scores[matched], -top_k)[-top_k:]]
+        return [(float(scores[i]), segment, int(i)) for i in matched]
+
+    def _document_frequency(self, term: str) -> int:
+        if term not in self._df_cache:
+            self._df_cache[term] = sum(segment.document_frequency(term) for segment in self.segments)
+        return self._df_cache[term]
+
+
+def collect_documents(knowledge_dir: str = KNOWLEDGE_DIR, include_pages: bool = True) -> dict:
+    """Find indexable documents: txt/md/jsonl files under knowledge_dir plus cached scraped pages."""
+    documents = {}
+    if os.path.isdir(knowledge_dir):
+        for root, _, files in os.walk(knowledge_dir):
+            for name in sorted(files):
+                if not name.endswith(SUPPORTED_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                documents[path] = (f"{stat.st_mtime_ns}:{stat.st_size}", lambda path=path: read_document(path))
+
+    if include_pages:
+        from src.history_buff.scraper import PageCache
+        cache = PageCache()
+        for entry in cache.entries():
+            if not (entry.get("passages") or entry.get("text")) or not entry.get("url"):
+                continue
+            # Only the URL is kept; the page is read again if the index needs it
+            documents[entry["url"]] = (f"page:{entry.get('fetched_at')}",
+                                       lambda url=entry["url"]: _page_passages(cache, url))
+    return documents
+
+
+def _page_passages(cache, url: str) -> list:
+    entry = cache.get(url) or {}
+    title = entry.get("title") or ""
+    # Entries hold the page's "passages"; older ones hold the joined "text"
+    passages = entry.get("passages")
+    paragraphs = passages if passages is not None else re.split(r"\n\s*\n", entry.get("text") or "")
+    return [f"{title}: {p}" if title else p for p in split_paragraphs(paragraphs)]
+
+
+def format_results(results: list) -> str:
+    """Render search hits for an agent."""
+    if not results:
+        return "No matching passages in the local knowledge index. Use web search instead."
+    return "\n\n".join(
+        f"[{i + 1}] (score {r['score']}) Source: {r['source']}\n{r['text']}" for i, r in enumerate(results)
+    )
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def clear_knowledge_index() -> None:
+    """Delete the on-disk index; the next get_knowledge_index() builds it again from scratch."""
+    global _index
+    with _index_lock:
+        if _index is not None:
+            with _index._write_lock():
+                for segment in _index.segments:
+                    segment.close()
+                _index.segments = []
+        _index = None
+        shutil.rmtree(INDEX_DIR, ignore_errors=True)
+
+
+def get_knowledge_index(refresh: bool = True) -> KnowledgeIndex:
+    """Return the process-wide knowledge index, bringing it up to date on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = KnowledgeIndex()
+            if refresh:
+                _index.update(collect_documents())
+    return _index
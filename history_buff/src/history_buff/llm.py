@@ -0,0 +1,81 @@
+import time
+
+from crewai import LLM
+
+from src.history_buff.instrumentation import span
+from src.history_buff.providers import estimate_tokens, get_client
+from src.history_buff.routing import get_router
+
+
+def valid_agent_output(response) -> bool:
+    """An agent step must end in an action or a final answer, or CrewAI will ask again."""
+    if not isinstance(response, str):
+        return True
+    return bool(response.strip()) and ("Final Answer:" in response or "Action:" in response)
+
+
+class ThrottledLLM(LLM):
+    """
+    CrewAI LLM whose calls go through the shared provider client, so agent
+    turns share rate limits, the concurrency cap and transport retries with
+    every other call to the same provider.
+    Created with a `tier` instead of a model, each call is routed (see
+    routing.py) and retried on a bigger tier when `validate` rejects it.
+    """
+
+    def __init__(self, model: str = None, provider: str = "openai", tier: str = None, target: str = None,
+                 validate=valid_agent_output, **kwargs):
+        # Retries happen in the provider client; don't let litellm retry on top of it
+        kwargs.setdefault("num_retries", 0)
+        super().__init__(model=model or get_router().tier(provider, tier).model, **kwargs)
+        self.provider = provider
+        self.tier = tier
+        self.target = target
+        self.validate = validate
+
+    def call(self, messages, *args, **kwargs):
+        if isinstance(messages, str):
+            prompt_tokens = estimate_tokens(messages)
+        else:
+            prompt_tokens = sum(estimate_tokens(m.get("content")) for m in messages)
+        agent = kwargs.get("from_agent")
+        name = getattr(agent, "role", None) or self.target or self.model
+        if self.tier is None:
+            return self._call(messages, prompt_tokens, name, None, args, kwargs)
+
+        router = get_router()
+        route = router.route(self.provider, self.target or name, prompt_tokens, tier=self.tier)
+        while True:
+            response = self._call(messages, prompt_tokens, name, route, args, kwargs)
+            if self.validate is None or self.validate(response):
+                return response
+            route = router.escalate(route)
+            if route is None:
+                return response
+
+    def _call(self, messages, prompt_tokens, name, route, args, kwargs):
+        configured_model = self.model
+        # The agent lock keeps this LLM to one call at a time, so switching the model per call is safe
+        if route is not None:
+            self.model = route.model
+        try:
+            tokens = prompt_tokens + (self.max_tokens or 0)
+            parent_call = super().call
+            client = get_client(self.provider)
+            # One span per agent step, named after the agent's role
+            with span(name, "agent_step", model=self.model, tier=route.tier.name if route else None) as step:
+                start = time.perf_counter()
+                response = client.call(
+                    lambda: parent_call(messages, *args, **kwargs),
+                    tokens=tokens,
+                    request={"model": self.model, "messages": messages}
+                )
+                completion_tokens = estimate_tokens(response) if isinstance(response, str) else 0
+                if route is not None:
+                    cost = get_router().record(route, time.perf_counter() - start, prompt_tokens, completion_tokens)
+                else:
+                    cost = client.cost(prompt_tokens, completion_tokens)
+                step.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cost_usd=cost)
+                return response
+        finally:
+            self.model = configured_model
@@ -4,8 +4,9 @@ import os
 import sys
 from dotenv import load_dotenv
 
-# Import the crew class from crew.py
-from src.history_buff.crew import HistoryBuff
+from src.history_buff.startup import ImportProfiler
+
+# HistoryBuff (and through it crewai) is imported on demand so subcommands start quickly
 
 # Suppress warnings
 warnings.filterwarnings("ignore", category=SyntaxWarning, module="pysbd")
@@ -40,10 +41,86 @@ def check_api_keys():
     
     return True
 
+def print_run_stats():
+    """Print cache, provider and fast-path counters collected during the run."""
+    from src.history_buff.cache import get_llm_cache
+    from src.history_buff.search_cache import get_search_cache
+    from src.history_buff.providers import provider_metrics
+    from src.history_buff.intent import get_intent_classifier
+    from src.history_buff.scraper import get_page_fetcher
+    
+    print(f"LLM cache: {get_llm_cache().stats()}")
+    print(f"Search cache: {get_search_cache().stats()}")
+    print(f"Pages: {get_page_fetcher().stats()}")
+    print(f"Provider calls: {provider_metrics()}")
+    print(f"Intent classifier: {get_intent_classifier().stats()}")
+    
+    from src.history_buff.compaction import get_compactor
+    print(f"Context compaction: {get_compactor().stats()}")
+    
+    from src.history_buff.report_store import get_report_store
+    print(f"Report reuse: {get_report_store().stats()}")
+    
+    from src.history_buff.routing import get_router
+    print(f"Model routing: {get_router().stats()}")
+    
+    from src.history_buff.prefetch import get_prefetcher
+    print(f"Search prefetch: {get_prefetcher().stats()}")
+    
+    from src.history_buff.event_store import get_event_store
+    print(f"Event store: {get_event_store().stats()}")
+    
+    from src.history_buff.memory import get_memory_tracker
+    print(f"Memory: {get_memory_tracker().stats()}")
+    
+    from src.history_buff.instrumentation import export_from_env, get_tracer
+    print("\nWhere the time went:")
+    print(get_tracer().summary_table())
+    export_from_env()
+
+def create_history_buff(stream=None, profiler=None):
+    """Import and construct HistoryBuff, printing the import-time breakdown when profiling."""
+    print("Initializing HistoryBuff...")
+    from src.history_buff.crew import HistoryBuff
+    history_buff = HistoryBuff(stream=stream)
+    if profiler is not None:
+        print(profiler.stop().report())
+    return history_buff
+
 def run():
     """
     Run the CrewAI HistoryBuff pipeline.
+    `history_buff batch ...` runs a JSONL file of topics instead (see batch()).
+    `--profile-startup` prints where startup time went once HistoryBuff is ready.
+    `--trace FILE` / `--metrics FILE` write a Chrome trace / Prometheus metrics at the end.
     """
+    profiler = ImportProfiler().start() if "--profile-startup" in sys.argv[1:] else None
+    if profiler is not None:
+        sys.argv.remove("--profile-startup")
+    for flag, env_var in (("--trace", "HISTORY_BUFF_TRACE_FILE"), ("--metrics", "HISTORY_BUFF_METRICS_FILE")):
+        if flag in sys.argv[1:-1]:
+            i = sys.argv.index(flag)
+            os.environ[env_var] = sys.argv[i + 1]
+            del sys.argv[i:i + 2]
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        return batch(sys.argv[2:], profiler=profiler)
+    if len(sys.argv) > 1 and sys.argv[1] == "retrain-intent":
+        return retrain_intent(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "index-knowledge":
+        return index_knowledge(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        return serve(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        return benchmark(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "replay":
+        return replay(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "events":
+        return events(sys.argv[2:])
+    
+    # --stream shows model output live as each stage generates it
+    stream = "--stream" in sys.argv[1:] or None
+    
     # Configure environment for CrewAI
     os.environ["CREWAI_TELEMETRY"] = "False"
     os.environ["LANGCHAIN_TRACING"] = "false"
@@ -63,21 +140,12 @@ def run():
     
     try:
         # Create the history buff instance 
-        print("Initializing HistoryBuff...")
-        history_buff = HistoryBuff()
-        
-        # Set up tasks with inputs
-        print(f"Creating tasks for topic: {topic}")
-        history_buff._create_tasks(inputs)
+        history_buff = create_history_buff(stream=stream, profiler=profiler)
         
-        # Get the crew and kick it off
-        print("Creating crew and starting the process...")
-        crew = history_buff.crew()
-        
-        # Execute the crew's tasks
+        # Execute the tasks (in parallel where tasks.yaml allows it)
         try:
             print(f"Executing tasks for topic: {topic}...")
-            result = crew.kickoff(inputs=inputs)
+            result = history_buff.kickoff(inputs)
             
             # Print the final report to the console
             print("\n\nFinal Report:")
@@ -85,11 +153,13 @@ def run():
             
             # Inform the user where the full report is saved
             print("\n\nThe full report has been saved to 'full_report.md' and the timeline to 'timeline.md'")
+            print_run_stats()
             
         except Exception as e:
             print(f"\n\nError during execution: {str(e)}")
             print("\nThis could be due to API limits, connection issues, or other runtime errors.")
             print("\nCheck your API keys and try again, or try with a simpler query.")
+            print("Finished stages were checkpointed: running the same topic again resumes after them.")
             
     except Exception as e:
         # Print any unexpected errors that occur
@@ -98,6 +168,296 @@ def run():
         import traceback
         traceback.print_exc()
 
+def batch(argv=None, profiler=None):
+    """
+    Run many topics from a JSONL file through one shared HistoryBuff.
+    Each line needs a "topic" (or "title") field and may carry an "id".
+    """
+    import argparse
+    from src.history_buff.batch import BatchRunner
+    
+    parser = argparse.ArgumentParser(prog="history_buff batch", description="Run a batch of history topics")
+    parser.add_argument("input", help="JSONL file with one topic per line")
+    parser.add_argument("--output-dir", default="batch_output", help="Directory for per-topic results")
+    parser.add_argument("--concurrency", type=int, default=2, help="Number of topics run at once")
+    parser.add_argument("--no-resume", action="store_true", help="Re-run topics that already have results")
+    parser.add_argument("--profile-startup", action="store_true", help="Print an import-time breakdown")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    if args.profile_startup and profiler is None:
+        profiler = ImportProfiler().start()
+    
+    os.environ["CREWAI_TELEMETRY"] = "False"
+    os.environ["LANGCHAIN_TRACING"] = "false"
+    
+    if not check_api_keys():
+        return
+    
+    runner = BatchRunner(
+        create_history_buff(profiler=profiler),
+        output_dir=args.output_dir,
+        concurrency=args.concurrency,
+        resume=not args.no_resume
+    )
+    summary = runner.run(args.input)
+    
+    print("\n\nBatch summary:")
+    for key, value in summary.items():
+        print(f"  {key}: {value}")
+    print_run_stats()
+    return summary
+
+def retrain_intent(argv=None):
+    """
+    Retrain the local intent classifier from the bundled seed set plus
+    the labels Gemini produced for low-confidence queries.
+    """
+    import argparse
+    from src.history_buff.intent import LABEL_LOG_PATH, MODEL_PATH, retrain
+    
+    parser = argparse.ArgumentParser(prog="history_buff retrain-intent", description="Retrain the local intent classifier")
+    parser.add_argument("--log", default=LABEL_LOG_PATH, help="JSONL file of logged Gemini labels")
+    parser.add_argument("--output", default=MODEL_PATH, help="Where to write the model weights")
+    parser.add_argument("--no-seed", action="store_true", help="Train on the logged labels only")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    
+    summary = retrain(args.log, args.output, include_seed=not args.no_seed)
+    print("Retrained intent classifier:")
+    for key, value in summary.items():
+        print(f"  {key}: {value}")
+    return summary
+
+def index_knowledge(argv=None):
+    """
+    Build or update the local knowledge index from knowledge/ and the
+    cached scraped pages. Only new or changed documents are re-indexed.
+    """
+    import argparse
+    import time
+    from src.history_buff.knowledge import KNOWLEDGE_DIR, KnowledgeIndex, collect_documents
+    
+    parser = argparse.ArgumentParser(prog="history_buff index-knowledge", description="Update the local knowledge index")
+    parser.add_argument("--dir", default=KNOWLEDGE_DIR, help="Directory of txt/md/jsonl documents")
+    parser.add_argument("--no-pages", action="store_true", help="Skip the cached scraped pages")
+    parser.add_argument("--compact", action="store_true", help="Merge all segments into one afterwards")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    
+    start = time.time()
+    index = KnowledgeIndex()
+    summary = index.update(collect_documents(args.dir, include_pages=not args.no_pages))
+    if args.compact:
+        index.compact()
+    summary["segments"] = len(index.segments)
+    summary["seconds"] = round(time.time() - start, 2)
+    print("Knowledge index updated:")
+    for key, value in summary.items():
+        print(f"  {key}: {value}")
+    return summary
+
+def serve(argv=None):
+    """
+    Serve reports over HTTP/JSON from a pool of warm HistoryBuff crews.
+    --stub swaps the crews for canned responses so the service can be tried without API keys.
+    """
+    import argparse
+    import asyncio
+    from src.history_buff.service import ReportService, StubHistoryBuff, serve as serve_reports
+    
+    parser = argparse.ArgumentParser(prog="history_buff serve", description="Run the HistoryBuff HTTP service")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--pool-size", type=int, default=2, help="Number of warm crews (topics run at once)")
+    parser.add_argument("--queue-size", type=int, default=16, help="Queued topics before requests get 503")
+    parser.add_argument("--output-dir", default="service_output", help="Directory for per-job output files")
+    parser.add_argument("--stub", action="store_true", help="Use stub crews instead of calling the APIs")
+    parser.add_argument("--stub-delay", type=float, default=0.5, help="Seconds each stub run takes")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    
+    if args.stub:
+        factory = lambda: StubHistoryBuff(args.stub_delay)
+    else:
+        if not check_api_keys():
+            return
+        factory = None
+    
+    service = ReportService(factory, pool_size=args.pool_size, queue_size=args.queue_size, output_dir=args.output_dir)
+    try:
+        asyncio.run(serve_reports(service, args.host, args.port))
+    except KeyboardInterrupt:
+        print("Service stopped")
+
+def benchmark(argv=None):
+    """
+    Run the topic corpus through the full pipeline against recorded provider
+    responses and compare the numbers with a saved baseline.
+    Use --record once (with real API keys) to capture the fixtures.
+    """
+    import argparse
+    import json
+    import tempfile
+    
+    parser = argparse.ArgumentParser(prog="history_buff benchmark", description="Offline pipeline benchmark")
+    parser.add_argument("--corpus", default=os.path.join("benchmarks", "topics.jsonl"), help="JSONL topic corpus")
+    parser.add_argument("--fixtures", default=os.path.join("benchmarks", "fixtures"), help="Fixture directory")
+    parser.add_argument("--record", action="store_true", help="Call the live APIs and save their responses")
+    parser.add_argument("--strict", action="store_true", help="Fail on requests without an exact fixture")
+    parser.add_argument("--max-synthetic", type=float, default=0.05,
+                        help="Fail when more than this share of replayed responses had no fixture at all")
+    parser.add_argument("--latency", action="append", default=[],
+                        help="Replay latency, e.g. lognormal:0.8,0.5 or openai=fixed:1.5 (default: recorded)")
+    parser.add_argument("--concurrency", type=int, default=2, help="Topics run at once")
+    parser.add_argument("--warm-cache", action="store_true", help="Keep the normal cache directory instead of a cold one")
+    parser.add_argument("--no-memory-pass", action="store_true",
+                        help="Skip the untimed tracemalloc pass that measures peak memory")
+    parser.add_argument("--output", default=None, help="Write the report JSON here")
+    parser.add_argument("--baseline", default=os.path.join("benchmarks", "baseline.json"), help="Baseline report")
+    parser.add_argument("--save-baseline", action="store_true", help="Save this report as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change counted as a regression")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    
+    # Caches live under HISTORY_BUFF_CACHE_DIR, which is read at import time, so set it first
+    if not args.warm_cache:
+        os.environ["HISTORY_BUFF_CACHE_DIR"] = tempfile.mkdtemp(prefix="history_buff_bench_cache_")
+    # Otherwise the warm-up run would answer the timed runs from stored reports and checkpoints,
+    # and feed its events into their timelines
+    os.environ["HISTORY_BUFF_REPORT_REUSE"] = "off"
+    os.environ["HISTORY_BUFF_CHECKPOINTS"] = "off"
+    os.environ["HISTORY_BUFF_EVENT_STORE"] = "off"
+    if args.record:
+        if not check_api_keys():
+            return
+    else:
+        # Replay never reaches the APIs, but the tools still expect keys to be set
+        for key in ("OPENAI_API_KEY", "GEMINI_API_KEY", "SERPER_API_KEY"):
+            os.environ.setdefault(key, "replay")
+    
+    from src.history_buff.benchmark import FixtureStore, compare, format_comparison, parse_latency, run_benchmark
+    from src.history_buff.crew import HistoryBuff
+    
+    latency = {}
+    for spec in args.latency:
+        provider, _, model = spec.rpartition("=")
+        latency[provider or "default"] = parse_latency(model)
+    store = FixtureStore(args.fixtures, record=args.record, latency=latency, strict=args.strict)
+    report = run_benchmark(HistoryBuff, args.corpus, store, concurrency=args.concurrency, cold=not args.warm_cache,
+                           memory_pass=not args.no_memory_pass)
+    
+    print("\n\nBenchmark report:")
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            rows = compare(report, json.load(f), args.tolerance)
+        print("\nCompared with baseline:")
+        print(format_comparison(rows))
+        regressions = [row[0] for row in rows if row[4]]
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        sys.exit(1)
+    fixtures = report["fixtures"]
+    if not args.record and fixtures["synthetic_share"] > args.max_synthetic:
+        # Stand-in responses measure the harness, not the pipeline
+        print(f"Error: {fixtures['synthetic']} replayed responses had no fixture "
+              f"({fixtures['synthetic_share']:.0%}, limit {args.max_synthetic:.0%}); "
+              f"record fixtures with --record or raise --max-synthetic")
+        sys.exit(1)
+    return report
+
+def replay(argv=None):
+    """
+    Re-run a checkpointed topic. With --from-stage that stage and everything
+    downstream of it run again; the other stages are restored from their
+    checkpoints. Without it only missing or invalidated stages run.
+    """
+    import argparse
+    from src.history_buff.checkpoints import get_checkpoint_store
+    from src.history_buff.crew import load_config
+    from src.history_buff.scheduler import downstream_of, task_dependencies
+    
+    deps = task_dependencies(load_config('tasks'))
+    parser = argparse.ArgumentParser(prog="history_buff replay", description="Resume or replay a checkpointed run")
+    parser.add_argument("--topic", help="Topic to replay (default: the most recently checkpointed one)")
+    parser.add_argument("--current-year", default=None, help="current_year input of the run")
+    parser.add_argument("--from-stage", choices=list(deps), help="First stage to run again")
+    parser.add_argument("--output-dir", default=None, help="Directory for the output files")
+    parser.add_argument("--list", action="store_true", help="List checkpointed runs and exit")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    
+    store = get_checkpoint_store()
+    runs = store.runs()
+    if args.list:
+        for run in runs:
+            print(f"{run['inputs'].get('topic')!r} ({run['inputs'].get('current_year')}): {', '.join(run['stages'])}")
+        return runs
+    
+    if args.topic:
+        inputs = {'topic': args.topic, 'current_year': args.current_year or '2025'}
+    elif runs:
+        inputs = dict(runs[0]['inputs'])
+        if args.current_year:
+            inputs['current_year'] = args.current_year
+    else:
+        print("No checkpointed runs to replay; pass --topic")
+        return
+    
+    if args.from_stage:
+        removed = store.for_run(inputs, {}).invalidate(downstream_of(deps, args.from_stage))
+        print(f"Replaying '{inputs['topic']}' from {args.from_stage} (dropped checkpoints: {', '.join(removed) or 'none'})")
+    else:
+        print(f"Resuming '{inputs['topic']}'")
+    
+    # A replay is meant to run stages again, not to return a similar stored report
+    os.environ["HISTORY_BUFF_REPORT_REUSE"] = "off"
+    os.environ["CREWAI_TELEMETRY"] = "False"
+    os.environ["LANGCHAIN_TRACING"] = "false"
+    if not check_api_keys():
+        return
+    
+    result = create_history_buff().kickoff(inputs, output_dir=args.output_dir)
+    print("\n\nFinal Report:")
+    print(result)
+    print_run_stats()
+    return result
+
+def events(argv=None):
+    """
+    Print the stored events of a year range as one timeline merged across
+    every report, optionally only those linked to the given entities.
+    """
+    import argparse
+    from src.history_buff.event_store import get_event_store
+    from src.history_buff.timeline import build_timeline
+    
+    parser = argparse.ArgumentParser(prog="history_buff events", description="Query the stored events")
+    parser.add_argument("--from", dest="start", type=int, default=None, help="First year (negative for BCE)")
+    parser.add_argument("--to", dest="end", type=int, default=None, help="Last year (negative for BCE)")
+    parser.add_argument("--entity", action="append", default=[], help="Entity the events must be linked to (repeatable)")
+    parser.add_argument("--limit", type=int, default=200, help="Maximum number of events")
+    parser.add_argument("--sources", action="store_true", help="Show the topics each event was reported for")
+    parser.add_argument("--compact", action="store_true", help="Merge all segments into one first")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    
+    store = get_event_store()
+    if args.compact:
+        store.compact()
+    found = store.query(args.start, args.end, args.entity or None, limit=args.limit)
+    if not found:
+        print("No stored events match.")
+    elif args.sources:
+        for event in found:
+            print(f"- {event.to_item()['date']}: {event.text} ({'; '.join(event.sources)})")
+    else:
+        print(build_timeline([event.to_item() for event in found]))
+    print(f"Event store: {store.stats()}")
+    return found
+
 # Entry point for script execution
 if __name__ == "__main__":
     run()
\ No newline at end of file
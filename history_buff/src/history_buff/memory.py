@@ -0,0 +1,252 @@
+import contextvars
+import os
+import re
+import tempfile
+import threading
+import weakref
+from contextlib import contextmanager
+
+from src.history_buff.cache import CACHE_DIR
+
+# Bounded memory for large research payloads. Every run gets a byte budget for
+# the intermediate artifacts it holds (page text, formatted chunks); buffers
+# that would go over it, or that are large on their own, move to a temp file
+# under the cache directory and are read back chunk by chunk. The budget is a
+# contextvar, so threads started with the run's context share it.
+
+SPILL_DIR = os.path.join(CACHE_DIR, "spill")
+# 0 disables the per-run limit
+RUN_MEMORY_BYTES = int(float(os.getenv("HISTORY_BUFF_RUN_MEMORY_MB", "32")) * 1024 * 1024)
+# A single buffer larger than this goes to disk even when the run has budget left
+# (below the per-page text cap, so one large page spills on its own)
+SPILL_THRESHOLD_BYTES = int(float(os.getenv("HISTORY_BUFF_SPILL_THRESHOLD_KB", "64")) * 1024)
+
+
+class MemoryBudget:
+    """Bytes of intermediate artifacts one run may hold in memory."""
+
+    def __init__(self, max_bytes: int = RUN_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.peak = 0
+        self.spills = 0
+        self.spilled_bytes = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes: int) -> bool:
+        """Take nbytes from the budget; False (and nothing taken) when they do not fit."""
+        with self._lock:
+            if self.max_bytes and self.used + nbytes > self.max_bytes:
+                return False
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+            return True
+
+    def reserve_up_to(self, nbytes: int) -> int:
+        """Take as much of nbytes as is left (all of it without a limit); returns how much was taken."""
+        with self._lock:
+            granted = nbytes if not self.max_bytes else max(0, min(nbytes, self.max_bytes - self.used))
+            self.used += granted
+            self.peak = max(self.peak, self.used)
+            return granted
+
+    def release(self, nbytes: int) -> None:
+        with self._lock:
+            self.used = max(0, self.used - nbytes)
+
+    def spilled(self, nbytes: int, buffers: int = 0) -> None:
+        """Count bytes written to disk instead of memory, and buffers that moved there."""
+        with self._lock:
+            self.spills += buffers
+            self.spilled_bytes += nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"max_bytes": self.max_bytes, "peak_bytes": self.peak, "spills": self.spills,
+                    "spilled_bytes": self.spilled_bytes}
+
+
+_budget = contextvars.ContextVar("history_buff_memory_budget", default=None)
+
+
+def current_memory_budget():
+    """The memory budget of the run in this context, if any."""
+    return _budget.get()
+
+
+class SpillBuffer:
+    """
+    Append-only sequence of text chunks kept in memory while the run's budget
+    allows, and in a temp file after that. Chunks are read back one at a time,
+    so a spilled buffer is never loaded whole unless getvalue() is called.
+    """
+
+    def __init__(self, budget: MemoryBudget = None, threshold: int = SPILL_THRESHOLD_BYTES):
+        self.budget = budget if budget is not None else current_memory_budget()
+        self.threshold = threshold
+        self.size = 0
+        self._chunks = []
+        # Byte length of every chunk, to read them back from the file
+        self._sizes = []
+        # Reserved bytes and the temp file, given back when the buffer is closed or collected
+        self._state = {"reserved": 0, "file": None}
+        self._finalizer = weakref.finalize(self, _release, self.budget, self._state)
+        self._lock = threading.Lock()
+
+    @property
+    def spilled(self) -> bool:
+        return self._state["file"] is not None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def write(self, text: str) -> None:
+        if text is None:
+            return
+        data = text.encode("utf-8")
+        with self._lock:
+            self.size += len(data)
+            self._sizes.append(len(data))
+            if not self.spilled and (self.size > self.threshold or not self._reserve(len(data))):
+                self._spill()
+            if self.spilled:
+                self._state["file"].seek(0, os.SEEK_END)
+                self._state["file"].write(data)
+                if self.budget is not None:
+                    self.budget.spilled(len(data))
+            else:
+                self._chunks.append(text)
+
+    def _reserve(self, nbytes: int) -> bool:
+        if self.budget is None:
+            return True
+        if not self.budget.reserve(nbytes):
+            return False
+        self._state["reserved"] += nbytes
+        return True
+
+    def _spill(self) -> None:
+        os.makedirs(SPILL_DIR, exist_ok=True)
+        spill_file = tempfile.TemporaryFile(dir=SPILL_DIR)
+        for chunk in self._chunks:
+            spill_file.write(chunk.encode("utf-8"))
+        self._chunks = []
+        self._state["file"] = spill_file
+        if self.budget is not None:
+            self.budget.release(self._state["reserved"])
+            # The chunk being written is counted by write()
+            self.budget.spilled(self.size - self._sizes[-1], buffers=1)
+        self._state["reserved"] = 0
+
+    def chunks(self):
+        """Yield the chunks in the order they were written."""
+        with self._lock:
+            chunks = None if self.spilled else list(self._chunks)
+            sizes = list(self._sizes)
+        if chunks is not None:
+            yield from chunks
+            return
+        position = 0
+        for size in sizes:
+            with self._lock:
+                if not self.spilled:
+                    return
+                self._state["file"].seek(position)
+                data = self._state["file"].read(size)
+            position += size
+            yield data.decode("utf-8")
+
+    def getvalue(self, separator: str = "") -> str:
+        return separator.join(self.chunks())
+
+    def close(self) -> None:
+        """Give the reserved bytes back and delete the temp file."""
+        with self._lock:
+            self._chunks = []
+            self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _release(budget, state: dict) -> None:
+    if budget is not None and state["reserved"]:
+        budget.release(state["reserved"])
+    state["reserved"] = 0
+    if state["file"] is not None:
+        state["file"].close()
+        state["file"] = None
+
+
+def iter_text_chunks(text: str, max_chars: int):
+    """Yield pieces of at most max_chars, cut at paragraph and then sentence boundaries."""
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(". ", 0, max_chars)
+            cut = cut + 1 if cut > max_chars // 2 else max_chars
+            if current:
+                yield current
+                current = ""
+            yield paragraph[:cut]
+            paragraph = paragraph[cut:]
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            yield current
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current.strip():
+        yield current
+
+
+class MemoryTracker:
+    """Hands out per-run budgets and totals what they held and spilled."""
+
+    def __init__(self, max_bytes: int = RUN_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self.totals = {"runs": 0, "peak_bytes": 0, "spills": 0, "spilled_bytes": 0}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def run_budget(self):
+        """Memory budget for the run inside the block (and threads started with its context)."""
+        budget = MemoryBudget(self.max_bytes)
+        token = _budget.set(budget)
+        try:
+            yield budget
+        finally:
+            _budget.reset(token)
+            stats = budget.stats()
+            if stats["spills"]:
+                print(f"Memory: peak {stats['peak_bytes'] // 1024} KB of {self.max_bytes // 1024} KB, "
+                      f"{stats['spills']} buffers ({stats['spilled_bytes'] // 1024} KB) spilled to disk")
+            with self._lock:
+                self.totals["runs"] += 1
+                self.totals["peak_bytes"] = max(self.totals["peak_bytes"], stats["peak_bytes"])
+                self.totals["spills"] += stats["spills"]
+                self.totals["spilled_bytes"] += stats["spilled_bytes"]
+
+    def stats(self) -> dict:
+        import resource
+        with self._lock:
+            totals = dict(self.totals)
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        totals["max_rss_mb"] = round(max_rss / 1024 / 1024 if os.uname().sysname == "Darwin" else max_rss / 1024, 1)
+        totals["run_budget_bytes"] = self.max_bytes
+        return totals
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_memory_tracker() -> MemoryTracker:
+    """Return the process-wide memory tracker."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = MemoryTracker()
+    return _tracker
@@ -0,0 +1,228 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+from src.history_buff.cache import cache_enabled
+from src.history_buff.search_cache import normalize_query
+
+# Speculative searches for the research stage. As soon as a run knows its topic
+# (and later the entities and year range from query understanding) a planned
+# set of Serper searches and top-result page fetches starts in the background.
+# The search tools and BatchScrapeTool look in the run's session first, so most
+# research-stage tool calls become local lookups. Work still queued when the
+# research stage finishes is cancelled.
+
+# Stage whose output adds entities and years to the plan, and the stage that uses the results
+PLANNING_STAGE = "query_understanding"
+CONSUMER_STAGE = "research"
+
+MAX_SEARCHES = 8
+PAGES_PER_SEARCH = 2
+MAX_PAGES = 8
+# A tool query this similar (term-set Jaccard) to a prefetched one is answered from it
+QUERY_SIMILARITY = 0.75
+WAIT_SECONDS = 30
+
+
+def prefetch_enabled() -> bool:
+    return cache_enabled("HISTORY_BUFF_PREFETCH")
+
+
+def _terms(query: str) -> set:
+    return set(normalize_query(query).split())
+
+
+def _year(year) -> str:
+    return f"{-year} BC" if year < 0 else str(year)
+
+
+def plan_topic_queries(topic: str) -> list:
+    return [topic, f"{topic} timeline", f"{topic} causes and consequences"]
+
+
+def plan_entity_queries(topic: str, understanding: dict) -> list:
+    """Searches suggested by the query-understanding output (entities, years, key events)."""
+    queries = []
+    start, end = understanding.get("start_year"), understanding.get("end_year")
+    if isinstance(start, int) and isinstance(end, int):
+        queries.append(f"{topic} {_year(start)} to {_year(end)}")
+    for entity in (understanding.get("entities") or [])[:3]:
+        if normalize_query(entity) not in normalize_query(topic):
+            queries.append(f"{entity} history")
+    for event in (understanding.get("key_events") or [])[:3]:
+        if isinstance(event, dict) and event.get("event"):
+            queries.append(" ".join(str(part) for part in (event["event"], event.get("date")) if part))
+    return queries
+
+
+class PrefetchSession:
+    """Prefetched searches and pages of one run, looked up by the tools while it lasts."""
+
+    def __init__(self, prefetcher: "Prefetcher", topic: str, search):
+        self.prefetcher = prefetcher
+        self.topic = topic
+        # search(query) -> Serper response dict, through the shared search cache
+        self.search = search
+        self.searches = {}
+        self.pages = {}
+        self.used = set()
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def plan(self, queries: list) -> None:
+        """Start background searches (and their top page fetches) for queries not planned yet."""
+        for query in queries:
+            key = normalize_query(query)
+            with self._lock:
+                if self.closed or key in self.searches or len(self.searches) >= MAX_SEARCHES:
+                    continue
+                future = self.prefetcher.submit(self._search_and_fetch, query)
+                self.searches[key] = (query, future)
+            self.prefetcher.count("issued")
+
+    def plan_from_understanding(self, output) -> None:
+        data = getattr(output, "data", None)
+        if not isinstance(data, dict):
+            from src.history_buff.query_understanding import repair_json
+            try:
+                data = repair_json(getattr(output, "raw", str(output)))
+            except ValueError:
+                return
+        self.plan(plan_entity_queries(self.topic, data))
+
+    def _search_and_fetch(self, query: str) -> dict:
+        results = self.search(query)
+        links = [r.get("link") for r in (results or {}).get("organic", [])[:PAGES_PER_SEARCH] if r.get("link")]
+        for url in links:
+            with self._lock:
+                if self.closed or url in self.pages or len(self.pages) >= MAX_PAGES:
+                    continue
+                self.pages[url] = self.prefetcher.submit(self.prefetcher.fetch_page, url)
+            self.prefetcher.count("issued")
+        return results
+
+    def lookup_search(self, query: str):
+        """Prefetched results for this query or a near-identical one, or None."""
+        terms = _terms(query)
+        with self._lock:
+            match = self.searches.get(normalize_query(query))
+            if match is None:
+                best = 0.0
+                for key, entry in self.searches.items():
+                    other = set(key.split())
+                    similarity = len(terms & other) / len(terms | other) if terms | other else 0.0
+                    if similarity >= QUERY_SIMILARITY and similarity > best:
+                        match, best = entry, similarity
+        return self._use(("search", match[0]) if match else None, match[1] if match else None)
+
+    def lookup_page(self, url: str):
+        with self._lock:
+            future = self.pages.get(url)
+        return self._use(("page", url) if future else None, future)
+
+    def _use(self, key, future):
+        if future is None or future.cancelled():
+            self.prefetcher.count("misses")
+            return None
+        try:
+            result = future.result(timeout=WAIT_SECONDS)
+        except (FutureTimeout, Exception):
+            self.prefetcher.count("misses")
+            return None
+        with self._lock:
+            first_use = key not in self.used
+            self.used.add(key)
+        self.prefetcher.count("hits")
+        if first_use:
+            self.prefetcher.count("used")
+        return result
+
+    def fetch_pages(self, urls: list, fetcher) -> list:
+        """Pages for the URLs in order, prefetched ones from the session and the rest through `fetcher`."""
+        pages = {}
+        for url in dict.fromkeys(u for u in urls if u):
+            page = self.lookup_page(url)
+            if page is not None and not page.error:
+                pages[url] = page
+        missing = [u for u in urls if u and u not in pages]
+        pages.update(zip(missing, fetcher.fetch_many(missing)))
+        return [pages[u] for u in urls if u]
+
+    def cancel_pending(self) -> None:
+        """Stop planning and cancel prefetches that have not started; results already fetched stay usable."""
+        with self._lock:
+            self.closed = True
+            futures = [f for _, f in self.searches.values()] + list(self.pages.values())
+        # cancel() is also True for a future cancelled by an earlier call
+        cancelled = sum(1 for future in futures if not future.cancelled() and future.cancel())
+        self.prefetcher.count("cancelled", cancelled)
+
+    def close(self) -> None:
+        self.cancel_pending()
+        with self._lock:
+            issued = len(self.searches) + len(self.pages)
+            unused = issued - len(self.used)
+        self.prefetcher.count("unused", max(0, unused))
+
+
+_session = contextvars.ContextVar("history_buff_prefetch", default=None)
+
+
+def current_session():
+    """The prefetch session of the run in this context, if any."""
+    return _session.get()
+
+
+class Prefetcher:
+    """Runs the prefetches of every session on a small shared pool and keeps the hit-rate counters."""
+
+    def __init__(self, max_workers: int = 4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self.counters = {"issued": 0, "hits": 0, "misses": 0, "used": 0, "cancelled": 0, "unused": 0}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        return self._executor.submit(contextvars.copy_context().run, fn, *args)
+
+    @staticmethod
+    def fetch_page(url: str):
+        from src.history_buff.scraper import get_page_fetcher
+        return get_page_fetcher().fetch(url)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += amount
+
+    @contextmanager
+    def session(self, topic: str, search):
+        """Prefetch for a run inside the block; the tools find the session through current_session()."""
+        session = PrefetchSession(self, topic, search)
+        token = _session.set(session)
+        try:
+            session.plan(plan_topic_queries(topic))
+            yield session
+        finally:
+            _session.reset(token)
+            session.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = round(counters["hits"] / lookups, 3) if lookups else 0.0
+        counters["used_rate"] = round(counters["used"] / counters["issued"], 3) if counters["issued"] else 0.0
+        return counters
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> Prefetcher:
+    """Return the process-wide prefetcher."""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher()
+    return _prefetcher
@@ -0,0 +1,242 @@
+import functools
+import os
+import random
+import threading
+import time
+
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+
+from src.history_buff.instrumentation import current_span
+
+# Status codes worth retrying at the transport level
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Exception class names (from requests, google-api-core, openai/litellm) that mean "try again"
+RETRYABLE_ERRORS = (
+    "RateLimit", "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded",
+    "Timeout", "APIConnectionError", "InternalServerError", "TooManyRequests",
+)
+
+DEFAULT_LIMITS = {
+    "requests_per_minute": 60,
+    "tokens_per_minute": 0,
+    "max_concurrency": 4,
+    "max_retries": 3,
+    "backoff_base": 1.0,
+    "backoff_max": 30.0,
+    "timeout": 30,
+    # Used for the cost estimates in instrumentation spans
+    "prompt_cost_per_1k": 0.0,
+    "completion_cost_per_1k": 0.0,
+    "cost_per_request": 0.0,
+}
+
+
+def estimate_tokens(text) -> int:
+    """Rough token count (about four characters per token)."""
+    return len(str(text or "")) // 4 + 1
+
+
+def status_code_of(error):
+    """Pull an HTTP status code out of the exception types our SDKs raise."""
+    for attr in ("status_code", "code", "http_status"):
+        value = getattr(error, attr, None)
+        if callable(value):
+            try:
+                value = value()
+            except Exception:
+                value = None
+        value = getattr(value, "value", value)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_retryable(error) -> bool:
+    """True for rate limits, server errors, timeouts and dropped connections."""
+    if isinstance(error, (ConnectionError, TimeoutError, requests.exceptions.ConnectionError,
+                          requests.exceptions.Timeout)):
+        return True
+    if status_code_of(error) in RETRYABLE_STATUS:
+        return True
+    name = type(error).__name__
+    return any(marker in name for marker in RETRYABLE_ERRORS)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `per_minute` units per minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = float(per_minute) / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Block until `amount` units are available; return the seconds spent waiting."""
+        if self.rate <= 0:
+            return 0.0
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class ProviderClient:
+    """
+    Gatekeeper for every outbound call to one provider.
+    Applies request and token buckets, a concurrency cap and retries with
+    jittered exponential backoff, and keeps one pooled HTTP session.
+    """
+
+    def __init__(self, name: str, limits: dict = None):
+        self.name = name
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.request_bucket = TokenBucket(self.limits["requests_per_minute"])
+        self.token_bucket = TokenBucket(self.limits["tokens_per_minute"])
+        self._slots = threading.BoundedSemaphore(max(1, int(self.limits["max_concurrency"])))
+        self._session = None
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttled_seconds = 0.0
+        self.backoff_seconds = 0.0
+        self.call_seconds = 0.0
+
+    @property
+    def session(self) -> requests.Session:
+        """Pooled HTTP session shared by every caller of this provider."""
+        with self._lock:
+            if self._session is None:
+                pool_size = max(10, int(self.limits["max_concurrency"]) * 2)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+        return self._session
+
+    def call(self, fn, tokens: int = 0, request=None, consume=None):
+        """
+        Run fn() under this provider's limits, retrying transient failures.
+        `request` is a JSON-serializable description of the call, used to
+        record and replay responses (see benchmark.py); it does not affect live calls.
+        `consume(result)` runs inside the same attempt, so a streamed response is
+        read while the call still holds its concurrency slot and is timed and
+        retried with it; call() returns what consume returns.
+        """
+        if _fixtures is not None and request is not None:
+            fn = functools.partial(_fixtures.handle, self.name, request, fn)
+        if consume is not None:
+            fn = functools.partial(_consumed, fn, consume)
+        attempt = 0
+        while True:
+            waited = self.request_bucket.acquire(1)
+            if tokens:
+                waited += self.token_bucket.acquire(tokens)
+            queued = time.monotonic()
+            with self._slots:
+                waited += time.monotonic() - queued
+                start = time.monotonic()
+                try:
+                    return fn()
+                except Exception as e:
+                    if attempt >= self.limits["max_retries"] or not is_retryable(e):
+                        with self._lock:
+                            self.failures += 1
+                        raise
+                    error = e
+                finally:
+                    current_span().add(throttled_seconds=waited)
+                    with self._lock:
+                        self.calls += 1
+                        self.throttled_seconds += waited
+                        self.call_seconds += time.monotonic() - start
+
+            # Full jitter keeps many workers from retrying in lockstep
+            delay = random.uniform(0, min(self.limits["backoff_max"], self.limits["backoff_base"] * 2 ** attempt))
+            print(f"Retrying {self.name} call after {type(error).__name__} (attempt {attempt + 1}, {delay:.1f}s)")
+            current_span().add(retries=1, backoff_seconds=delay)
+            with self._lock:
+                self.retries += 1
+                self.backoff_seconds += delay
+            time.sleep(delay)
+            attempt += 1
+
+    def cost(self, prompt_tokens: int = 0, completion_tokens: int = 0) -> float:
+        """Estimated US dollar cost of one call with the given token counts."""
+        return (self.limits["cost_per_request"]
+                + prompt_tokens / 1000 * self.limits["prompt_cost_per_1k"]
+                + completion_tokens / 1000 * self.limits["completion_cost_per_1k"])
+
+    def metrics(self) -> dict:
+        """Call, retry and throttling counters for this provider."""
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "backoff_seconds": round(self.backoff_seconds, 3),
+            "call_seconds": round(self.call_seconds, 3),
+        }
+
+
+def _consumed(fn, consume):
+    return consume(fn())
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# When set, calls that describe their request are recorded or replayed through this store
+_fixtures = None
+
+
+def set_fixtures(store) -> None:
+    """Route provider calls through a fixture store (benchmark.FixtureStore), or None for live calls."""
+    global _fixtures
+    _fixtures = store
+
+
+_limits_config = None
+
+
+def _load_limits() -> dict:
+    global _limits_config
+    if _limits_config is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "providers.yaml")
+        try:
+            with open(path, "r") as f:
+                _limits_config = yaml.safe_load(f) or {}
+        except OSError as e:
+            print(f"Warning: Could not read provider limits from {path}: {str(e)}")
+            _limits_config = {}
+    return _limits_config
+
+
+def get_client(name: str) -> ProviderClient:
+    """Return the shared client for a provider (gemini, openai, serper, ...)."""
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = ProviderClient(name, _load_limits().get(name))
+        return _clients[name]
+
+
+def provider_metrics() -> dict:
+    """Metrics for every provider used so far in this process."""
+    with _clients_lock:
+        return {name: client.metrics() for name, client in _clients.items()}
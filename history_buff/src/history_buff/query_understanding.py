@@ -0,0 +1,159 @@
+import json
+import re
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+from src.history_buff.timeline import parse_date
+
+# One Gemini call for the query's intent, type, entities, timeframe and key
+# events (these used to be two separate tool calls by two agents).
+# The reply is parsed leniently (code fences, surrounding prose and trailing
+# commas are repaired locally) and validated against QueryUnderstanding.
+
+PROMPT = """
+    Analyze this historical query: {query}
+    Return only a JSON object with these fields:
+    {{"type": "factual" or "hypothetical",
+      "intent": "academic" or "casual",
+      "entities": [people, places, states, events named or implied by the query],
+      "start_year": first year of the period (negative for BC), "end_year": last year of the period,
+      "locations": [regions or places where it happened],
+      "key_events": [{{"date": "...", "event": "..."}}, up to 8 of the most important]}}
+"""
+
+
+class KeyEvent(BaseModel):
+    date: Optional[str] = None
+    event: str
+
+
+class QueryUnderstanding(BaseModel):
+    """Everything the research stage needs to know about the query."""
+
+    type: Literal["factual", "hypothetical"]
+    intent: Literal["academic", "casual"]
+    entities: List[str] = Field(default_factory=list)
+    start_year: Optional[int] = None
+    end_year: Optional[int] = None
+    locations: List[str] = Field(default_factory=list)
+    key_events: List[KeyEvent] = Field(default_factory=list)
+    source: str = "gemini"
+
+    @field_validator("type", "intent", mode="before")
+    @classmethod
+    def _label(cls, value):
+        # "Factual", "factual/academic" and similar variants
+        return str(value).strip().lower().split("/")[0] if value else value
+
+    @field_validator("entities", "locations", mode="before")
+    @classmethod
+    def _strings(cls, value):
+        if value is None:
+            return []
+        if isinstance(value, str):
+            return [part.strip() for part in value.split(",") if part.strip()]
+        return [item if isinstance(item, str) else (item.get("name") if isinstance(item, dict) else str(item))
+                for item in value if item]
+
+    @field_validator("start_year", "end_year", mode="before")
+    @classmethod
+    def _year(cls, value, info):
+        # "476 AD", "44 BC", "5th century" as well as plain numbers
+        if value is None or isinstance(value, int):
+            return value
+        if isinstance(value, float):
+            return int(value)
+        date = parse_date(str(value))
+        if date is None:
+            return None
+        return date.start if info.field_name == "start_year" else date.end
+
+    @field_validator("key_events", mode="before")
+    @classmethod
+    def _events(cls, value):
+        if not value:
+            return []
+        events = []
+        for item in value:
+            if isinstance(item, str):
+                date, sep, text = item.partition(":")
+                events.append({"date": date.strip(), "event": text.strip()} if sep and parse_date(date)
+                              else {"event": item})
+            elif isinstance(item, dict):
+                text = item.get("event") or item.get("description") or item.get("name")
+                if text:
+                    date = item.get("date") or item.get("year")
+                    events.append({"date": str(date) if date is not None else None, "event": str(text)})
+        return events
+
+
+def repair_json(text: str):
+    """
+    Parse a model's JSON reply, fixing the usual damage first: markdown code
+    fences, prose around the object, trailing commas, smart quotes and
+    Python literals. Raises ValueError when nothing usable is left.
+    """
+    if text is None:
+        raise ValueError("empty response")
+    cleaned = re.sub(r"```(?:json)?", "", str(text)).strip()
+    try:
+        return json.loads(cleaned)
+    except json.JSONDecodeError:
+        pass
+    start, end = cleaned.find("{"), cleaned.rfind("}")
+    if start == -1 or end <= start:
+        raise ValueError("no JSON object in response")
+    cleaned = cleaned[start:end + 1]
+    cleaned = cleaned.replace("“", '"').replace("”", '"').replace("‘", "'").replace("’", "'")
+    cleaned = re.sub(r",\s*([}\]])", r"\1", cleaned)
+    cleaned = re.sub(r"\bNone\b", "null", cleaned)
+    cleaned = re.sub(r"\bTrue\b", "true", cleaned)
+    cleaned = re.sub(r"\bFalse\b", "false", cleaned)
+    try:
+        return json.loads(cleaned)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"unrepairable JSON: {str(e)}")
+
+
+def parse_understanding(text: str) -> QueryUnderstanding:
+    """Validate a Gemini reply against the schema; raises ValueError when it cannot be used."""
+    data = repair_json(text)
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    try:
+        return QueryUnderstanding.model_validate(data)
+    except ValidationError as e:
+        raise ValueError(str(e))
+
+
+def understand_query(query: str, generate) -> QueryUnderstanding:
+    """
+    One structured call for the whole query. `generate(prompt)` returns the
+    model's text. Confident local intent labels override Gemini's, and
+    Gemini's labels are logged for retraining otherwise. When Gemini fails or
+    its reply cannot be used, the local labels are returned on their own
+    (no entities or years), so the stages after this one still run.
+    """
+    from src.history_buff.intent import get_intent_classifier, log_label
+
+    classifier = get_intent_classifier()
+    local = classifier.classify(query)
+    confident = classifier.is_confident(local)
+
+    # Entities and the timeframe always come from Gemini, so this is a Gemini answer
+    # even when the local labels replace Gemini's
+    try:
+        understanding = parse_understanding(generate(PROMPT.format(query=query)))
+    except Exception as e:
+        print(f"Warning: Query understanding from Gemini failed, using the local labels: {str(e)}")
+        classifier.record(local=True)
+        return QueryUnderstanding(type=local["type"], intent=local["intent"], source=local["source"])
+    classifier.record(local=False)
+    if confident:
+        understanding.type = local["type"]
+        understanding.intent = local["intent"]
+        understanding.source = f"gemini+{local['source']}"
+    else:
+        log_label(query, {"type": understanding.type, "intent": understanding.intent})
+    return understanding
@@ -0,0 +1,342 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+import uuid
+import zlib
+
+import yaml
+
+from src.history_buff.cache import CACHE_DIR, cache_enabled
+from src.history_buff.search_cache import STOPWORDS
+from src.history_buff.timeline import parse_date
+
+# Reuse of past reports for near-duplicate topics ("Fall of Rome", "why did
+# Rome fall"). Topics are reduced to a set of stemmed terms plus entity terms,
+# MinHash signatures are indexed with LSH banding, and candidates are checked
+# with exact Jaccard similarity. A close match returns the stored report; a
+# looser match seeds the pipeline with the stored upstream stages. Both need
+# the same entities, numerals ("World War I" vs "II") and years as the topic.
+
+REPORTS_DIR = os.path.join(CACHE_DIR, "reports")
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "report_reuse.yaml")
+
+NUM_HASHES = 64
+BANDS = 32
+ROWS = NUM_HASHES // BANDS
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1234)
+_HASH_PARAMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_HASHES)]
+
+DEFAULT_SETTINGS = {
+    "reuse_threshold": 0.8,
+    "seed_threshold": 0.7,
+    "reuse_max_age_days": 7,
+    "seed_max_age_days": 30,
+    "seed_stages": ["query_understanding", "research"],
+}
+
+# Words that change the phrasing of a topic but not the subject
+TOPIC_STOPWORDS = STOPWORDS | {
+    "about", "after", "before", "during", "explain", "give", "happen", "happened", "history",
+    "me", "overview", "tell", "their", "there", "this", "that", "its", "into",
+}
+
+ORDINALS = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5,
+    "sixth": 6, "seventh": 7, "eighth": 8, "ninth": 9, "tenth": 10,
+}
+_ROMAN = {"I": 1, "V": 5, "X": 10, "L": 50, "C": 100}
+ROMAN_NUMERAL = re.compile(r"^(?:XC|XL|L?X{0,3})(?:IX|IV|V?I{0,3})$")
+
+_SUFFIXES = ("ations", "ation", "ings", "ing", "ians", "ian", "ans", "an", "ed", "es", "s", "e")
+
+
+def stem(word: str) -> str:
+    """Crude suffix stripping so Rome/Roman and empire/empires share a term."""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def roman_value(numeral: str) -> int:
+    values = [_ROMAN[c] for c in numeral]
+    return sum(-v if i + 1 < len(values) and v < values[i + 1] else v for i, v in enumerate(values))
+
+
+def topic_numerals(topic: str) -> dict:
+    """
+    Ordinals and regnal/war numerals in the topic, mapped to their value:
+    "Second", "2nd" and the "II" of "World War II" all give 2. A roman numeral
+    only counts after a capitalized word, so the pronoun "I" is not one.
+    """
+    numerals = {}
+    words = re.findall(r"[A-Za-z0-9][\w'-]*", topic)
+    for i, word in enumerate(words):
+        lower = word.lower()
+        ordinal = re.fullmatch(r"(\d{1,3})(?:st|nd|rd|th)", lower)
+        if lower in ORDINALS:
+            numerals[lower] = ORDINALS[lower]
+        elif ordinal:
+            numerals[lower] = int(ordinal.group(1))
+        elif word.isupper() and ROMAN_NUMERAL.match(word) and i > 0 and words[i - 1][0].isupper():
+            numerals[lower] = roman_value(word)
+    return numerals
+
+
+def topic_entities(topic: str) -> list:
+    """
+    Capitalized names and years in the topic. A capitalized first word only
+    counts when it starts a longer name ("French Revolution", not "Fall of Rome").
+    """
+    entities = re.findall(r"\b\d{3,4}s?\b", topic)
+    numerals = topic_numerals(topic)
+    words = re.findall(r"[A-Za-z][\w'-]*", topic)
+    for i, word in enumerate(words):
+        if not word[0].isupper() or word.lower() in TOPIC_STOPWORDS or word.lower() in numerals:
+            continue
+        if i == 0 and not (len(words) > 1 and words[1][0].isupper()):
+            continue
+        entities.append(word)
+    return entities
+
+
+def topic_terms(topic: str) -> set:
+    """Stemmed content words of the topic plus "e:"-prefixed entity and "n:"-prefixed numeral terms."""
+    topic = unicodedata.normalize("NFKC", str(topic))
+    text = topic.lower()
+    numerals = topic_numerals(topic)
+    terms = {stem(t) for t in re.findall(r"[a-z0-9]+", text) if t not in TOPIC_STOPWORDS and t not in numerals}
+    for entity in topic_entities(topic):
+        terms.add("e:" + stem(entity.lower()))
+    for value in numerals.values():
+        terms.add(f"n:{value}")
+    return terms or {text.strip()}
+
+
+def entity_terms(terms: set) -> set:
+    """The entity, year and numeral terms, which must all agree for a stored run to be used."""
+    return {t for t in terms if t.startswith(("e:", "n:"))}
+
+
+def _year_range(understanding: str):
+    """(start_year, end_year) from a stored query_understanding output, or None."""
+    from src.history_buff.query_understanding import repair_json
+
+    try:
+        data = repair_json(understanding)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    start, end = data.get("start_year"), data.get("end_year")
+    if not isinstance(start, int) and not isinstance(end, int):
+        return None
+    start = start if isinstance(start, int) else end
+    return start, end if isinstance(end, int) else start
+
+
+def years_match(topic: str, entry: dict, outputs: dict) -> bool:
+    """
+    The topic names the same period as the stored one and, when it names one,
+    the stored run's query understanding covers it.
+    """
+    date, stored = parse_date(topic), parse_date(entry["topic"])
+    if date is None or stored is None:
+        return date is None and stored is None
+    if (date.start, date.end) != (stored.start, stored.end):
+        return False
+    if "query_understanding" not in outputs:
+        return True
+    years = _year_range(outputs["query_understanding"])
+    return years is not None and years[0] <= date.end and date.start <= years[1]
+
+
+def minhash(terms: set) -> list:
+    hashes = [zlib.crc32(t.encode("utf-8")) for t in terms]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _HASH_PARAMS]
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def load_settings(path: str = CONFIG_PATH) -> dict:
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(path, "r") as f:
+            settings.update(yaml.safe_load(f) or {})
+    except OSError:
+        pass
+    return settings
+
+
+class ReportMatch:
+    """A stored report close enough to a new topic, and what it can be used for ("reuse" or "seed")."""
+
+    def __init__(self, entry: dict, similarity: float, action: str, outputs: dict):
+        self.entry = entry
+        self.similarity = similarity
+        self.action = action
+        self.outputs = outputs
+
+    @property
+    def topic(self) -> str:
+        return self.entry["topic"]
+
+
+class ReportStore:
+    """
+    Stage outputs of past runs, indexed by topic. Lookups hash the topic into
+    LSH band buckets, so only a handful of candidates are compared.
+    """
+
+    def __init__(self, directory: str = REPORTS_DIR, settings: dict = None):
+        self.directory = directory
+        self.settings = settings or load_settings()
+        self.entries = {}
+        self.buckets = {}
+        self.lookups = 0
+        self.reused = 0
+        self.seeded = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, "index.jsonl")
+
+    def _load(self) -> None:
+        if not os.path.exists(self._index_path):
+            return
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self._index(json.loads(line))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: Could not read report index: {str(e)}")
+
+    def _index(self, entry: dict) -> None:
+        # Recomputed so entries stored before a change to topic_terms are compared alike
+        entry["terms"] = topic_terms(entry["topic"])
+        entry["signature"] = minhash(entry["terms"])
+        self.entries[entry["id"]] = entry
+        for band in self._bands(entry["signature"]):
+            self.buckets.setdefault(band, set()).add(entry["id"])
+
+    @staticmethod
+    def _bands(signature: list):
+        for i in range(BANDS):
+            yield (i, tuple(signature[i * ROWS:(i + 1) * ROWS]))
+
+    def find(self, topic: str, now: float = None) -> ReportMatch:
+        """Best stored match for the topic that is similar and fresh enough, or None."""
+        now = now or time.time()
+        terms = topic_terms(topic)
+        entities = entity_terms(terms)
+        signature = minhash(terms)
+        with self._lock:
+            self.lookups += 1
+            candidates = set()
+            for band in self._bands(signature):
+                candidates |= self.buckets.get(band, set())
+            best, best_similarity = None, 0.0
+            for entry_id in candidates:
+                entry = self.entries[entry_id]
+                if (now - entry["created"]) / 86400 > self.settings["seed_max_age_days"]:
+                    continue
+                # A different ordinal, name or year is a different subject however similar the wording
+                if entity_terms(entry["terms"]) != entities:
+                    continue
+                similarity = jaccard(terms, entry["terms"])
+                if similarity > best_similarity or (similarity == best_similarity and best
+                                                    and entry["created"] > best["created"]):
+                    best, best_similarity = entry, similarity
+
+            if best is None:
+                return None
+            age_days = (now - best["created"]) / 86400
+            if best_similarity >= self.settings["reuse_threshold"] and age_days <= self.settings["reuse_max_age_days"]:
+                action = "reuse"
+            elif best_similarity >= self.settings["seed_threshold"] and age_days <= self.settings["seed_max_age_days"]:
+                action = "seed"
+            else:
+                return None
+
+        stages = best["stages"] if action == "reuse" else \
+            [s for s in best["stages"] if s in self.settings["seed_stages"]]
+        outputs = self._read_outputs(best, stages)
+        if not outputs or not years_match(topic, best, outputs):
+            return None
+        with self._lock:
+            if action == "reuse":
+                self.reused += 1
+            else:
+                self.seeded += 1
+        return ReportMatch(best, round(best_similarity, 3), action, outputs)
+
+    def _read_outputs(self, entry: dict, stages: list) -> dict:
+        outputs = {}
+        for stage in stages:
+            try:
+                with open(os.path.join(self.directory, entry["id"], f"{stage}.md"), "r", encoding="utf-8") as f:
+                    outputs[stage] = f.read()
+            except OSError:
+                continue
+        return outputs
+
+    def add(self, topic: str, outputs: dict) -> str:
+        """Store every stage's output for a finished run; returns the entry id."""
+        terms = topic_terms(topic)
+        entry = {
+            "id": f"{int(time.time())}-{uuid.uuid4().hex[:8]}",
+            "topic": topic,
+            "terms": sorted(terms),
+            "signature": minhash(terms),
+            "created": time.time(),
+            "stages": sorted(outputs),
+        }
+        entry_dir = os.path.join(self.directory, entry["id"])
+        os.makedirs(entry_dir, exist_ok=True)
+        for stage, text in outputs.items():
+            with open(os.path.join(entry_dir, f"{stage}.md"), "w", encoding="utf-8") as f:
+                f.write(text)
+        # The index line is appended only after the stage files exist
+        with self._lock:
+            with open(self._index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+            self._index(entry)
+        return entry["id"]
+
+    def stats(self) -> dict:
+        hits = self.reused + self.seeded
+        return {
+            "entries": len(self.entries),
+            "lookups": self.lookups,
+            "reused": self.reused,
+            "seeded": self.seeded,
+            "hit_rate": round(hits / self.lookups, 3) if self.lookups else 0.0,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def reuse_enabled() -> bool:
+    return cache_enabled("HISTORY_BUFF_REPORT_REUSE")
+
+
+def get_report_store() -> ReportStore:
+    """Return the process-wide report store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ReportStore()
+    return _store
@@ -0,0 +1,260 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import yaml
+
+from src.history_buff.providers import estimate_tokens
+
+# Chooses the model for every agent step and tool call. Each agent and tool is
+# assigned a tier (agents.yaml); the router keeps to it unless the report's
+# budget is running out, in which case it drops to a cheaper, faster tier, and
+# moves a call up a tier only when its output fails validation. Decisions that
+# differ from the configured tier are logged with their cost and latency impact.
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config")
+ROUTING_PATH = os.path.join(CONFIG_DIR, "routing.yaml")
+AGENTS_PATH = os.path.join(CONFIG_DIR, "agents.yaml")
+
+DEFAULT_TIER = "fast"
+
+
+class Tier:
+    def __init__(self, name: str, model: str, prompt_cost_per_1k: float = 0.0,
+                 completion_cost_per_1k: float = 0.0, typical_seconds: float = 0.0):
+        self.name = name
+        self.model = model
+        self.prompt_cost_per_1k = prompt_cost_per_1k
+        self.completion_cost_per_1k = completion_cost_per_1k
+        self.typical_seconds = typical_seconds
+
+    def cost(self, prompt_tokens: int, completion_tokens: int = 0) -> float:
+        return (prompt_tokens * self.prompt_cost_per_1k + completion_tokens * self.completion_cost_per_1k) / 1000
+
+
+class RequestBudget:
+    """Cost and wall-time allowance for one report."""
+
+    def __init__(self, max_cost_usd: float = 0.0, max_seconds: float = 0.0):
+        self.max_cost_usd = max_cost_usd
+        self.max_seconds = max_seconds
+        self.started = time.perf_counter()
+        self.spent_usd = 0.0
+        self._lock = threading.Lock()
+
+    def spend(self, cost: float) -> None:
+        with self._lock:
+            self.spent_usd += cost
+
+    @property
+    def remaining_usd(self) -> float:
+        return self.max_cost_usd - self.spent_usd if self.max_cost_usd else float("inf")
+
+    @property
+    def remaining_seconds(self) -> float:
+        return self.max_seconds - (time.perf_counter() - self.started) if self.max_seconds else float("inf")
+
+    def remaining_share(self) -> float:
+        """The smaller of the cost and time shares still left (1.0 when unlimited)."""
+        shares = [1.0]
+        if self.max_cost_usd:
+            shares.append(self.remaining_usd / self.max_cost_usd)
+        if self.max_seconds:
+            shares.append(self.remaining_seconds / self.max_seconds)
+        return max(0.0, min(shares))
+
+
+_budget = contextvars.ContextVar("history_buff_budget", default=None)
+
+
+def current_budget():
+    """The budget of the report being produced in this context, if any."""
+    return _budget.get()
+
+
+class Route:
+    """The tier a call was configured for and the one it actually uses."""
+
+    def __init__(self, provider: str, target: str, requested: Tier, tier: Tier, reason: str = "configured"):
+        self.provider = provider
+        self.target = target
+        self.requested = requested
+        self.tier = tier
+        self.reason = reason
+
+    @property
+    def model(self) -> str:
+        return self.tier.model
+
+
+class Router:
+    """Maps agents and tools to model tiers and keeps per-tier call statistics."""
+
+    def __init__(self, tiers: dict = None, targets: dict = None, budget: dict = None, downgrade_below: float = 0.25):
+        # provider -> list of Tier, cheapest first
+        self.tiers = {provider: [Tier(name, **spec) for name, spec in entries.items()]
+                      for provider, entries in (tiers or {}).items()}
+        self.targets = targets or {}
+        self.budget = budget or {}
+        self.downgrade_below = downgrade_below
+        self.calls = {}
+        self.downgrades = 0
+        self.escalations = 0
+        self.saved_usd = 0.0
+        self.saved_seconds = 0.0
+        self.escalation_usd = 0.0
+        self.escalation_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, routing_path: str = ROUTING_PATH, agents_path: str = AGENTS_PATH) -> "Router":
+        settings = _read_yaml(routing_path)
+        agents = _read_yaml(agents_path)
+        targets = {}
+        for name, config in agents.items():
+            if isinstance(config, dict) and config.get("tier") and name != "routing":
+                targets[name] = config["tier"]
+        routing = agents.get("routing") or {}
+        targets.update(routing.get("tools") or {})
+        if routing.get("manager"):
+            targets["manager"] = routing["manager"]
+        budget = dict(settings.get("budget") or {})
+        if os.getenv("HISTORY_BUFF_BUDGET_USD"):
+            budget["max_cost_usd"] = float(os.environ["HISTORY_BUFF_BUDGET_USD"])
+        if os.getenv("HISTORY_BUFF_BUDGET_SECONDS"):
+            budget["max_seconds"] = float(os.environ["HISTORY_BUFF_BUDGET_SECONDS"])
+        return cls(settings.get("tiers"), targets, budget, settings.get("downgrade_below", 0.25))
+
+    def tier(self, provider: str, name: str = None) -> Tier:
+        """The named tier of a provider (its cheapest tier if the name is unknown)."""
+        tiers = self.tiers.get(provider)
+        if not tiers:
+            return Tier(name or DEFAULT_TIER, "gpt-3.5-turbo" if provider == "openai" else "gemini-pro")
+        return next((t for t in tiers if t.name == name), tiers[0])
+
+    def tier_for(self, target: str) -> str:
+        return self.targets.get(target, DEFAULT_TIER)
+
+    @contextmanager
+    def request_budget(self):
+        """Budget for the report produced inside the block (and any threads started with its context)."""
+        budget = RequestBudget(float(self.budget.get("max_cost_usd") or 0), float(self.budget.get("max_seconds") or 0))
+        token = _budget.set(budget)
+        try:
+            yield budget
+        finally:
+            _budget.reset(token)
+
+    def route(self, provider: str, target: str, prompt_tokens: int = 0, tier: str = None) -> Route:
+        """Pick the tier for one call: the configured one, or a cheaper one when the budget is running out."""
+        requested = self.tier(provider, tier or self.tier_for(target))
+        route = Route(provider, target, requested, requested)
+        budget = current_budget()
+        tiers = self.tiers.get(provider)
+        if budget is None or not tiers or requested is tiers[0]:
+            return route
+        cheapest = tiers[0]
+        share = budget.remaining_share()
+        if share < self.downgrade_below:
+            route.tier, route.reason = cheapest, f"budget ({share:.0%} left)"
+        elif requested.cost(prompt_tokens, prompt_tokens // 2) > budget.remaining_usd:
+            route.tier, route.reason = cheapest, f"cost (${budget.remaining_usd:.4f} left)"
+        elif requested.typical_seconds > budget.remaining_seconds:
+            route.tier, route.reason = cheapest, f"latency ({budget.remaining_seconds:.0f}s left)"
+        return route
+
+    def escalate(self, route: Route, reason: str = "invalid output"):
+        """Route for retrying a call on the next bigger tier, or None when there is none or no budget for it."""
+        tiers = self.tiers.get(route.provider) or []
+        if route.tier not in tiers or tiers.index(route.tier) + 1 >= len(tiers):
+            return None
+        budget = current_budget()
+        if budget is not None and budget.remaining_share() < self.downgrade_below:
+            return None
+        bigger = tiers[tiers.index(route.tier) + 1]
+        return Route(route.provider, route.target, route.requested, bigger, f"escalated: {reason}")
+
+    def record(self, route: Route, seconds: float, prompt_tokens: int, completion_tokens: int) -> float:
+        """Account for a finished call; returns its estimated cost."""
+        cost = route.tier.cost(prompt_tokens, completion_tokens)
+        budget = current_budget()
+        if budget is not None:
+            budget.spend(cost)
+        with self._lock:
+            entry = self.calls.setdefault(f"{route.provider}:{route.tier.name}",
+                                          {"model": route.model, "calls": 0, "seconds": 0.0, "cost_usd": 0.0})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["cost_usd"] += cost
+            if route.reason.startswith("escalated"):
+                self.escalations += 1
+                self.escalation_usd += cost
+                self.escalation_seconds += seconds
+            elif route.tier is not route.requested:
+                saved_usd = route.requested.cost(prompt_tokens, completion_tokens) - cost
+                saved_seconds = route.requested.typical_seconds - route.tier.typical_seconds
+                self.downgrades += 1
+                self.saved_usd += saved_usd
+                self.saved_seconds += saved_seconds
+        if route.tier is not route.requested:
+            print(f"Routing: {route.target} {route.requested.name} -> {route.tier.name} ({route.model}), "
+                  f"{route.reason}: {seconds:.1f}s, ${cost:.4f}")
+        return cost
+
+    def generate(self, provider: str, target: str, call, prompt: str, validate=None) -> str:
+        """
+        Run `call(model_name) -> text` on the routed tier. When `validate(text)`
+        raises ValueError the call is repeated once per bigger tier available.
+        """
+        prompt_tokens = estimate_tokens(prompt)
+        route = self.route(provider, target, prompt_tokens)
+        while True:
+            start = time.perf_counter()
+            text = call(route.model)
+            self.record(route, time.perf_counter() - start, prompt_tokens, estimate_tokens(text))
+            if validate is None:
+                return text
+            try:
+                validate(text)
+                return text
+            except ValueError as e:
+                bigger = self.escalate(route, str(e)[:80])
+                if bigger is None:
+                    return text
+                route = bigger
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tiers": {name: {**entry, "seconds": round(entry["seconds"], 2), "cost_usd": round(entry["cost_usd"], 4)}
+                          for name, entry in self.calls.items()},
+                "downgrades": self.downgrades,
+                "downgrade_saved_usd": round(self.saved_usd, 4),
+                "downgrade_saved_seconds": round(self.saved_seconds, 1),
+                "escalations": self.escalations,
+                "escalation_cost_usd": round(self.escalation_usd, 4),
+                "escalation_seconds": round(self.escalation_seconds, 1),
+            }
+
+
+def _read_yaml(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return yaml.safe_load(f) or {}
+    except OSError:
+        return {}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> Router:
+    """Return the process-wide router."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = Router.from_config()
+    return _router
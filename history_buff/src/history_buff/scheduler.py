@@ -0,0 +1,249 @@
+import contextvars
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.history_buff.instrumentation import span
+from src.history_buff.streaming import write_atomic
+
+# Same divider CrewAI uses when it joins upstream task outputs into a context
+CONTEXT_DIVIDER = "\n\n----------\n\n"
+
+
+def task_dependencies(tasks_config: dict) -> dict:
+    """Read `depends_on` from tasks.yaml into a {task: [upstream tasks]} mapping."""
+    deps = {}
+    for name, config in tasks_config.items():
+        upstream = config.get("depends_on") or []
+        if isinstance(upstream, str):
+            upstream = [upstream]
+        deps[name] = list(upstream)
+    return deps
+
+
+def is_static_graph(tasks_config: dict) -> bool:
+    """A graph is static when every task declares its dependencies up front."""
+    return all("depends_on" in config for config in tasks_config.values())
+
+
+def topological_order(deps: dict) -> list:
+    """Order tasks so every task comes after its dependencies (config order kept for ties)."""
+    for name, upstream in deps.items():
+        missing = [d for d in upstream if d not in deps]
+        if missing:
+            raise ValueError(f"Task '{name}' depends on unknown task(s): {', '.join(missing)}")
+
+    order = []
+    state = {}
+
+    def visit(name, path):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Dependency cycle detected: {' -> '.join(path + [name])}")
+        state[name] = "visiting"
+        for upstream in deps[name]:
+            visit(upstream, path + [name])
+        state[name] = "done"
+        order.append(name)
+
+    for name in deps:
+        visit(name, [])
+    return order
+
+
+def downstream_of(deps: dict, stage: str) -> list:
+    """The stage and every task that depends on it, directly or not, in dependency order."""
+    affected = {stage}
+    for name in topological_order(deps):
+        if any(d in affected for d in deps[name]):
+            affected.add(name)
+    return [name for name in topological_order(deps) if name in affected]
+
+
+def critical_path(deps: dict, durations: dict) -> tuple:
+    """Return (length in seconds, task names) of the longest dependency chain."""
+    finish = {}
+    previous = {}
+    for name in topological_order(deps):
+        best = max(deps[name], key=lambda d: finish[d], default=None)
+        previous[name] = best
+        finish[name] = durations.get(name, 0.0) + (finish[best] if best else 0.0)
+    if not finish:
+        return 0.0, []
+    node = max(finish, key=finish.get)
+    length = finish[node]
+    path = []
+    while node:
+        path.append(node)
+        node = previous[node]
+    return length, list(reversed(path))
+
+
+class ScheduleResult:
+    """Outputs and timings of one scheduled run."""
+
+    def __init__(self, outputs: dict, timings: dict, deps: dict, wall_time: float):
+        self.outputs = outputs
+        self.timings = timings
+        self.deps = deps
+        self.wall_time = wall_time
+        durations = {name: end - start for name, (start, end) in timings.items()}
+        self.serial_time = sum(durations.values())
+        self.critical_path_time, self.critical_path = critical_path(deps, durations)
+
+    @property
+    def final_output(self):
+        """Output of the last task in dependency order."""
+        return self.outputs[topological_order(self.deps)[-1]]
+
+    @property
+    def raw(self) -> str:
+        output = self.final_output
+        return getattr(output, "raw", str(output))
+
+    def summary(self) -> str:
+        lines = ["Stage timings:"]
+        for name in topological_order(self.deps):
+            if name in self.timings:
+                start, end = self.timings[name]
+                lines.append(f"  {name:<20} {end - start:8.2f}s")
+        lines.append(f"  {'wall time':<20} {self.wall_time:8.2f}s")
+        lines.append(f"  {'serial time':<20} {self.serial_time:8.2f}s")
+        lines.append(
+            f"  {'critical path':<20} {self.critical_path_time:8.2f}s ({' -> '.join(self.critical_path)})"
+        )
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.raw
+
+
+class ToolOutput:
+    """Output of a ToolTask, with the `raw` text the scheduler and downstream tasks read."""
+
+    def __init__(self, raw: str, data=None):
+        self.raw = raw
+        self.data = data
+
+    def __str__(self):
+        return self.raw
+
+
+class ToolTask:
+    """
+    A stage answered by calling one tool directly, without an agent turn
+    around it (tasks with a `tool:` key in tasks.yaml). Upstream context is
+    not passed to the tool; its arguments come from `tool_args`.
+    """
+
+    def __init__(self, tool, arguments: dict, output_file: str = None):
+        self.tool = tool
+        self.arguments = arguments
+        self.output_file = output_file
+        self.agent = None
+
+    def execute_sync(self, agent=None, context=None) -> ToolOutput:
+        result = self.tool.run(**self.arguments)
+        if isinstance(result, dict) and result.get("error"):
+            raise RuntimeError(f"{self.tool.name} failed: {result['error']}")
+        if isinstance(result, str) and result.startswith("Error:"):
+            raise RuntimeError(f"{self.tool.name} failed: {result[len('Error:'):].strip()}")
+        raw = result if isinstance(result, str) else json.dumps(result, indent=2, ensure_ascii=False)
+        if self.output_file:
+            write_atomic(self.output_file, raw)
+        return ToolOutput(raw, result)
+
+
+class DagScheduler:
+    """
+    Runs CrewAI tasks as a dependency graph instead of a fixed chain.
+    Every task whose upstream tasks are finished is started right away on a
+    thread pool, so independent stages overlap. No manager LLM is involved.
+    """
+
+    def __init__(self, max_workers: int = 4, agent_locks: dict = None, compact=None):
+        self.max_workers = max_workers
+        # compact(task name, upstream outputs) -> context string, for token-budgeted context
+        self.compact = compact
+        # Keyed by id(agent); shared locks let several runs use the same agents safely
+        self.agent_locks = agent_locks if agent_locks is not None else {}
+
+    def run(self, tasks: dict, deps: dict, streamer=None, precomputed: dict = None,
+            checkpoints=None, on_finish=None) -> ScheduleResult:
+        """
+        Run every task once its dependencies are done.
+        An optional streamer (see streaming.StageStreamer) is told when each stage starts and ends.
+        Tasks in `precomputed` (name -> output) are not run; their outputs feed downstream tasks as is.
+        With `checkpoints` (see checkpoints.RunCheckpoints) a task whose checkpoint matches its
+        upstream outputs is restored instead of run, and every finished task is checkpointed.
+        `on_finish(name, output)` is called as each task finishes.
+        """
+        order = topological_order(deps)
+        outputs = dict(precomputed or {})
+        timings = {}
+        agent_locks = self.agent_locks
+        for name in order:
+            if name in outputs:
+                continue
+            agent_locks.setdefault(id(tasks[name].agent), threading.Lock())
+
+        def execute(name):
+            task = tasks[name]
+            upstream = [getattr(outputs[d], "raw", str(outputs[d])) for d in deps[name]]
+            if checkpoints is not None:
+                restored = checkpoints.load(name, upstream)
+                if restored is not None:
+                    print(f"Restored {name} from checkpoint")
+                    now = time.perf_counter()
+                    timings[name] = (now, now)
+                    return restored
+            if self.compact is not None and upstream:
+                context = self.compact(name, upstream)
+            else:
+                context = CONTEXT_DIVIDER.join(upstream)
+            # An agent keeps per-run state, so tasks sharing one never overlap
+            with agent_locks[id(task.agent)], span(name, "task", agent=getattr(task.agent, "role", None)):
+                start = time.perf_counter()
+                if streamer is not None:
+                    streamer.start_stage(name, task.agent)
+                try:
+                    output = task.execute_sync(agent=task.agent, context=context or None)
+                except Exception:
+                    if streamer is not None:
+                        streamer.fail_stage(name, task.agent)
+                    raise
+                if streamer is not None:
+                    streamer.finish_stage(name, task.agent, output)
+                timings[name] = (start, time.perf_counter())
+            if checkpoints is not None:
+                checkpoints.save(name, upstream, getattr(output, "raw", str(output)))
+            return output
+
+        started = time.perf_counter()
+        pending = {}
+        remaining = [name for name in order if name not in outputs]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while remaining or pending:
+                for name in [n for n in remaining if all(d in outputs for d in deps[n])]:
+                    remaining.remove(name)
+                    print(f"Starting task: {name}")
+                    # Workers see the caller's context (the report's routing budget)
+                    pending[pool.submit(contextvars.copy_context().run, execute, name)] = name
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = pending.pop(future)
+                    try:
+                        outputs[name] = future.result()
+                    except Exception:
+                        for other in pending:
+                            other.cancel()
+                        raise
+                    print(f"Finished task: {name}")
+                    if on_finish is not None:
+                        on_finish(name, outputs[name])
+
+        wall_time = time.perf_counter() - started
+        offset = {name: (s - started, e - started) for name, (s, e) in timings.items()}
+        return ScheduleResult(outputs, offset, deps, wall_time)
@@ -0,0 +1,550 @@
+import codecs
+import contextvars
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from src.history_buff.cache import CACHE_DIR
+from src.history_buff.instrumentation import current_span, span
+from src.history_buff.memory import SpillBuffer, current_memory_budget
+from src.history_buff.providers import get_client
+
+PAGE_CACHE_DIR = os.path.join(CACHE_DIR, "pages")
+# Pages younger than this are served from disk without revalidation
+PAGE_FRESH_SECONDS = int(os.getenv("HISTORY_BUFF_PAGE_FRESH_SECONDS", str(6 * 3600)))
+MAX_PAGE_BYTES = int(os.getenv("HISTORY_BUFF_MAX_PAGE_BYTES", str(1024 * 1024)))
+# Extracted text kept per page; passages past it are dropped and the page marked truncated
+MAX_PAGE_CHARS = int(os.getenv("HISTORY_BUFF_MAX_PAGE_CHARS", "200000"))
+
+USER_AGENT = "Mozilla/5.0 (compatible; HistoryBuff/0.1; +https://github.com/Lucyfer1865/LLM_Project)"
+
+# Elements whose whole subtree is boilerplate
+SKIP_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form",
+             "svg", "iframe", "button", "select", "template", "figure"}
+# Elements that end a block of text
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "ul", "ol", "table", "tr", "td", "th",
+              "blockquote", "pre", "h1", "h2", "h3", "h4", "h5", "h6", "dd", "dt", "br", "hr"}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+             "param", "source", "track", "wbr"}
+# class/id fragments that mark navigation, ads and other chrome
+BOILERPLATE_HINT = re.compile(
+    r"(?:^|[\s_-])(nav|navbar|menu|footer|header|sidebar|cookie|banner|advert|ads?|promo|share|social|"
+    r"comments?|related|breadcrumbs?|subscribe|newsletter|popup|modal)(?:$|[\s_-])", re.I
+)
+MIN_BLOCK_CHARS = 40
+# Media types we extract text from; anything else (PDFs, images, JSON, ...) is reported unsupported
+HTML_TYPES = {"text/html", "application/xhtml+xml"}
+TEXT_TYPES = HTML_TYPES | {"text/plain"}
+
+
+def media_type(content_type: str) -> str:
+    """The media type of a Content-Type header, without parameters: "text/html; charset=utf-8" -> "text/html"."""
+    return (content_type or "").split(";")[0].strip().lower()
+
+
+def is_supported(content_type: str) -> bool:
+    """True for HTML and plain text; a missing header counts as HTML."""
+    media = media_type(content_type)
+    return not media or media in TEXT_TYPES
+
+
+def _content_type(headers) -> str:
+    # Replayed fixtures hold a plain dict, so the lookup cannot rely on requests' case-insensitive headers
+    return next((value for name, value in dict(headers or {}).items() if name.lower() == "content-type"), "")
+
+
+class _ArticleParser(HTMLParser):
+    """
+    Collects text blocks outside boilerplate, remembering which were inside
+    <article>/<main>. At most max_chars of text are kept inside and outside
+    the main region each.
+    """
+
+    def __init__(self, max_chars: int = MAX_PAGE_CHARS):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.blocks = []
+        self.max_chars = max_chars
+        self.truncated = False
+        self._kept_chars = {True: 0, False: 0}
+        self._in_title = False
+        self._skip_depth = 0
+        self._stack = []
+        self._main_depth = 0
+        self._buffer = []
+        self._link_chars = 0
+        self._in_link = 0
+        self._heading = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            if tag == "br" and not self._skip_depth:
+                self._flush()
+            return
+        attrs = dict(attrs)
+        hint = f"{attrs.get('class', '')} {attrs.get('id', '')} {attrs.get('role', '')}"
+        skip = tag in SKIP_TAGS or bool(BOILERPLATE_HINT.search(hint)) or attrs.get("aria-hidden") == "true"
+        self._stack.append((tag, skip))
+        if skip:
+            self._skip_depth += 1
+            return
+        if tag == "title":
+            self._in_title = True
+        if tag in ("article", "main") or attrs.get("role") == "main":
+            self._main_depth += 1
+        if tag == "a":
+            self._in_link += 1
+        if tag in BLOCK_TAGS:
+            self._flush()
+            self._heading = tag in HEADING_TAGS
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS:
+            return
+        # Pop up to the matching open tag; tolerate unclosed children
+        while self._stack:
+            open_tag, skip = self._stack.pop()
+            if skip:
+                self._skip_depth -= 1
+            elif open_tag in ("article", "main"):
+                self._flush()
+                self._main_depth = max(0, self._main_depth - 1)
+            elif open_tag == "a":
+                self._in_link = max(0, self._in_link - 1)
+            elif open_tag == "title":
+                self._in_title = False
+            if open_tag == tag:
+                break
+        if tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+            return
+        if self._skip_depth:
+            return
+        self._buffer.append(data)
+        if self._in_link:
+            self._link_chars += len(data.strip())
+
+    def _flush(self):
+        text = re.sub(r"\s+", " ", "".join(self._buffer)).strip()
+        in_main = self._main_depth > 0
+        if text and self._kept_chars[in_main] >= self.max_chars:
+            self.truncated = True
+        elif text:
+            self._kept_chars[in_main] += len(text)
+            self.blocks.append({
+                "text": text,
+                "in_main": in_main,
+                "heading": self._heading,
+                "link_density": self._link_chars / max(len(text), 1),
+            })
+        self._buffer = []
+        self._link_chars = 0
+        self._heading = False
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def extract_article(html: str) -> tuple:
+    """Return (title, [passages]) with navigation, link lists and other boilerplate removed."""
+    extractor = PageExtractor("text/html")
+    extractor.feed_text(html)
+    return extractor.close()
+
+
+def _article_passages(parser: _ArticleParser) -> tuple:
+    blocks = parser.blocks
+    # Prefer the <article>/<main> region when the page has a substantial one
+    main_blocks = [b for b in blocks if b["in_main"]]
+    if sum(len(b["text"]) for b in main_blocks) >= 200:
+        blocks = main_blocks
+    passages = []
+    for block in blocks:
+        if block["link_density"] > 0.5:
+            continue
+        if block["heading"] or len(block["text"]) >= MIN_BLOCK_CHARS:
+            passages.append(block["text"])
+    return re.sub(r"\s+", " ", parser.title).strip(), passages
+
+
+class PageExtractor:
+    """
+    Extracts (title, passages) from a response body fed in chunks as they are
+    downloaded, so the raw body is never held whole. HTML goes through the
+    article parser; other text is split on blank lines.
+    """
+
+    def __init__(self, content_type: str = "", max_chars: int = MAX_PAGE_CHARS):
+        charset = re.search(r"charset=([\w-]+)", content_type)
+        try:
+            self._decoder = codecs.getincrementaldecoder(charset.group(1) if charset else "utf-8")(errors="replace")
+        except LookupError:
+            self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        media = media_type(content_type)
+        self.html = media in HTML_TYPES or not media
+        self.max_chars = max_chars
+        self.truncated = False
+        self._parser = _ArticleParser(max_chars) if self.html else None
+        self._failed = False
+        self._tail = ""
+        self._passages = []
+        self._kept_chars = 0
+
+    def feed(self, data: bytes) -> None:
+        self.feed_text(self._decoder.decode(data))
+
+    def feed_text(self, text: str) -> None:
+        if self.html:
+            if not self._failed:
+                try:
+                    self._parser.feed(text)
+                except Exception as e:
+                    self._failed = True
+                    print(f"Warning: HTML parse error: {str(e)}")
+            return
+        parts = re.split(r"\n\s*\n", self._tail + text)
+        self._tail = parts.pop()
+        for part in parts:
+            self._add(part)
+
+    def _add(self, part: str) -> None:
+        part = part.strip()
+        if not part:
+            return
+        if self._kept_chars >= self.max_chars:
+            self.truncated = True
+            return
+        self._passages.append(part)
+        self._kept_chars += len(part)
+
+    def close(self) -> tuple:
+        self.feed_text(self._decoder.decode(b"", final=True))
+        if not self.html:
+            self._add(self._tail)
+            self._tail = ""
+            return "", self._passages
+        if not self._failed:
+            try:
+                self._parser.close()
+            except Exception as e:
+                print(f"Warning: HTML parse error: {str(e)}")
+        self.truncated = self.truncated or self._parser.truncated
+        return _article_passages(self._parser)
+
+
+class ExtractedPage:
+    """
+    Extracted text of one page plus the (start, end) offset of every passage.
+    The passages live in a SpillBuffer, so pages held by a run count against
+    its memory budget and move to disk when it is used up.
+    """
+
+    def __init__(self, url: str, title: str = "", text: str = "", offsets: list = None, status: int = 0,
+                 truncated: bool = False, from_cache: bool = False, error: str = None, passages: list = None):
+        self.url = url
+        self.title = title
+        self.offsets = offsets or ([(0, len(text))] if text else [])
+        self.status = status
+        self.truncated = truncated
+        self.from_cache = from_cache
+        self.error = error
+        self._passages = SpillBuffer()
+        for passage in passages if passages is not None else (text[start:end] for start, end in self.offsets):
+            self._passages.write(passage)
+
+    @classmethod
+    def from_passages(cls, url: str, title: str, passages: list, max_chars: int = MAX_PAGE_CHARS, **kwargs):
+        offsets = []
+        kept = []
+        position = 0
+        for passage in passages:
+            if position + len(passage) > max_chars and kept:
+                kwargs["truncated"] = True
+                break
+            offsets.append((position, position + len(passage)))
+            kept.append(passage)
+            position += len(passage) + 2
+        return cls(url, title, offsets=offsets, passages=kept, **kwargs)
+
+    @property
+    def text(self) -> str:
+        """The whole text (passages joined by blank lines); passages() avoids building it."""
+        return self._passages.getvalue("\n\n")
+
+    @property
+    def length(self) -> int:
+        return self.offsets[-1][1] if self.offsets else 0
+
+    def passages(self):
+        """Yield (start, end, text) for each passage."""
+        for (start, end), passage in zip(self.offsets, self._passages.chunks()):
+            yield start, end, passage
+
+    def to_dict(self) -> dict:
+        """Everything but the passages, which PageCache.put writes one at a time."""
+        return {"url": self.url, "title": self.title, "offsets": self.offsets,
+                "status": self.status, "truncated": self.truncated}
+
+
+class PageCache:
+    """
+    Sharded on-disk store of extracted pages plus their ETag/Last-Modified
+    validators. Entries hold a "passages" list; entries written before that
+    hold the joined "text" instead, and readers accept both.
+    """
+
+    def __init__(self, directory: str = PAGE_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, url: str) -> str:
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def get(self, url: str):
+        try:
+            with open(self._path(url), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, url: str, entry: dict, passages=None) -> None:
+        """Store an entry; `passages` (any iterable of strings) is written one at a time as its "passages"."""
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            if passages is None:
+                json.dump(entry, f)
+            else:
+                head = json.dumps(entry)[:-1]
+                f.write(head + (', "passages": [' if entry else '"passages": ['))
+                for i, passage in enumerate(passages):
+                    f.write((", " if i else "") + json.dumps(passage))
+                f.write("]}")
+        os.replace(tmp_path, path)
+
+    def clear(self) -> None:
+        """Remove every cached page."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def entries(self):
+        """Yield every cached page entry (used by the knowledge index)."""
+        if not os.path.isdir(self.directory):
+            return
+        for shard in sorted(os.listdir(self.directory)):
+            shard_dir = os.path.join(self.directory, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in sorted(os.listdir(shard_dir)):
+                if name.endswith(".json"):
+                    try:
+                        with open(os.path.join(shard_dir, name), "r", encoding="utf-8") as f:
+                            yield json.load(f)
+                    except (OSError, json.JSONDecodeError):
+                        continue
+
+
+class PageFetcher:
+    """
+    Fetches many URLs concurrently with a per-host connection limit and a byte
+    cap per page, extracts the article text and caches it on disk. Stale cache
+    entries are revalidated with If-None-Match / If-Modified-Since.
+    """
+
+    def __init__(self, cache: PageCache = None, max_workers: int = 8, per_host: int = 2,
+                 max_bytes: int = MAX_PAGE_BYTES, timeout: float = 15, fresh_seconds: int = PAGE_FRESH_SECONDS):
+        self.cache = cache or PageCache()
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.fresh_seconds = fresh_seconds
+        self._host_slots = {}
+        self._lock = threading.Lock()
+        self.fetched = 0
+        self.cache_hits = 0
+        self.revalidated = 0
+        self.bytes_downloaded = 0
+
+    def _slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def fetch_many(self, urls: list) -> list:
+        """Fetch every URL (duplicates fetched once) and return pages in input order."""
+        unique = list(dict.fromkeys(u for u in urls if u))
+        if not unique:
+            return []
+        # Each fetch runs in a copy of this context, so its page counts against the run's memory budget
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(unique))) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, self.fetch, url) for url in unique]
+            pages = dict(zip(unique, (future.result() for future in futures)))
+        return [pages[u] for u in urls if u]
+
+    def fetch(self, url: str) -> ExtractedPage:
+        """Fetch one URL, using the disk cache when it is fresh or still valid."""
+        with span("scrape", "request", host=urlsplit(url).netloc) as request:
+            page = self._fetch(url)
+            request.set(cache_hit=int(page.from_cache), status=page.status)
+            return page
+
+    def _fetch(self, url: str) -> ExtractedPage:
+        cached = self.cache.get(url)
+        if cached and time.time() - cached.get("fetched_at", 0) < self.fresh_seconds:
+            with self._lock:
+                self.cache_hits += 1
+            return self._page(url, cached, from_cache=True)
+
+        headers = {"User-Agent": USER_AGENT}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        client = get_client("scrape")
+        try:
+            with self._slot(url):
+                status, response_headers, extracted, truncated = client.call(
+                    lambda: self._download(client, url, headers),
+                    request={"url": url}
+                )
+        except Exception as e:
+            if cached:
+                return self._page(url, cached, from_cache=True)
+            return ExtractedPage(url, error=f"Error fetching {url}: {str(e)}")
+
+        if status == 304 and cached:
+            cached["fetched_at"] = time.time()
+            self.cache.put(url, cached)
+            with self._lock:
+                self.revalidated += 1
+            return self._page(url, cached, from_cache=True)
+        if status >= 400:
+            return ExtractedPage(url, status=status, error=f"HTTP {status} for {url}")
+        content_type = _content_type(response_headers)
+        if not is_supported(content_type):
+            # Not cached: the next run should not skip a URL whose content type changes
+            return ExtractedPage(url, status=status, error=f"unsupported content type {media_type(content_type)} for {url}")
+
+        page = ExtractedPage.from_passages(url, extracted["title"], extracted.pop("passages"),
+                                           status=status, truncated=truncated)
+        entry = page.to_dict()
+        entry.update({
+            "etag": response_headers.get("ETag"),
+            "last_modified": response_headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+        })
+        # Written from the page's buffer passage by passage, never as one joined string
+        self.cache.put(url, entry, (passage for _, _, passage in page.passages()))
+        current_span().add(bytes=extracted["bytes"])
+        with self._lock:
+            self.fetched += 1
+            self.bytes_downloaded += extracted["bytes"]
+        return page
+
+    def _download(self, client, url: str, headers: dict) -> tuple:
+        """
+        GET the URL reading at most max_bytes of the body, extracting passages
+        as the chunks arrive. Returns (status, headers, extracted, truncated)
+        with extracted = {"title", "passages", "bytes"}.
+        The text kept while reading counts against the run's memory budget;
+        when less is left than a full page, less of the page is kept.
+        """
+        with client.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+            if response.status_code in (429, 500, 502, 503, 504):
+                response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "")
+            size = 0
+            truncated = False
+            reserved = 0
+            budget = current_memory_budget()
+            # The body of an unsupported type is never read
+            read_body = response.status_code == 200 and is_supported(content_type)
+            max_chars = MAX_PAGE_CHARS
+            if read_body and budget is not None:
+                length = response.headers.get("Content-Length", "")
+                wanted = min(MAX_PAGE_CHARS, int(length) if length.isdigit() else MAX_PAGE_CHARS)
+                reserved = max_chars = budget.reserve_up_to(wanted)
+                if not reserved:
+                    raise RuntimeError(f"run memory budget used up before reading {url}")
+            try:
+                extractor = PageExtractor(content_type, max_chars)
+                if read_body:
+                    for chunk in response.iter_content(chunk_size=16384):
+                        chunk = chunk[:self.max_bytes - size]
+                        extractor.feed(chunk)
+                        size += len(chunk)
+                        if size >= self.max_bytes:
+                            truncated = True
+                            break
+                title, passages = extractor.close()
+            finally:
+                # The page's own buffer takes over the passages from here
+                if budget is not None:
+                    budget.release(reserved)
+            extracted = {"title": title, "passages": passages, "bytes": size}
+            return response.status_code, response.headers, extracted, truncated or extractor.truncated
+
+    @staticmethod
+    def _page(url: str, entry: dict, from_cache: bool = False) -> ExtractedPage:
+        # Older entries hold the joined "text" instead of "passages"
+        return ExtractedPage(url, entry.get("title", ""), entry.get("text", ""),
+                             [tuple(o) for o in entry.get("offsets", [])], entry.get("status", 200),
+                             entry.get("truncated", False), from_cache, passages=entry.get("passages"))
+
+    def stats(self) -> dict:
+        return {
+            "fetched": self.fetched,
+            "cache_hits": self.cache_hits,
+            "revalidated": self.revalidated,
+            "bytes_downloaded": self.bytes_downloaded,
+        }
+
+
+def format_pages(pages: list, max_chars_per_page: int = 4000) -> str:
+    """Compact text for the LLM: one section per page, each passage tagged with its offsets."""
+    sections = []
+    for page in pages:
+        if page.error:
+            sections.append(f"## {page.url}\nError: {page.error}")
+            continue
+        lines = [f"## {page.title or page.url}", f"Source: {page.url}"]
+        used = 0
+        for start, end, passage in page.passages():
+            if used + len(passage) > max_chars_per_page:
+                lines.append(f"[... {page.length - start} more characters]")
+                break
+            lines.append(f"[{start}-{end}] {passage}")
+            used += len(passage)
+        sections.append("\n".join(lines))
+    return "\n\n".join(sections)
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_page_fetcher() -> PageFetcher:
+    """Return the process-wide page fetcher."""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = PageFetcher()
+    return _fetcher
@@ -0,0 +1,149 @@
+import os
+import re
+import threading
+import unicodedata
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from src.history_buff.cache import CACHE_DIR, ResponseCache, cache_enabled, make_key
+
+# Search results go stale faster than LLM answers
+SEARCH_CACHE_TTL = int(os.getenv("HISTORY_BUFF_SEARCH_CACHE_TTL", str(24 * 3600)))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("HISTORY_BUFF_SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Common words skipped when matching terms (report reuse, knowledge search)
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for", "from",
+    "how", "in", "is", "it", "of", "on", "or", "the", "to", "was", "were", "what",
+    "when", "where", "which", "who", "why", "with",
+}
+
+# Filler that does not change what a search engine returns. Question words and
+# prepositions do ("causes of" vs "effects of"), so they stay in the query key.
+FILLER_WORDS = {"a", "an", "the", "please"}
+
+# Query parameters that only track the click and never change page content
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "ref", "ref_src", "mc_cid", "mc_eid"}
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, strip punctuation and filler words, and collapse whitespace; word order is kept."""
+    text = unicodedata.normalize("NFKC", str(query)).lower()
+    tokens = re.findall(r"\w+", text)
+    terms = [t for t in tokens if t not in FILLER_WORDS] or tokens
+    return " ".join(terms)
+
+
+def canonical_url(url: str) -> str:
+    """Reduce a URL to a canonical form for duplicate detection."""
+    if not url:
+        return ""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS
+    )
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit(("", host, path, urlencode(query), ""))
+
+
+def dedupe_results(results: list) -> tuple:
+    """Drop results whose link points at an already seen canonical URL."""
+    seen = set()
+    unique = []
+    for result in results:
+        key = canonical_url(result.get("link", "")) if isinstance(result, dict) else ""
+        if key and key in seen:
+            continue
+        if key:
+            seen.add(key)
+        unique.append(result)
+    return unique, len(results) - len(unique)
+
+
+class SearchCache:
+    """
+    Local store for search responses.
+    Queries are normalized before lookup, concurrent requests for the same
+    normalized query share one upstream call, and result lists are
+    deduplicated by canonical URL before they are stored.
+    """
+
+    def __init__(self, store: ResponseCache):
+        self.store = store
+        self.coalesced = 0
+        self.duplicates_removed = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def fetch(self, query: str, fetcher, **params) -> dict:
+        """Return results for query, calling fetcher() only on a cache miss."""
+        key = make_key("serper", normalize_query(query), params)
+        cached = self.store.get(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            pending = self._inflight.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._inflight[key] = {"event": threading.Event(), "result": None, "error": None}
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            pending["event"].wait()
+            if pending["error"] is not None:
+                raise pending["error"]
+            return pending["result"]
+
+        try:
+            results = self._dedupe(fetcher())
+            self.store.set(key, results)
+            pending["result"] = results
+            return results
+        except Exception as e:
+            pending["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            pending["event"].set()
+
+    def _dedupe(self, results):
+        if not isinstance(results, dict):
+            return results
+        for section in ("organic", "news"):
+            if isinstance(results.get(section), list):
+                results[section], removed = dedupe_results(results[section])
+                self.duplicates_removed += removed
+        return results
+
+    def stats(self) -> dict:
+        """Return cache counters plus coalescing and deduplication counts."""
+        stats = self.store.stats()
+        stats["coalesced"] = self.coalesced
+        stats["duplicates_removed"] = self.duplicates_removed
+        return stats
+
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+
+def get_search_cache() -> SearchCache:
+    """Return the process-wide search cache."""
+    global _search_cache
+    with _search_cache_lock:
+        if _search_cache is None:
+            store = ResponseCache(
+                os.path.join(CACHE_DIR, "search_results.sqlite"),
+                ttl=SEARCH_CACHE_TTL,
+                max_bytes=SEARCH_CACHE_MAX_BYTES,
+                enabled=cache_enabled("HISTORY_BUFF_SEARCH_CACHE"),
+            )
+            _search_cache = SearchCache(store)
+    return _search_cache
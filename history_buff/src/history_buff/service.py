@@ -0,0 +1,323 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from src.history_buff.batch import topic_id_for
+from src.history_buff.instrumentation import get_tracer, percentile
+
+# Long-running HTTP/JSON service: a fixed pool of warm HistoryBuff instances
+# serves topic requests from a bounded queue. Identical topics that are queued
+# or running share one job.
+#
+#   POST /reports {"topic": ..., "current_year": ..., "wait": false}
+#        -> 202 {"id", "status", ...}, or 200 with the finished job when wait=true
+#   GET  /jobs/{id}  -> job status and, once done, the report
+#   GET  /health     -> pool, queue and latency figures
+#   GET  /metrics    -> span metrics in Prometheus text format
+
+MAX_BODY_BYTES = 64 * 1024
+FINISHED_JOBS_KEPT = 1000
+STATUS_TEXT = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+               405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+               503: "Service Unavailable"}
+
+
+def coalesce_key(topic: str, current_year: str) -> str:
+    """Requests with the same key share one run."""
+    normalized = re.sub(r"\s+", " ", topic.strip().lower())
+    return f"{normalized}|{current_year}"
+
+
+def default_runner(history_buff, inputs: dict, output_dir: str) -> str:
+    result = history_buff.kickoff(inputs, output_dir=output_dir)
+    return getattr(result, "raw", None) or str(result)
+
+
+class StubHistoryBuff:
+    """Stand-in crew for trying the service without API keys: sleeps, then returns a canned report."""
+
+    def __init__(self, delay: float = 0.5):
+        self.delay = delay
+
+    def warm(self):
+        return self
+
+    def kickoff(self, inputs=None, output_dir=None):
+        time.sleep(self.delay)
+        return f"# {inputs['topic']}\n\nStub report generated for {inputs.get('current_year')}."
+
+
+class Job:
+    def __init__(self, topic: str, current_year: str):
+        self.id = f"{topic_id_for({}, topic)}-{uuid.uuid4().hex[:6]}"
+        self.topic = topic
+        self.current_year = current_year
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.requests = 1
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = asyncio.Event()
+
+    def to_dict(self, include_result: bool = True) -> dict:
+        data = {
+            "id": self.id,
+            "topic": self.topic,
+            "current_year": self.current_year,
+            "status": self.status,
+            "requests": self.requests,
+            "queued_at": self.queued_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.started_at and self.finished_at:
+            data["duration_seconds"] = round(self.finished_at - self.started_at, 3)
+        if self.error:
+            data["error"] = self.error
+        if include_result and self.result is not None:
+            data["result"] = self.result
+        return data
+
+
+class ReportService:
+    """
+    Owns the job queue and one worker per pooled HistoryBuff. Runs execute on
+    a thread pool so the event loop keeps serving requests meanwhile.
+    `factory` builds a crew and `runner(crew, inputs, output_dir)` runs one
+    topic; both can be swapped for stubs.
+    """
+
+    def __init__(self, factory=None, pool_size: int = 2, queue_size: int = 16,
+                 output_dir: str = "service_output", runner=default_runner):
+        if factory is None:
+            from src.history_buff.crew import HistoryBuff
+            factory = HistoryBuff
+        self.factory = factory
+        self.pool_size = max(1, pool_size)
+        self.queue_size = max(1, queue_size)
+        self.output_dir = output_dir
+        self.runner = runner
+        self.jobs = {}
+        self.inflight = {}
+        self.latencies = []
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self._queue = None
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="history-buff")
+        self._workers = []
+
+    async def start(self) -> None:
+        """Build and warm the pool, then start one worker per instance."""
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        crews = await asyncio.gather(*[
+            loop.run_in_executor(self._executor, self._build_crew) for _ in range(self.pool_size)
+        ])
+        self._workers = [asyncio.create_task(self._worker(crew)) for crew in crews]
+        print(f"HistoryBuff service ready: {self.pool_size} warm crews, queue size {self.queue_size}")
+
+    def _build_crew(self):
+        crew = self.factory()
+        warm = getattr(crew, "warm", None)
+        return warm() if warm else crew
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+
+    def submit(self, topic: str, current_year: str) -> tuple:
+        """Queue a topic, or join the matching in-flight job. Returns (job, coalesced); raises asyncio.QueueFull."""
+        key = coalesce_key(topic, current_year)
+        job = self.inflight.get(key)
+        if job is not None:
+            job.requests += 1
+            self.coalesced += 1
+            return job, True
+        job = Job(topic, current_year)
+        try:
+            self._queue.put_nowait((key, job))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise
+        self.jobs[job.id] = job
+        self.inflight[key] = job
+        return job, False
+
+    def retry_after(self) -> int:
+        """Seconds until a queue slot is likely to free up (a running job finishing)."""
+        typical = percentile(self.latencies[-100:], 50) or 30.0
+        return max(1, round(typical / self.pool_size))
+
+    async def _worker(self, crew) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            key, job = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            self.busy += 1
+            inputs = {"topic": job.topic, "current_year": job.current_year}
+            output_dir = os.path.join(self.output_dir, job.id)
+            try:
+                os.makedirs(output_dir, exist_ok=True)
+                job.result = await loop.run_in_executor(self._executor, self.runner, crew, inputs, output_dir)
+                job.status = "done"
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[{job.id}] Error: {str(e)}")
+                job.status = "failed"
+                job.error = str(e)
+                self.failed += 1
+            finally:
+                job.finished_at = time.time()
+                self.busy -= 1
+                self.inflight.pop(key, None)
+                job.done.set()
+                self._queue.task_done()
+            if job.status == "done":
+                self.latencies.append(job.finished_at - job.started_at)
+            self._prune()
+
+    def _prune(self) -> None:
+        finished = [job for job in self.jobs.values() if job.done.is_set()]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self.jobs[job.id]
+
+    def health(self) -> dict:
+        return {
+            "status": "ok",
+            "pool_size": self.pool_size,
+            "busy": self.busy,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "queue_size": self.queue_size,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+            "p50_latency_seconds": round(percentile(self.latencies, 50), 2),
+            "p95_latency_seconds": round(percentile(self.latencies, 95), 2),
+        }
+
+    # HTTP handling
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            status, body, headers = await self._handle_request(reader)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            status, body, headers = 400, {"error": f"Malformed request: {str(e)}"}, {}
+        except Exception as e:
+            # Anything else is our bug: answer and close instead of leaving the client hanging
+            print(f"Error handling request: {type(e).__name__}: {str(e)}")
+            status, body, headers = 500, {"error": "Internal server error"}, {}
+        try:
+            # Plain-text bodies (Prometheus metrics) are passed through as they are
+            if isinstance(body, str):
+                payload, content_type = body.encode("utf-8"), "text/plain; version=0.0.4"
+            else:
+                payload, content_type = json.dumps(body).encode("utf-8"), "application/json"
+            head = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+                    f"Content-Type: {content_type}",
+                    f"Content-Length: {len(payload)}",
+                    "Connection: close"]
+            head.extend(f"{name}: {value}" for name, value in headers.items())
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader) -> tuple:
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            raise ValueError("empty request")
+        method, target, _ = request_line.split(" ", 2)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_BYTES:
+            return 413, {"error": "Request body too large"}, {}
+        raw_body = await reader.readexactly(length) if length else b""
+
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        path = url.path.rstrip("/") or "/"
+
+        if path == "/health":
+            return 200, self.health(), {}
+        if path == "/metrics":
+            return 200, get_tracer().prometheus_text(), {}
+        if path.startswith("/jobs/"):
+            if method != "GET":
+                return 405, {"error": "Use GET"}, {"Allow": "GET"}
+            job = self.jobs.get(path[len("/jobs/"):])
+            if job is None:
+                return 404, {"error": "Unknown job id"}, {}
+            return 200, job.to_dict(), {}
+        if path == "/reports":
+            if method != "POST":
+                return 405, {"error": "Use POST"}, {"Allow": "POST"}
+            try:
+                body = json.loads(raw_body or b"{}")
+            except json.JSONDecodeError as e:
+                return 400, {"error": f"Invalid JSON: {str(e)}"}, {}
+            if not isinstance(body, dict):
+                return 400, {"error": "Request body must be a JSON object"}, {}
+            return await self._create_report(body, query)
+        return 404, {"error": "Not found"}, {}
+
+    async def _create_report(self, body: dict, query: dict) -> tuple:
+        topic = str(body.get("topic") or "").strip()
+        if not topic:
+            return 400, {"error": "'topic' is required"}, {}
+        current_year = str(body.get("current_year") or "2025")
+        wait = body.get("wait", query.get("wait", False))
+        wait = wait if isinstance(wait, bool) else str(wait).lower() in ("1", "true", "yes")
+        timeout = float(body.get("timeout") or query.get("timeout") or 300)
+
+        try:
+            job, coalesced = self.submit(topic, current_year)
+        except asyncio.QueueFull:
+            retry_after = self.retry_after()
+            return 503, {"error": "Queue is full, retry later", "retry_after": retry_after}, \
+                {"Retry-After": str(retry_after)}
+
+        location = {"Location": f"/jobs/{job.id}"}
+        if wait:
+            try:
+                await asyncio.wait_for(asyncio.shield(job.done.wait()), timeout)
+            except asyncio.TimeoutError:
+                return 202, {**job.to_dict(), "coalesced": coalesced}, location
+            return 200, {**job.to_dict(), "coalesced": coalesced}, location
+        return 202, {**job.to_dict(include_result=False), "coalesced": coalesced}, location
+
+
+async def serve(service: ReportService, host: str = "127.0.0.1", port: int = 8080) -> None:
+    """Start the pool and serve until cancelled."""
+    await service.start()
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"Listening on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
@@ -0,0 +1,71 @@
+import builtins
+import sys
+import time
+
+# Import-time profiling for `--profile-startup`: wraps builtins.__import__ and
+# attributes the time spent loading each new module to its top-level package.
+
+
+class ImportProfiler:
+    """Records self time (excluding nested imports) for every module imported while active."""
+
+    def __init__(self):
+        self.self_times = {}
+        self.total_times = {}
+        self._original_import = None
+        self._stack = []
+        self._started = None
+        self.elapsed = 0.0
+
+    def start(self):
+        self._original_import = builtins.__import__
+        self._started = time.perf_counter()
+        builtins.__import__ = self._import
+        return self
+
+    def stop(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+            self.elapsed = time.perf_counter() - self._started
+        return self
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Only time first imports of absolute module names; cached and relative imports are cheap
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        self._stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.self_times[name] = self.self_times.get(name, 0.0) + elapsed - nested
+            self.total_times[name] = self.total_times.get(name, 0.0) + elapsed
+
+    def by_package(self) -> dict:
+        """Self time summed per top-level package, in seconds."""
+        packages = {}
+        for name, seconds in self.self_times.items():
+            root = name.split(".")[0]
+            packages[root] = packages.get(root, 0.0) + seconds
+        return packages
+
+    def report(self, limit: int = 15) -> str:
+        packages = sorted(self.by_package().items(), key=lambda item: item[1], reverse=True)
+        imported = sum(self.self_times.values())
+        lines = [
+            f"Startup: {self.elapsed * 1000:.0f} ms total, {imported * 1000:.0f} ms importing "
+            f"{len(self.self_times)} modules",
+            f"{'package':<32}{'ms':>10}{'share':>8}",
+        ]
+        for package, seconds in packages[:limit]:
+            share = seconds / imported if imported else 0.0
+            lines.append(f"{package:<32}{seconds * 1000:>10.1f}{share:>8.1%}")
+        if len(packages) > limit:
+            rest = sum(seconds for _, seconds in packages[limit:])
+            lines.append(f"{'(other)':<32}{rest * 1000:>10.1f}")
+        return "\n".join(lines)
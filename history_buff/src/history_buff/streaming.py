@@ -0,0 +1,172 @@
+import os
+import sys
+import tempfile
+import threading
+
+# Streaming output for interactive runs: model chunks are shown on the console
+# as they arrive and appended to a temp file next to each stage's output file,
+# which is renamed into place only when the stage has finished.
+
+
+class AtomicFileWriter:
+    """
+    Appends chunks to a temp file in the target's directory and renames it
+    over the target on commit, so readers never see a half-written file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".partial", dir=directory)
+        self._file = os.fdopen(fd, "w", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, chunk: str) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.write(chunk)
+                self._file.flush()
+
+    def commit(self, final_text: str = None) -> None:
+        """Replace the streamed content with final_text (if given) and move the file into place."""
+        with self._lock:
+            if self._file is None:
+                return
+            if final_text is not None:
+                self._file.seek(0)
+                self._file.truncate()
+                self._file.write(final_text)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        """Drop the partial file and leave any existing target untouched."""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+
+
+def write_atomic(path: str, text: str) -> None:
+    """Write a whole file atomically."""
+    writer = AtomicFileWriter(path)
+    writer.commit(text)
+
+
+class StageStreamer:
+    """
+    Routes streamed chunks to each stage's partial output file, and echoes
+    tool-level chunks to the console prefixed with the stage name whenever
+    the stage changes.
+    """
+
+    def __init__(self, output_files: dict = None, echo: bool = True):
+        self.output_files = output_files or {}
+        self.echo = echo
+        self._writers = {}
+        self._last_stage = None
+        self._lock = threading.Lock()
+
+    def start_stage(self, stage: str, agent=None) -> None:
+        path = self.output_files.get(stage)
+        if path:
+            self._writers[stage] = AtomicFileWriter(path)
+        llm = getattr(agent, "llm", None)
+        if llm is not None:
+            _register_source(llm, self, stage)
+        _local.stage = (self, stage)
+
+    def write(self, stage: str, chunk: str, echo: bool = True) -> None:
+        if not chunk:
+            return
+        if self.echo and echo:
+            with self._lock:
+                if stage != self._last_stage:
+                    sys.stdout.write(f"\n[{stage}] ")
+                    self._last_stage = stage
+                sys.stdout.write(chunk)
+                sys.stdout.flush()
+        writer = self._writers.get(stage)
+        if writer is not None:
+            writer.write(chunk)
+
+    def finish_stage(self, stage: str, agent=None, output=None) -> None:
+        """Commit the stage's file with its final output."""
+        _unregister_source(getattr(agent, "llm", None))
+        _local.stage = None
+        writer = self._writers.pop(stage, None)
+        if writer is not None:
+            writer.commit(getattr(output, "raw", None) if output is not None else None)
+
+    def fail_stage(self, stage: str, agent=None) -> None:
+        _unregister_source(getattr(agent, "llm", None))
+        _local.stage = None
+        writer = self._writers.pop(stage, None)
+        if writer is not None:
+            writer.abort()
+
+
+# Which streamer/stage each agent LLM is currently producing output for
+_sources = {}
+_sources_lock = threading.Lock()
+_local = threading.local()
+_handler_registered = False
+_handler_lock = threading.Lock()
+
+
+def _register_source(llm, streamer: StageStreamer, stage: str) -> None:
+    _ensure_handler()
+    with _sources_lock:
+        _sources[id(llm)] = (streamer, stage)
+
+
+def _unregister_source(llm) -> None:
+    if llm is None:
+        return
+    with _sources_lock:
+        _sources.pop(id(llm), None)
+
+
+def _ensure_handler() -> None:
+    """Subscribe once to CrewAI's LLM stream events."""
+    global _handler_registered
+    with _handler_lock:
+        if _handler_registered:
+            return
+        _handler_registered = True
+        try:
+            from crewai.utilities.events import LLMStreamChunkEvent, crewai_event_bus
+        except ImportError as e:
+            print(f"Warning: LLM streaming events are not available in this CrewAI version: {str(e)}")
+            return
+
+        @crewai_event_bus.on(LLMStreamChunkEvent)
+        def on_chunk(source, event):
+            with _sources_lock:
+                target = _sources.get(id(source))
+            if target is not None:
+                streamer, stage = target
+                # CrewAI's own console listener already echoes agent chunks
+                streamer.write(stage, event.chunk, echo=False)
+
+
+def current_chunk_callback():
+    """Chunk callback for the stage running on this thread, or None when not streaming."""
+    target = getattr(_local, "stage", None)
+    if target is None:
+        return None
+    streamer, stage = target
+    return lambda chunk: streamer.write(stage, chunk)
+
+
+def streaming_enabled() -> bool:
+    return os.getenv("HISTORY_BUFF_STREAM", "").strip().lower() in ("1", "on", "true", "yes")
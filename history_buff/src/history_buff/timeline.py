@@ -0,0 +1,338 @@
+import json
+import re
+
+# Deterministic timeline engine used by TimelineBuilderTool.
+# Years are stored as historical signed years with no year 0: 44 BCE -> -44, AD 476 -> 476.
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+MONTH_NAMES = [
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December",
+]
+
+_ERA = r"(?:\s*(BCE|BC|B\.C\.E?\.?|CE|AD|A\.D\.))?"
+_MONTH = r"\b(Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|June?|July?|Aug(?:ust)?|Sep(?:t(?:ember)?)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)\.?"
+_CIRCA = r"(?:(c\.|ca\.|circa|approx\.?|around)\s*)?"
+# Era-marked years may be written with thousands separators: "10,000 BC"
+_ERA_NUMBER = r"(\d{1,3}(?:,\d{3})+|\d{1,5})"
+
+ISO_DATE = re.compile(r"\b(\d{3,4})-(\d{1,2})-(\d{1,2})\b")
+MONTH_DAY_YEAR = re.compile(_MONTH + r"\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{1,4})" + _ERA + r"\b", re.I)
+DAY_MONTH_YEAR = re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?" + _MONTH + r",?\s+(\d{1,4})" + _ERA + r"\b", re.I)
+MONTH_YEAR = re.compile(_MONTH + r",?\s+(\d{3,4})" + _ERA + r"\b", re.I)
+CENTURY = re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)(?:\s+|-)century" + _ERA, re.I)
+DECADE = re.compile(r"\b(\d{1,3}0)'?s\b" + _ERA, re.I)
+ERA_PREFIX_YEAR = re.compile(r"\b(AD|A\.D\.)\s*(\d{1,4})\b", re.I)
+RANGE = re.compile(
+    _CIRCA + r"\b" + _ERA_NUMBER + _ERA + r"\s*(?:-|–|—|to|until)\s*" + _CIRCA + r"(?:AD\s*|A\.D\.\s*)?"
+    + _ERA_NUMBER + _ERA + r"(?![\d,])", re.I
+)
+YEAR_WITH_ERA = re.compile(_CIRCA + r"\b" + _ERA_NUMBER + r"\s*(BCE|BC|B\.C\.E?\.?|CE|AD|A\.D\.)", re.I)
+# Not part of a larger number ("1,500", "12.5") and not a "1914-18" range
+BARE_YEAR = re.compile(_CIRCA + r"(?<![\d,.])\b(\d{3,4})\b(?![,.]\d)(?!\s*(?:-|–|—)\s*\d{1,2}\b)", re.I)
+
+# A bare number right after one of these is a year ("in 1588", "by 1850")
+DATE_CONTEXT = re.compile(r"\b(?:in|by|since|from|until|till|after|before|during|year|c\.|ca\.|circa)\s*$", re.I)
+# A bare number right before one of these is a count ("130 ships"), not a year
+COUNT_NOUN = re.compile(
+    r"\s+(?:people|men|women|children|soldiers|troops|sailors|knights|warriors|ships|vessels|boats|galleys|"
+    r"horses|guns|cannons|casualties|dead|deaths|victims|prisoners|slaves|refugees|inhabitants|residents|"
+    r"citizens|families|houses|buildings|churches|members|delegates|workers|votes|copies|pages|words|"
+    r"years|months|weeks|days|hours|miles|kilometres|kilometers|km|feet|metres|meters|acres|tons|tonnes|"
+    r"pounds|dollars|francs|ducats)\b", re.I
+)
+
+
+class EventDate:
+    """A parsed date or date range."""
+
+    def __init__(self, start: int, end: int = None, month: int = 0, day: int = 0,
+                 approximate: bool = False, text: str = "", kind: str = ""):
+        self.start = start
+        self.end = start if end is None else end
+        self.month = month
+        self.day = day
+        self.approximate = approximate
+        self.text = text
+        # "decade" ("the 1960s", also "the 1800s") or "century" when the date names a whole period
+        self.kind = kind
+
+    @property
+    def sort_key(self) -> tuple:
+        return (self.start, self.month, self.day, self.end)
+
+
+def _is_bce(era) -> bool:
+    return bool(era) and era.upper().replace(".", "").startswith("B")
+
+
+def _signed(year: str, era) -> int:
+    value = int(year.replace(",", ""))
+    return -value if _is_bce(era) else value
+
+
+def _range_end(first: str, second: str) -> str:
+    """Expand an abbreviated range end against its start: ("1914", "18") -> "1918"."""
+    if len(first) >= 3 and len(second) == 2 and "," not in first:
+        return first[:-2] + second
+    return second
+
+
+def _bare_year(text: str):
+    """The bare number most likely to be a year: one with date context, else the first that is not a count."""
+    candidates = [m for m in BARE_YEAR.finditer(text) if not COUNT_NOUN.match(text, m.end())]
+    for match in candidates:
+        if match.group(1) or DATE_CONTEXT.search(text, 0, match.start()):
+            return match
+    return candidates[0] if candidates else None
+
+
+def _month(name: str) -> int:
+    return MONTHS[name[:3].lower()]
+
+
+def parse_date(text) -> EventDate:
+    """Parse one date expression (years, BCE/CE, circa, decades, centuries, ranges, full dates)."""
+    if text is None:
+        return None
+    if isinstance(text, int):
+        return EventDate(text, text=str(text))
+    text = str(text).strip()
+    if not text:
+        return None
+
+    match = ISO_DATE.search(text)
+    if match:
+        year, month, day = (int(g) for g in match.groups())
+        if 1 <= month <= 12 and 1 <= day <= 31:
+            return EventDate(year, month=month, day=day, text=match.group(0))
+
+    match = MONTH_DAY_YEAR.search(text)
+    if match:
+        month, day, year, era = match.groups()
+        return EventDate(_signed(year, era), month=_month(month), day=int(day), text=match.group(0))
+
+    match = DAY_MONTH_YEAR.search(text)
+    if match:
+        day, month, year, era = match.groups()
+        return EventDate(_signed(year, era), month=_month(month), day=int(day), text=match.group(0))
+
+    match = MONTH_YEAR.search(text)
+    if match:
+        month, year, era = match.groups()
+        return EventDate(_signed(year, era), month=_month(month), text=match.group(0))
+
+    match = CENTURY.search(text)
+    if match:
+        number, era = int(match.group(1)), match.group(2)
+        if _is_bce(era):
+            return EventDate(-number * 100, -(number - 1) * 100 - 1, approximate=True,
+                             text=match.group(0), kind="century")
+        return EventDate((number - 1) * 100 + 1, number * 100, approximate=True, text=match.group(0), kind="century")
+
+    match = RANGE.search(text)
+    if match:
+        circa1, first, era1, circa2, second, era2 = match.groups()
+        if not (era1 or era2):
+            # "1914–18": the end only gives the last two digits
+            second = _range_end(first, second)
+        # "27 BC - AD 14": each side has its own era; "500-400 BC": the end era covers both
+        start = _signed(first, era1 or (era2 if _is_bce(era2) else None))
+        end = _signed(second, era2)
+        if start <= end and (era1 or era2 or (len(first) >= 3 and len(second) >= 3)):
+            return EventDate(start, end, approximate=bool(circa1 or circa2), text=match.group(0).strip())
+
+    match = DECADE.search(text)
+    if match:
+        decade, era = match.groups()
+        start = _signed(decade, era)
+        # "the 1800s" names a hundred years; "the 2000s" is usually the decade
+        width = 99 if int(decade) % 100 == 0 and 100 <= int(decade) < 2000 else 9
+        end = start - width if start < 0 else start + width
+        return EventDate(min(start, end), max(start, end), approximate=True, text=match.group(0), kind="decade")
+
+    match = YEAR_WITH_ERA.search(text)
+    if match:
+        circa, year, era = match.groups()
+        return EventDate(_signed(year, era), approximate=bool(circa), text=match.group(0).strip())
+
+    match = ERA_PREFIX_YEAR.search(text)
+    if match:
+        return EventDate(int(match.group(2)), text=match.group(0))
+
+    match = _bare_year(text)
+    if match:
+        circa, year = match.groups()
+        return EventDate(int(year), approximate=bool(circa), text=match.group(0).strip())
+
+    return None
+
+
+def format_year(year: int) -> str:
+    return f"{-year} BCE" if year < 0 else str(year)
+
+
+def format_date(date: EventDate) -> str:
+    """Human-readable date for a bullet."""
+    prefix = "c. " if date.approximate and date.start == date.end else ""
+    if date.kind == "decade":
+        return f"{-date.end}s BCE" if date.end < 0 else f"{date.start}s"
+    if date.kind == "century":
+        return bucket_label(date.start, "century")[1]
+    if date.start != date.end:
+        if date.start < 0 <= date.end:
+            return f"{format_year(date.start)} – {date.end} CE"
+        if date.end < 0:
+            return f"{-date.start}–{-date.end} BCE"
+        return f"{date.start}–{date.end}"
+    if date.month and date.day:
+        return f"{MONTH_NAMES[date.month - 1]} {date.day}, {format_year(date.start)}"
+    if date.month:
+        return f"{MONTH_NAMES[date.month - 1]} {format_year(date.start)}"
+    return prefix + format_year(date.start)
+
+
+def _ordinal(n: int) -> str:
+    suffix = "th" if 10 <= n % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+    return f"{n}{suffix}"
+
+
+def bucket_label(year: int, granularity: str) -> tuple:
+    """Return (sort key, heading) of the bucket a year falls in."""
+    if granularity == "century":
+        number = (abs(year) - 1) // 100 + 1 if year else 1
+        key = -number if year < 0 else number
+        return key, f"{_ordinal(number)} century" + (" BCE" if year < 0 else "")
+    if granularity == "decade":
+        if year < 0:
+            decade = (-year) // 10 * 10
+            return -decade - 10, f"{decade}s BCE"
+        decade = year // 10 * 10
+        return decade, f"{decade}s"
+    return year, format_year(year)
+
+
+def choose_granularity(dates: list) -> str:
+    """Years for short spans, decades for a few centuries, centuries beyond that."""
+    if not dates:
+        return "year"
+    span = max(d.end for d in dates) - min(d.start for d in dates)
+    if span <= 100:
+        return "year"
+    if span <= 400:
+        return "decade"
+    return "century"
+
+
+class TimelineEvent:
+    """One event with its parsed date (None when the date could not be parsed)."""
+
+    def __init__(self, title: str, description: str = "", date: EventDate = None, raw=None, index: int = 0):
+        self.title = title
+        self.description = description
+        self.date = date
+        self.raw = raw
+        self.index = index
+
+
+def normalize_event(item, index: int = 0) -> TimelineEvent:
+    """Turn a string or dict event into a TimelineEvent, parsing its date."""
+    if isinstance(item, dict):
+        title = next((str(item[k]) for k in ("title", "event", "name", "summary") if item.get(k)), "")
+        description = next((str(item[k]) for k in ("description", "details", "desc") if item.get(k)), "")
+        date = None
+        if isinstance(item.get("start_year"), int):
+            end = item.get("end_year")
+            date = EventDate(item["start_year"], end if isinstance(end, int) else None)
+        for key in ("date", "year", "when", "period", "start_year"):
+            if date is None and item.get(key) not in (None, ""):
+                date = parse_date(item[key])
+        if date is None and title:
+            date = parse_date(title)
+        return TimelineEvent(title or description, description if title else "", date, item, index)
+
+    text = str(item).strip()
+    # "1776: Declaration of Independence" / "July 4, 1776 - Declaration ..."
+    for separator in (r":", r"\s[-–—]\s"):
+        prefix = re.match(r"^(.{1,60}?)\s*" + separator + r"\s*(.+)$", text)
+        if prefix:
+            date = parse_date(prefix.group(1))
+            if date is not None:
+                return TimelineEvent(prefix.group(2), "", date, item, index)
+    return TimelineEvent(text, "", parse_date(text), item, index)
+
+
+def render_timeline(events: list) -> str:
+    """Render dated events grouped under '###' headings, undated ones last."""
+    dated = sorted((e for e in events if e.date is not None), key=lambda e: (e.date.sort_key, e.index))
+    undated = [e for e in events if e.date is None]
+    granularity = choose_granularity([e.date for e in dated])
+
+    lines = []
+    current = None
+    for event in dated:
+        key, label = bucket_label(event.date.start, granularity)
+        if key != current:
+            if lines:
+                lines.append("")
+            lines.append(f"### {label}")
+            current = key
+        lines.append(_bullet(event, format_date(event.date)))
+
+    if undated:
+        if lines:
+            lines.append("")
+        lines.append("### Undated")
+        lines.extend(_bullet(event) for event in undated)
+    return "\n".join(lines) + "\n"
+
+
+def _bullet(event: TimelineEvent, date_text: str = "") -> str:
+    text = f"- **{date_text}**: {event.title}" if date_text else f"- {event.title}"
+    if event.description:
+        text += f" — {event.description}"
+    return text
+
+
+def date_prompt(events: list) -> str:
+    """Prompt asking the LLM only for the dates we could not parse."""
+    listing = "\n".join(f"{i}. {e.title} {e.description}".strip() for i, e in enumerate(events))
+    return f"""
+        Give the date of each numbered historical event below.
+        Output only a JSON list: [{{"index": 0, "date": "1776"}}, ...]
+        Use forms like "1776", "44 BCE", "1914-1918" or "July 4, 1776". Use null if unknown.
+        {listing}
+    """
+
+
+def apply_llm_dates(events: list, response: str) -> None:
+    """Fill in dates from the LLM's JSON answer; anything unparseable stays undated."""
+    text = re.sub(r"^```(?:json)?|```$", "", (response or "").strip(), flags=re.M).strip()
+    try:
+        answers = json.loads(text)
+    except json.JSONDecodeError:
+        return
+    for answer in answers if isinstance(answers, list) else []:
+        if not isinstance(answer, dict):
+            continue
+        index = answer.get("index")
+        if isinstance(index, int) and 0 <= index < len(events):
+            events[index].date = parse_date(answer.get("date"))
+
+
+def build_timeline(items: list, resolve_dates=None) -> str:
+    """
+    Build a markdown timeline locally.
+    `resolve_dates(prompt) -> str` is only called when some events have no parseable date.
+    """
+    events = [normalize_event(item, i) for i, item in enumerate(items)]
+    undated = [e for e in events if e.date is None]
+    if undated and resolve_dates is not None:
+        try:
+            apply_llm_dates(undated, resolve_dates(date_prompt(undated)))
+        except Exception as e:
+            print(f"Warning: Could not resolve {len(undated)} undated events: {str(e)}")
+    return render_timeline(events)
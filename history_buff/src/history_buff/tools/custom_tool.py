@@ -2,27 +2,68 @@ from typing import Type
 from pydantic import BaseModel, Field
 import json
 import os
-import google.generativeai as genai
+import re
+import threading
 from dotenv import load_dotenv
 
-# Import CrewAI tool base and standard tools
+# Import CrewAI tool base (the crewai_tools based Serper tools live in serper_tool.py)
 from crewai.tools import BaseTool
-from crewai_tools import SerperDevTool, ScrapeWebsiteTool
 
-# Load env variables and configure Gemini
+from src.history_buff.cache import cached_generate
+from src.history_buff.event_store import event_store_enabled, get_event_store
+from src.history_buff.instrumentation import traced
+from src.history_buff.knowledge import format_results, get_knowledge_index
+from src.history_buff.memory import iter_text_chunks
+from src.history_buff.prefetch import current_session
+from src.history_buff.query_understanding import parse_understanding, understand_query
+from src.history_buff.routing import get_router
+from src.history_buff.scraper import format_pages, get_page_fetcher
+from src.history_buff.streaming import current_chunk_callback
+from src.history_buff.timeline import build_timeline
+
 load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-if api_key:
-    genai.configure(api_key=api_key)
-else:
-    print("Warning: GEMINI_API_KEY not found in environment variables!")
 
-# Create a direct Gemini model instance
-gemini_model = genai.GenerativeModel("gemini-pro")
+# MarkdownFormatterTool formats content longer than this one section at a time
+FORMAT_CHUNK_CHARS = 12000
+
+_gemini_models = {}
+_gemini_lock = threading.Lock()
+
+
+def get_gemini_model(model_name: str = "gemini-pro"):
+    """Configure Gemini and create the shared model of that name on first use."""
+    with _gemini_lock:
+        if model_name not in _gemini_models:
+            import google.generativeai as genai
+            if not _gemini_models:
+                api_key = os.getenv("GEMINI_API_KEY")
+                if api_key:
+                    genai.configure(api_key=api_key)
+                else:
+                    print("Warning: GEMINI_API_KEY not found in environment variables!")
+            _gemini_models[model_name] = genai.GenerativeModel(model_name)
+    return _gemini_models[model_name]
+
+
+def generate(tool_name: str, prompt: str, validate=None, on_chunk=None) -> str:
+    """Gemini call for a tool on the model tier routed for it (see routing.py)."""
+    # Replies that fail validation are not cached, so an escalated retry is not undone on the next run
+    call = lambda model_name: cached_generate(get_gemini_model(model_name), prompt, on_chunk=on_chunk,
+                                              validate=validate)
+    return get_router().generate("gemini", tool_name, call, prompt, validate=validate)
+
+
+def __getattr__(name):
+    # The Serper tools used to live here; importing them pulls in crewai_tools, so only do it on request
+    if name in ("CachedSerperDevTool", "EnhancedSerperTool"):
+        from src.history_buff.tools import serper_tool
+        return getattr(serper_tool, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Define input schema for timeline builder tool
 class TimelineInput(BaseModel):
     events: list = Field(..., description="List of historical events")
+    entities: list = Field(default_factory=list, description="Optional people, places or states the timeline is about")
 
 # Tool: Build a markdown timeline from a list of events
 class TimelineBuilderTool(BaseTool):
@@ -35,94 +76,113 @@ class TimelineBuilderTool(BaseTool):
     def __init__(self):
         super().__init__()
     
-    def _run(self, events: list) -> str:
-        # Use Gemini to generate a markdown timeline
-        prompt = f"""
-            Create a markdown timeline from these events: {events}
-            Format: Use '###' for years, and '-' for events under each year.
-            Include event dates, titles, and brief descriptions.
-        """
+    @traced("tool")
+    def _run(self, events: list, entities: list = None) -> str:
+        # Sort and group events locally; Gemini is only asked for dates we cannot parse
+        if isinstance(events, str):
+            try:
+                events = json.loads(events)
+            except json.JSONDecodeError:
+                events = [line for line in events.splitlines() if line.strip()]
+        if isinstance(events, dict):
+            events = events.get("key_events") or events.get("events") or [events]
+        events = list(events) + self._stored_events(events, entities)
         
         try:
-            response = gemini_model.generate_content(prompt)
-            return response.text
+            return build_timeline(events, resolve_dates=lambda prompt: generate("TimelineBuilderTool", prompt))
         except Exception as e:
-            print(f"Gemini API error in TimelineBuilderTool: {str(e)}")
+            print(f"Error in TimelineBuilderTool: {str(e)}")
             return "Error: Failed to generate timeline."
+    
+    @staticmethod
+    def _stored_events(events: list, entities: list = None) -> list:
+        # Events earlier reports found for the same years and entities
+        if not event_store_enabled():
+            return []
+        try:
+            return [event.to_item() for event in get_event_store().related(events, entities)]
+        except Exception as e:
+            print(f"Warning: Could not read stored events: {str(e)}")
+            return []
+
 
+# Define input schema for the batch scrape tool
+class BatchScrapeInput(BaseModel):
+    urls: list = Field(..., description="List of page URLs to read, e.g. the links from a search")
+    max_chars_per_page: int = Field(4000, description="Maximum characters of extracted text per page")
+
+# Tool: Fetch several pages at once and return their main article text
+class BatchScrapeTool(BaseTool):
+    name: str = "BatchScrapeTool"
+    description: str = (
+        "Reads several web pages at once and returns the main article text of each "
+        "(navigation and boilerplate removed), with character offsets for every passage"
+    )
+    args_schema: Type[BaseModel] = BatchScrapeInput
 
-# Tool: Enhanced Serper search tool for structured web search results
-class EnhancedSerperTool(SerperDevTool):
     def __init__(self):
-        api_key = os.getenv("SERPER_API_KEY")
-        if not api_key:
-            raise ValueError("SERPER_API_KEY environment variable is required")
-        super().__init__(api_key=api_key)
-    
-    def _run(self, query: str) -> list:
+        super().__init__()
+
+    @traced("tool")
+    def _run(self, urls: list, max_chars_per_page: int = 4000) -> str:
+        if isinstance(urls, str):
+            urls = [u.strip() for u in re.split(r"[\s,]+", urls) if u.strip()]
         try:
-            # Call the parent SerperTool's run method
-            results = super()._run(query)
-            # Structure the results for easier downstream use
-            return [{
-                'title': r.get('title'),
-                'link': r.get('link'),
-                'snippet': r.get('snippet'),
-                'date': r.get('date')
-            } for r in results.get('organic', [])]
+            # Pages the run's prefetcher already has are not fetched again
+            session = current_session()
+            fetcher = get_page_fetcher()
+            pages = session.fetch_pages(urls, fetcher) if session is not None else fetcher.fetch_many(urls)
+            return format_pages(pages, max_chars_per_page)
         except Exception as e:
-            print(f"Error in SerperDev search: {str(e)}")
-            return [{"error": str(e)}]
+            print(f"Error in BatchScrapeTool: {str(e)}")
+            return f"Error: Failed to scrape pages: {str(e)}"
+
+# Define input schema for the knowledge search tool
+class KnowledgeSearchInput(BaseModel):
+    query: str = Field(..., description="What to look up, e.g. 'causes of the French Revolution'")
+    top_k: int = Field(5, description="Number of passages to return")
 
-# Tool: Extract temporal context (dates, key events) from a query using Gemini
-class ChronoAPITool(BaseTool):
-    name: str = "ChronoAPITool"
-    description: str = "Extracts temporal context (dates, key events) from a historical query"
+# Tool: Search the local knowledge index (knowledge/ documents and previously scraped pages)
+class KnowledgeSearchTool(BaseTool):
+    name: str = "KnowledgeSearchTool"
+    description: str = (
+        "Searches the local knowledge base of documents and previously read web pages and returns "
+        "the best matching passages with their sources. Try this before searching the web"
+    )
+    args_schema: Type[BaseModel] = KnowledgeSearchInput
 
     def __init__(self):
         super().__init__()
-    
-    def _run(self, query: str) -> dict:
-        # Use Gemini to extract start/end years and key events
-        prompt = f"""
-            Extract a timeline JSON from: {query}
-            Output format: {{"start_year":, "end_year":, "key_events": []}}
-        """
-        
+
+    @traced("tool")
+    def _run(self, query: str, top_k: int = 5) -> str:
         try:
-            response = gemini_model.generate_content(prompt)
-            result = response.text
-            return json.loads(result) if result else {"error": "Failed to extract timeline."}
-        except json.JSONDecodeError:
-            return {"error": "Invalid JSON from Gemini response."}
+            return format_results(get_knowledge_index().search(query, top_k=top_k))
         except Exception as e:
-            print(f"Gemini API error in ChronoAPITool: {str(e)}")
-            return {"error": f"Error processing with Gemini: {str(e)}"}
+            print(f"Error in KnowledgeSearchTool: {str(e)}")
+            return f"Error: Failed to search the knowledge index: {str(e)}"
+
+# Tool: Intent, entities and timeframe of a query in one Gemini call
+class QueryUnderstandingTool(BaseTool):
+    name: str = "QueryUnderstandingTool"
+    description: str = (
+        "Analyzes a historical query in one step: factual/hypothetical type, academic/casual intent, "
+        "named entities, start and end years, locations and key events, as JSON"
+    )
 
-# Tool: Classify query intent (factual/hypothetical) using Gemini
-class IntentClassifierTool(BaseTool):
-    name: str = "IntentClassifierTool"
-    description: str = "Classifies historical queries as factual or hypothetical"
-    
     def __init__(self):
         super().__init__()
 
+    @traced("tool")
     def _run(self, query: str) -> dict:
-        # Use Gemini to classify the query
-        prompt = f"""
-            Classify this historical query: {query}
-            Output JSON format: {{"type": "factual/hypothetical", "intent": "academic/casual"}}
-        """
-        
         try:
-            response = gemini_model.generate_content(prompt)
-            result = response.text
-            return json.loads(result) if result else {"error": "Failed to classify query."}
-        except json.JSONDecodeError:
-            return {"error": "Invalid JSON from Gemini response."}
+            ask = lambda prompt: generate(self.name, prompt, validate=parse_understanding)
+            return understand_query(query, ask).model_dump()
+        except ValueError as e:
+            return {"error": f"Invalid JSON from Gemini response: {str(e)}"}
         except Exception as e:
-            print(f"Gemini API error in IntentClassifierTool: {str(e)}")
-            return {"error": f"Error classifying with Gemini: {str(e)}"}
+            print(f"Gemini API error in QueryUnderstandingTool: {str(e)}")
+            return {"error": f"Error analyzing query with Gemini: {str(e)}"}
 
 # Tool: Format markdown for reports
 class MarkdownFormatterTool(BaseTool):
@@ -132,9 +192,32 @@ class MarkdownFormatterTool(BaseTool):
     def __init__(self):
         super().__init__()
 
+    @traced("tool")
     def _run(self, content: str, format_type: str = "report") -> str:
+        # Long content is formatted a section at a time. The tool returns one string, so
+        # the parts are joined directly: a spill buffer would only be read back whole.
+        try:
+            return "\n\n".join(
+                # Streams into the current stage's console/file output when streaming is on
+                generate(self.name, self._prompt(part, format_type, i), on_chunk=current_chunk_callback())
+                for i, part in enumerate(iter_text_chunks(str(content), FORMAT_CHUNK_CHARS))
+            )
+        except Exception as e:
+            print(f"Gemini API error in MarkdownFormatterTool: {str(e)}")
+            return f"Error: Failed to format {format_type}."
+    
+    @staticmethod
+    def _prompt(content: str, format_type: str, part: int = 0) -> str:
         # Use Gemini to format the content according to the specified format type
-        prompt = f"""
+        if part:
+            return f"""
+            Continue formatting a historical {format_type} in markdown with this next section:
+            {content}
+            
+            Use the same heading levels, bullet points and citation formatting as before.
+            Do not repeat a title or table of contents.
+        """
+        return f"""
             Format this historical content into a well-structured {format_type} using markdown:
             {content}
             
@@ -143,11 +226,4 @@ class MarkdownFormatterTool(BaseTool):
             - Bullet points for key facts
             - Proper citation formatting
             - Table of contents (if appropriate)
-        """
-        
-        try:
-            response = gemini_model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            print(f"Gemini API error in MarkdownFormatterTool: {str(e)}")
-            return f"Error: Failed to format {format_type}."
\ No newline at end of file
+        """
\ No newline at end of file
@@ -0,0 +1,119 @@
+import os
+from itertools import islice
+
+from crewai_tools import SerperDevTool
+
+from src.history_buff.instrumentation import span, traced
+from src.history_buff.prefetch import current_session
+from src.history_buff.providers import get_client
+from src.history_buff.search_cache import get_search_cache
+
+# EnhancedSerperTool keeps at most this many results, with snippets cut to this length
+MAX_RESULTS = 10
+MAX_SNIPPET_CHARS = 400
+
+
+def structured_results(results: dict, limit: int = MAX_RESULTS):
+    """Yield the organic results as compact dicts, reading no more of the response than needed."""
+    for r in islice((results or {}).get('organic', []), limit):
+        yield {
+            'title': r.get('title'),
+            'link': r.get('link'),
+            'snippet': (r.get('snippet') or '')[:MAX_SNIPPET_CHARS],
+            'date': r.get('date')
+        }
+
+
+# Tool: Serper search served from the shared search cache
+class CachedSerperDevTool(SerperDevTool):
+    """
+    SerperDevTool that checks the local search cache before calling the API.
+    Live requests go through the shared Serper client (rate limits, retries, pooled session).
+    """
+
+    @traced("tool")
+    def _run(self, **kwargs):
+        return super()._run(**kwargs)
+
+    def _make_api_request(self, search_query: str, search_type: str) -> dict:
+        # Results the run's prefetcher already fetched for this (or a near-identical) query
+        session = current_session()
+        if session is not None and search_type == "search":
+            prefetched = session.lookup_search(search_query)
+            if prefetched is not None:
+                return prefetched
+        return self.cached_request(search_query, search_type)
+
+    def cached_request(self, search_query: str, search_type: str = "search") -> dict:
+        """Search through the shared search cache, without looking at prefetched results."""
+        with span("serper", "request", search_type=search_type) as request:
+            fetched = []
+
+            def fetch():
+                fetched.append(True)
+                return self._request_serper(search_query, search_type, request)
+
+            results = get_search_cache().fetch(
+                search_query,
+                fetch,
+                search_type=search_type,
+                n_results=self.n_results,
+                country=self.country,
+                location=self.location,
+                locale=self.locale
+            )
+            # Served from the cache, or by another thread's in-flight request for the same query
+            request.set(cache_hit=0 if fetched else 1)
+            return results
+
+    def _request_serper(self, search_query: str, search_type: str, request=None) -> dict:
+        payload = {"q": search_query, "num": self.n_results}
+        if self.country:
+            payload["gl"] = self.country
+        if self.location:
+            payload["location"] = self.location
+        if self.locale:
+            payload["hl"] = self.locale
+        headers = {
+            "X-API-KEY": os.environ["SERPER_API_KEY"],
+            "content-type": "application/json",
+        }
+        client = get_client("serper")
+
+        def post():
+            response = client.session.post(
+                self._get_search_url(search_type),
+                headers=headers,
+                json=payload,
+                timeout=client.limits["timeout"]
+            )
+            response.raise_for_status()
+            if request is not None:
+                request.add(bytes=len(response.content))
+            return response.json()
+
+        if request is not None:
+            request.set(cache_hit=0, cost_usd=client.cost())
+        results = client.call(post, request={"search_type": search_type, **payload})
+        if not results:
+            raise ValueError("Empty response from Serper API")
+        return results
+
+
+# Tool: Enhanced Serper search tool for structured web search results
+class EnhancedSerperTool(CachedSerperDevTool):
+    def __init__(self):
+        api_key = os.getenv("SERPER_API_KEY")
+        if not api_key:
+            raise ValueError("SERPER_API_KEY environment variable is required")
+        super().__init__(api_key=api_key)
+    
+    def _run(self, query: str) -> list:
+        try:
+            # Call the parent SerperTool's run method
+            results = super()._run(search_query=query)
+            # Structure the results for easier downstream use
+            return list(structured_results(results))
+        except Exception as e:
+            print(f"Error in SerperDev search: {str(e)}")
+            return [{"error": str(e)}]
@@ -0,0 +1,72 @@
+import json
+import os
+
+from src.history_buff.batch import DONE_MARKER, BatchRunner, read_topics, topic_id_for
+
+
+class FakeHistoryBuff:
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.topics = []
+
+    def kickoff(self, inputs, output_dir=None):
+        self.topics.append(inputs["topic"])
+        if inputs["topic"] in self.fail:
+            raise RuntimeError("model unavailable")
+        return f"# {inputs['topic']}"
+
+
+def write_jsonl(path, records):
+    path.write_text("\n".join(json.dumps(r) for r in records) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def test_topic_id_for_prefers_explicit_id():
+    assert topic_id_for({"id": "a/b c"}, "Rome") == "a_b_c"
+    assert topic_id_for({}, "Fall of Rome").startswith("fall-of-rome-")
+    assert topic_id_for({}, "Fall of Rome") != topic_id_for({}, "Rise of Rome")
+
+
+def test_read_topics_skips_bad_lines_and_duplicate_ids(tmp_path, capsys):
+    path = tmp_path / "topics.jsonl"
+    path.write_text('\n'.join([
+        json.dumps({"id": "t1", "topic": "Fall of Rome"}),
+        "not json",
+        json.dumps({"id": "t2"}),
+        json.dumps({"id": "t1", "topic": "Rise of Rome"}),
+        json.dumps("Battle of Hastings"),
+        json.dumps("Battle of Hastings"),
+    ]), encoding="utf-8")
+    topics = list(read_topics(str(path)))
+    assert [t for _, t in topics] == ["Fall of Rome", "Battle of Hastings"]
+    assert "duplicate id 't1' (first used on line 1)" in capsys.readouterr().out
+
+
+def test_run_records_results_failures_and_resumes(tmp_path):
+    path = write_jsonl(tmp_path / "topics.jsonl", [
+        {"id": "rome", "topic": "Fall of Rome"},
+        {"id": "somme", "topic": "Battle of the Somme"},
+    ])
+    out = tmp_path / "out"
+    runner = BatchRunner(FakeHistoryBuff(fail={"Battle of the Somme"}), output_dir=str(out))
+    summary = runner.run(path)
+    assert (summary["completed"], summary["failed"]) == (1, 1)
+    assert (out / "rome" / DONE_MARKER).exists()
+    assert json.loads((out / "somme" / "error.json").read_text())["error"] == "model unavailable"
+
+    history_buff = FakeHistoryBuff()
+    summary = BatchRunner(history_buff, output_dir=str(out)).run(path)
+    assert history_buff.topics == ["Battle of the Somme"]
+    assert (summary["completed"], summary["skipped"]) == (1, 1)
+    assert not (out / "somme" / "error.json").exists()
+
+
+def test_errors_outside_kickoff_count_as_failures(tmp_path):
+    path = write_jsonl(tmp_path / "topics.jsonl", [{"id": "rome", "topic": "Fall of Rome"}])
+    out = tmp_path / "out"
+    out.mkdir()
+    # A file where the topic directory should go makes os.makedirs fail inside _run_topic
+    (out / "rome").write_text("", encoding="utf-8")
+    summary = BatchRunner(FakeHistoryBuff(), output_dir=str(out)).run(path)
+    assert (summary["completed"], summary["failed"]) == (0, 1)
+    assert os.path.isfile(out / "rome")
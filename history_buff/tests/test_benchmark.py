@@ -0,0 +1,121 @@
+import tracemalloc
+
+import pytest
+
+from src.history_buff import cache, knowledge, scraper, search_cache
+from src.history_buff.benchmark import FixtureStore, compare, parse_latency, run_benchmark
+from src.history_buff.cache import ResponseCache, cached_generate
+from src.history_buff.providers import get_client, set_fixtures
+
+
+class Reply:
+    def __init__(self, text):
+        self.text = text
+
+
+class LiveModel:
+    model_name = "fake-live"
+
+    def generate_content(self, prompt, **kwargs):
+        return Reply(f"report on {prompt}")
+
+
+def generate(prompt):
+    return get_client("gemini").call(lambda: LiveModel().generate_content(prompt),
+                                     request={"model": "fake-live", "prompt": prompt})
+
+
+def test_record_then_replay(tmp_path):
+    recorder = FixtureStore(str(tmp_path), record=True)
+    set_fixtures(recorder)
+    try:
+        assert generate("Fall of Rome").text == "report on Fall of Rome"
+    finally:
+        set_fixtures(None)
+
+    replay = FixtureStore(str(tmp_path), latency={"default": parse_latency("none")})
+    set_fixtures(replay)
+    try:
+        assert generate("Fall of Rome").text == "report on Fall of Rome"
+        assert generate("Fall of the Roman Empire").text == "report on Fall of Rome"
+        assert replay.stats()["synthetic"] == 0
+    finally:
+        set_fixtures(None)
+    assert replay.stats() == {"exact": 1, "similar": 1, "synthetic": 0, "recorded": 0, "synthetic_share": 0.0}
+
+
+def test_missing_fixtures_count_as_synthetic(tmp_path):
+    store = FixtureStore(str(tmp_path / "none"), latency={"default": parse_latency("none")})
+    set_fixtures(store)
+    try:
+        assert generate("Fall of Rome").text == "{}"
+    finally:
+        set_fixtures(None)
+    assert store.stats()["synthetic_share"] == 1.0
+
+
+def test_strict_replay_fails_without_exact_fixture(tmp_path):
+    store = FixtureStore(str(tmp_path), strict=True)
+    set_fixtures(store)
+    try:
+        with pytest.raises(KeyError):
+            generate("Fall of Rome")
+    finally:
+        set_fixtures(None)
+
+
+def test_compare_flags_regressions():
+    rows = compare({"topics_per_minute": 8.0, "llm_calls": 10}, {"topics_per_minute": 10.0, "llm_calls": 10})
+    assert [(metric, regressed) for metric, *_, regressed in rows] == [("topics_per_minute", True), ("llm_calls", False)]
+
+
+class CachedCrew:
+    """Kicks off one cached Gemini call per topic, like the custom tools do."""
+
+    def kickoff(self, inputs, output_dir=None):
+        return cached_generate(LiveModel(), inputs["topic"])
+
+
+@pytest.fixture
+def isolated_caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "_llm_cache", ResponseCache(str(tmp_path / "llm.sqlite")))
+    monkeypatch.setattr(search_cache, "_search_cache",
+                        search_cache.SearchCache(ResponseCache(str(tmp_path / "search.sqlite"))))
+    monkeypatch.setattr(scraper, "_fetcher", scraper.PageFetcher(scraper.PageCache(str(tmp_path / "pages"))))
+    monkeypatch.setattr(knowledge, "INDEX_DIR", str(tmp_path / "index"))
+    monkeypatch.setattr(knowledge, "_index", None)
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.mark.parametrize("cold, expected_requests", [(True, 2), (False, 1)])
+def test_warm_up_does_not_serve_the_timed_run(tmp_path, isolated_caches, cold, expected_requests):
+    corpus = tmp_path / "topics.jsonl"
+    corpus.write_text('{"topic": "Fall of Rome"}\n', encoding="utf-8")
+    store = FixtureStore(str(tmp_path / "fixtures"), latency={"default": parse_latency("none")})
+    report = run_benchmark(CachedCrew, str(corpus), store, concurrency=1, cold=cold)
+    assert report["completed"] == 1
+    # The warm-up makes one request; a cold timed run makes its own instead of reading the warm-up's reply
+    assert report["fixtures"]["synthetic"] == expected_requests
+
+
+class TracingCrew:
+    """Notes whether tracemalloc was on during each kickoff."""
+    tracing = []
+
+    def kickoff(self, inputs, output_dir=None):
+        TracingCrew.tracing.append(tracemalloc.is_tracing())
+        return "report"
+
+
+@pytest.mark.parametrize("memory_pass", [True, False])
+def test_timed_run_is_not_traced(tmp_path, isolated_caches, memory_pass):
+    TracingCrew.tracing = []
+    corpus = tmp_path / "topics.jsonl"
+    corpus.write_text('{"topic": "Fall of Rome"}\n{"topic": "Rise of Rome"}\n', encoding="utf-8")
+    store = FixtureStore(str(tmp_path / "fixtures"), latency={"default": parse_latency("none")})
+    report = run_benchmark(TracingCrew, str(corpus), store, concurrency=1, memory_pass=memory_pass)
+    # Warm-up and timed runs first, then the traced memory pass
+    assert TracingCrew.tracing[:3] == [False, False, False]
+    assert TracingCrew.tracing[3:] == ([True, True] if memory_pass else [])
+    assert (report["peak_traced_mb"] is not None) == memory_pass
+    assert not tracemalloc.is_tracing()
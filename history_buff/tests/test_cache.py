@@ -0,0 +1,119 @@
+import json
+import time
+
+import pytest
+
+from src.history_buff import cache
+from src.history_buff.cache import ResponseCache, cached_generate, make_key, normalize_prompt
+
+
+class FakeReply:
+    def __init__(self, text):
+        self.text = text
+
+    def __iter__(self):
+        for i in range(0, len(self.text), 4):
+            yield FakeReply(self.text[i:i + 4])
+
+
+class FakeModel:
+    model_name = "fake-model"
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        return FakeReply(self.replies.pop(0))
+
+
+@pytest.fixture
+def llm_cache(tmp_path, monkeypatch):
+    store = ResponseCache(str(tmp_path / "llm.sqlite"))
+    monkeypatch.setattr(cache, "_llm_cache", store)
+    return store
+
+
+def must_be_json(text):
+    try:
+        json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(str(e))
+
+
+def test_normalize_prompt_ignores_indentation():
+    assert normalize_prompt("  Hello\n\n      world  ") == normalize_prompt("Hello\nworld")
+    assert make_key("a", normalize_prompt(" x ")) == make_key("a", "x")
+
+
+def test_response_cache_expires_entries(tmp_path):
+    store = ResponseCache(str(tmp_path / "c.sqlite"), ttl=1)
+    store.set("k", {"v": 1})
+    assert store.get("k") == {"v": 1}
+    store._connect().execute("UPDATE entries SET created = ?", (time.time() - 5,))
+    assert store.get("k") is None
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    store = ResponseCache(str(tmp_path / "c.sqlite"), max_bytes=30)
+    store.set("a", "x" * 10)
+    store.set("b", "y" * 10)
+    store.get("a")
+    store.set("c", "z" * 10)
+    assert store.get("b") is None
+    assert store.get("a") == "x" * 10
+
+
+def test_cached_generate_reuses_replies(llm_cache):
+    model = FakeModel(["first"])
+    assert cached_generate(model, "prompt") == "first"
+    assert cached_generate(model, "  prompt ") == "first"
+    assert model.calls == 1
+
+
+def test_invalid_replies_are_not_cached(llm_cache):
+    model = FakeModel(["not json", '{"ok": true}'])
+    assert cached_generate(model, "prompt", validate=must_be_json) == "not json"
+    assert cached_generate(model, "prompt", validate=must_be_json) == '{"ok": true}'
+    assert model.calls == 2
+    assert cached_generate(model, "prompt", validate=must_be_json) == '{"ok": true}'
+    assert model.calls == 2
+
+
+def test_cached_reply_failing_validation_is_replaced(llm_cache):
+    model = FakeModel(["not json", '{"ok": true}'])
+    cached_generate(model, "prompt")
+    assert cached_generate(model, "prompt", validate=must_be_json) == '{"ok": true}'
+    assert model.calls == 2
+
+
+def test_streamed_reply_is_passed_to_on_chunk(llm_cache):
+    chunks = []
+    model = FakeModel(["streamed reply"])
+    assert cached_generate(model, "prompt", on_chunk=chunks.append) == "streamed reply"
+    assert "".join(chunks) == "streamed reply"
+    assert len(chunks) > 1
+
+
+def test_file_lock_uses_msvcrt_without_fcntl(tmp_path, monkeypatch):
+    calls = []
+
+    class FakeMsvcrt:
+        LK_LOCK, LK_UNLCK = 1, 0
+
+        def __init__(self):
+            self.failures = 1
+
+        def locking(self, fd, mode, nbytes):
+            # The first attempt times out, as LK_LOCK does when another process holds the lock
+            if mode == self.LK_LOCK and self.failures:
+                self.failures -= 1
+                raise OSError("deadlock avoided")
+            calls.append((mode, nbytes))
+
+    monkeypatch.setattr(cache, "fcntl", None)
+    monkeypatch.setattr(cache, "msvcrt", FakeMsvcrt(), raising=False)
+    with cache.file_lock(str(tmp_path / "locks" / "index.lock")):
+        calls.append("held")
+    assert calls == [(FakeMsvcrt.LK_LOCK, 1), "held", (FakeMsvcrt.LK_UNLCK, 1)]
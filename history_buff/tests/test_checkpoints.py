@@ -0,0 +1,63 @@
+import os
+import time
+
+from src.history_buff.checkpoints import CheckpointStore, RunCheckpoints, run_key
+
+INPUTS = {"topic": "Fall of Rome", "current_year": "2026"}
+
+
+def test_run_key_depends_on_the_inputs():
+    assert run_key(INPUTS) == run_key(dict(INPUTS))
+    assert run_key(INPUTS) != run_key({**INPUTS, "topic": "Rise of Rome"})
+
+
+def test_saved_stage_is_restored_with_the_same_upstream(tmp_path):
+    checkpoints = RunCheckpoints(str(tmp_path), INPUTS, {"research": "abc"})
+    checkpoints.save("research", ["understanding"], "notes")
+    assert checkpoints.load("research", ["understanding"]) == "notes"
+    assert checkpoints.saved == ["research"]
+    assert checkpoints.restored == ["research"]
+
+
+def test_changed_upstream_or_config_makes_the_checkpoint_stale(tmp_path):
+    RunCheckpoints(str(tmp_path), INPUTS, {"research": "abc"}).save("research", ["understanding"], "notes")
+    assert RunCheckpoints(str(tmp_path), INPUTS, {"research": "abc"}).load("research", ["other"]) is None
+    assert RunCheckpoints(str(tmp_path), INPUTS, {"research": "changed"}).load("research", ["understanding"]) is None
+
+
+def test_missing_or_corrupt_checkpoint_loads_as_none(tmp_path):
+    checkpoints = RunCheckpoints(str(tmp_path), INPUTS, {})
+    assert checkpoints.load("research", []) is None
+    (tmp_path / "research.json").write_text("{not json")
+    assert checkpoints.load("research", []) is None
+    assert checkpoints.restored == []
+
+
+def test_invalidate_removes_only_existing_stages(tmp_path):
+    checkpoints = RunCheckpoints(str(tmp_path), INPUTS, {})
+    checkpoints.save("research", [], "notes")
+    checkpoints.save("reporting", ["notes"], "report")
+    assert checkpoints.stages() == ["reporting", "research"]
+    assert checkpoints.invalidate(["reporting", "timeline_creation"]) == ["reporting"]
+    assert checkpoints.stages() == ["research"]
+
+
+def test_store_lists_runs_most_recent_first(tmp_path):
+    store = CheckpointStore(str(tmp_path), ttl=0)
+    store.for_run(INPUTS, {}).save("research", [], "notes")
+    time.sleep(0.01)
+    other = {**INPUTS, "topic": "Rise of Rome"}
+    store.for_run(other, {}).save("query_understanding", [], "{}")
+    runs = store.runs()
+    assert [run["inputs"]["topic"] for run in runs] == ["Rise of Rome", "Fall of Rome"]
+    assert runs[1]["stages"] == ["research"]
+
+
+def test_prune_removes_runs_older_than_the_ttl(tmp_path):
+    store = CheckpointStore(str(tmp_path), ttl=3600)
+    run = store.for_run(INPUTS, {})
+    run.save("research", [], "notes")
+    old = time.time() - 7200
+    os.utime(run.directory, (old, old))
+    assert store.prune() == 1
+    assert store.runs() == []
@@ -0,0 +1,49 @@
+from src.history_buff.compaction import (FACTS_HEADING, ContextCompactor, dedupe_passages, extract_dated_facts,
+                                         split_passages, summarize_with_gemini)
+
+NOTES = """
+The Battle of Hastings was fought in 1066 between William of Normandy and Harold Godwinson.
+
+The Battle of Hastings was fought in 1066 between William of Normandy and Harold Godwinson!
+
+- Harold had marched south after defeating the Norwegians at Stamford Bridge.
+- William was crowned at Westminster Abbey on 25 December 1066.
+
+Unrelated paragraph about modern tourism and gift shops near the abbey ruins today.
+"""
+
+
+def test_split_and_dedupe():
+    passages = split_passages(NOTES)
+    assert len(passages) == 5
+    assert len(dedupe_passages(passages)) == 4
+
+
+def test_extract_dated_facts_in_order():
+    facts = extract_dated_facts(dedupe_passages(split_passages(NOTES)))
+    assert [(date.start, date.month) for date, _ in facts] == [(1066, 0), (1066, 12)]
+
+
+def test_under_budget_context_is_unchanged():
+    compactor = ContextCompactor(summarize=lambda *args: "unused")
+    assert compactor.compact("report", ["a", "b"], "topic", budget=100) == "a\n\nb"
+    assert compactor.stats()["report"]["tokens_saved"] == 0
+
+
+def test_over_budget_context_is_compacted_without_llm():
+    calls = []
+    compactor = ContextCompactor(summarize=lambda *args: calls.append(args))
+    result = compactor.compact("report", [NOTES * 3], "Battle of Hastings", budget=120)
+    assert result.startswith(FACTS_HEADING)
+    assert "tourism" not in result
+    assert calls == []
+    assert compactor.stats()["report"]["tokens_saved"] > 0
+
+
+def test_summarize_with_gemini_goes_through_the_router(monkeypatch):
+    from src.history_buff.tools import custom_tool
+    calls = []
+    monkeypatch.setattr(custom_tool, "generate", lambda tool, prompt, **kwargs: calls.append((tool, prompt)) or "ok")
+    assert summarize_with_gemini("notes", "Rome", 400) == "ok"
+    assert calls[0][0] == "ContextCompactor"
+    assert "at most 300 words" in calls[0][1]
@@ -0,0 +1,83 @@
+from src.history_buff import event_store
+from src.history_buff.event_store import EventStore, served_events, text_entities
+
+
+def test_text_entities_skip_months_and_eras():
+    assert text_entities("Assassination of Franz Ferdinand in June") == [
+        "Assassination of Franz Ferdinand", "Assassination", "Franz Ferdinand"]
+    assert text_entities("476 AD") == []
+
+
+def test_duplicates_across_runs_are_stored_once_with_every_source(tmp_path):
+    store = EventStore(str(tmp_path))
+    assert store.add(["476: Fall of the Western Roman Empire"], "Fall of Rome") == 1
+    store.flush()
+    assert store.add(["476: Fall of the Western Roman Empire"], "Late antiquity") == 1
+    store.flush()
+    store.compact()
+    events = store.query(400, 500)
+    assert len(events) == 1
+    assert events[0].sources == ["Fall of Rome", "Late antiquity"]
+
+
+def test_query_is_chronological_across_segments_and_pending(tmp_path):
+    store = EventStore(str(tmp_path))
+    store.add(["1918: Armistice", "1914: Outbreak of war"], "WWI")
+    store.flush()
+    store.add(["1916: Battle of the Somme", "July 1, 1916: First day on the Somme"], "Somme")
+    store.flush()
+    store.add(["1915: Gallipoli campaign", "1850: Unrelated"], "Gallipoli")
+    texts = [e.text for e in store.query(1900, 1920)]
+    assert texts == ["Outbreak of war", "Gallipoli campaign", "Battle of the Somme",
+                     "First day on the Somme", "Armistice"]
+
+
+def test_query_limit_stops_early(tmp_path, monkeypatch):
+    store = EventStore(str(tmp_path))
+    store.add([f"{year}: Event in {year}" for year in range(1000, 1200)], "Medieval")
+    store.flush()
+    read = []
+    original = event_store.EventSegment.event
+
+    def counting_event(self, i):
+        read.append(i)
+        return original(self, i)
+
+    monkeypatch.setattr(event_store.EventSegment, "event", counting_event)
+    events = store.query(1000, 1199, limit=5)
+    assert [e.start for e in events] == [1000, 1001, 1002, 1003, 1004]
+    assert len(read) < 10
+
+
+def test_entity_filter(tmp_path):
+    store = EventStore(str(tmp_path))
+    store.add(["1914: Assassination of Franz Ferdinand", "1914: Battle of Tannenberg"], "WWI")
+    store.flush()
+    assert [e.text for e in store.query(entities=["franz ferdinand"])] == ["Assassination of Franz Ferdinand"]
+
+
+def test_stores_sharing_a_directory_keep_each_others_segments(tmp_path):
+    first, second = EventStore(str(tmp_path)), EventStore(str(tmp_path))
+    first.add(["1066: Battle of Hastings"], "Normans")
+    first.flush()
+    second.add(["1215: Magna Carta"], "England")
+    second.flush()
+    names = [s["name"] for s in second.manifest["segments"]]
+    assert len(names) == len(set(names))
+    reopened = EventStore(str(tmp_path))
+    assert [e.text for e in reopened.query()] == ["Battle of Hastings", "Magna Carta"]
+
+
+def test_served_events_are_not_recorded_for_the_run(tmp_path):
+    store = EventStore(str(tmp_path))
+    store.add(["410: Sack of Rome by Alaric"], "Visigoths")
+    store.flush()
+    with served_events() as served:
+        related = store.related(["395: Division of Rome", "476: Fall of Rome"], ["Rome"])
+    assert [e.text for e in related] == ["Sack of Rome by Alaric"]
+    timeline = "### 4th century\n- **395**: Division of Rome\n\n### 5th century\n" \
+               "- **410**: Sack of Rome by Alaric\n- **476**: Fall of Rome\n"
+    store.record_run("Fall of Rome", {"timeline_creation": timeline}, served)
+    sources = {e.text: e.sources for e in store.query(300, 500)}
+    assert sources == {"Division of Rome": ["Fall of Rome"], "Sack of Rome by Alaric": ["Visigoths"],
+                       "Fall of Rome": ["Fall of Rome"]}
@@ -0,0 +1,39 @@
+import pytest
+
+from src.history_buff.instrumentation import Tracer, percentile
+
+
+def test_percentile_nearest_rank():
+    assert percentile([], 50) == 0.0
+    assert percentile([4, 1, 3, 2], 50) == 2
+    assert percentile([4, 1, 3, 2], 95) == 4
+
+
+def test_spans_nest_and_aggregate():
+    tracer = Tracer()
+    with tracer.span("research", "task") as task:
+        with tracer.span("gemini", "request", cache_hit=1) as request:
+            assert tracer.current() is request
+            request.add(bytes=10).add(bytes=5)
+        assert request.parent is task
+    assert tracer.current().set(x=1) is tracer.current()
+    aggregate = tracer.aggregates[("request", "gemini")]
+    assert (aggregate["count"], aggregate["bytes"], aggregate["cache_hit"]) == (1, 15, 1)
+
+
+def test_errors_are_counted_and_raised():
+    tracer = Tracer()
+    with pytest.raises(ValueError):
+        with tracer.span("scrape", "tool"):
+            raise ValueError("bad page")
+    assert tracer.aggregates[("tool", "scrape")]["errors"] == 1
+
+
+def test_exports():
+    tracer = Tracer()
+    with tracer.span("serper", "request", cost_usd=0.001):
+        pass
+    events = tracer.chrome_trace()["traceEvents"]
+    assert events[0]["name"] == "serper" and events[0]["ph"] == "X"
+    text = tracer.prometheus_text()
+    assert 'kind="request",name="serper"' in text
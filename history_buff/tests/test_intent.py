@@ -0,0 +1,47 @@
+import json
+
+from src.history_buff.intent import (IntentClassifier, IntentModel, SEED_PATH, log_label, read_examples,
+                                     retrain)
+
+
+def test_rules_settle_unambiguous_queries():
+    classifier = IntentClassifier(IntentModel())
+    result = classifier.classify("What if Rome had never fallen? Just curious")
+    assert (result["type"], result["intent"], result["source"]) == ("hypothetical", "casual", "rules")
+    assert classifier.is_confident(result)
+
+
+def test_untrained_model_is_not_confident():
+    classifier = IntentClassifier(IntentModel())
+    result = classifier.classify("Byzantine coinage")
+    assert result["confidence"] == 0.5
+    assert not classifier.is_confident(result)
+
+
+def test_shipped_model_fits_the_seed_set():
+    classifier = IntentClassifier(IntentModel.load())
+    examples = read_examples(SEED_PATH)
+    assert examples
+    correct = sum(classifier.classify(q)["type"] == labels["type"] for q, labels in examples)
+    assert correct / len(examples) > 0.9
+
+
+def test_log_label_skips_unknown_labels_and_retrains(tmp_path):
+    log_path = tmp_path / "labels.jsonl"
+    log_label("Byzantine coinage reforms", {"type": "factual", "intent": "academic"}, str(log_path))
+    log_label("Byzantine coinage", {"type": "maybe", "intent": "academic"}, str(log_path))
+    assert len(log_path.read_text().splitlines()) == 1
+
+    model_path = tmp_path / "model.json"
+    stats = retrain(str(log_path), str(model_path), include_seed=False)
+    assert stats["examples"] == stats["logged_examples"] == 1
+    assert json.loads(model_path.read_text())["type"]
+    assert IntentClassifier(IntentModel.load(str(model_path))).classify("Byzantine coinage reforms")["type"] == "factual"
+
+
+def test_stats_count_local_and_gemini_answers():
+    classifier = IntentClassifier(IntentModel())
+    classifier.record(local=True)
+    classifier.record(local=True)
+    classifier.record(local=False)
+    assert classifier.stats() == {"local": 2, "gemini": 1, "local_rate": 0.667}
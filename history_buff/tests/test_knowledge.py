@@ -0,0 +1,97 @@
+from src.history_buff.knowledge import (KnowledgeIndex, _page_passages, collect_documents, split_passages,
+                                        tokenize)
+from src.history_buff.scraper import PageCache
+
+ROME = "The Western Roman Empire fell in 476 when Odoacer deposed Romulus Augustulus."
+HASTINGS = "The Battle of Hastings in 1066 began the Norman conquest of England."
+SOMME = "The Battle of the Somme in 1916 was one of the bloodiest battles of the First World War."
+
+
+def documents(**texts):
+    return {source: ("v1", lambda text=text: [text]) for source, text in texts.items()}
+
+
+def test_tokenize_drops_stopwords_and_single_letters():
+    assert tokenize("The Fall of Rome, a history") == ["fall", "rome", "history"]
+
+
+def test_split_passages_respects_size_limits():
+    text = "\n\n".join(["Short paragraph."] * 3 + ["Long sentence. " * 200])
+    passages = split_passages(text)
+    assert passages[0].startswith("Short paragraph. Short paragraph.")
+    assert all(len(p) <= 1200 for p in passages)
+
+
+def test_search_ranks_by_bm25(tmp_path):
+    index = KnowledgeIndex(str(tmp_path))
+    index.update(documents(rome=ROME, hastings=HASTINGS, somme=SOMME))
+    results = index.search("battle of hastings")
+    assert [r["source"] for r in results] == ["hastings", "somme"]
+    assert results[0]["score"] > results[1]["score"]
+    assert index.search("zeppelin") == []
+
+
+def test_segment_postings_and_document_frequency(tmp_path):
+    index = KnowledgeIndex(str(tmp_path))
+    index.update(documents(rome=ROME, hastings=HASTINGS, somme=SOMME))
+    segment = index.segments[0]
+    assert segment.postings("battle") == [(1, 1), (2, 1)]
+    assert segment.document_frequency("battle") == 2
+    assert segment.document_frequency("zeppelin") == 0
+    assert index.search("battle", top_k=1)[0]["source"] in ("hastings", "somme")
+
+
+def test_changed_and_removed_documents_leave_search(tmp_path):
+    index = KnowledgeIndex(str(tmp_path))
+    index.update(documents(rome=ROME, hastings=HASTINGS))
+    index.update({"rome": ("v2", lambda: [SOMME])})
+    assert index.search("odoacer") == []
+    assert index.search("hastings") == []
+    assert [r["source"] for r in index.search("somme")] == ["rome"]
+
+
+def test_compaction_keeps_live_passages(tmp_path):
+    index = KnowledgeIndex(str(tmp_path))
+    index.update(documents(rome=ROME, hastings=HASTINGS))
+    index.update(documents(rome=ROME, somme=SOMME))
+    index.compact()
+    assert len(index.segments) == 1
+    assert index.num_passages == 2
+    assert index.search("somme")[0]["source"] == "somme"
+    assert KnowledgeIndex(str(tmp_path)).search("odoacer")[0]["source"] == "rome"
+
+
+def test_two_indexes_on_one_directory_do_not_reuse_segment_names(tmp_path):
+    first = KnowledgeIndex(str(tmp_path))
+    second = KnowledgeIndex(str(tmp_path))
+    first.update(documents(rome=ROME))
+    # `second` still holds the empty manifest it opened with
+    second.update(documents(rome=ROME, hastings=HASTINGS))
+    names = [s["name"] for s in second.manifest["segments"]]
+    assert len(names) == len(set(names)) == 2
+    reopened = KnowledgeIndex(str(tmp_path))
+    assert reopened.num_passages == 2
+    assert reopened.search("odoacer")[0]["source"] == "rome"
+
+
+def test_collect_documents_reads_files_lazily(tmp_path):
+    (tmp_path / "rome.md").write_text(ROME, encoding="utf-8")
+    (tmp_path / "image.png").write_bytes(b"\\x89PNG")
+    docs = collect_documents(str(tmp_path), include_pages=False)
+    assert list(docs) == [str(tmp_path / "rome.md")]
+    version, loader = docs[str(tmp_path / "rome.md")]
+    assert loader() == [ROME]
+
+
+def test_page_passages_reread_the_cache(tmp_path):
+    cache = PageCache(str(tmp_path))
+    cache.put("https://example.com/rome", {"url": "https://example.com/rome", "title": "Rome", "text": ROME})
+    assert _page_passages(cache, "https://example.com/rome") == [f"Rome: {ROME}"]
+    assert _page_passages(cache, "https://example.com/missing") == []
+
+
+def test_page_passages_read_passage_entries(tmp_path):
+    cache = PageCache(str(tmp_path))
+    cache.put("https://example.com/rome", {"url": "https://example.com/rome", "title": "Rome"}, iter([ROME]))
+    assert cache.get("https://example.com/rome")["passages"] == [ROME]
+    assert _page_passages(cache, "https://example.com/rome") == [f"Rome: {ROME}"]
@@ -0,0 +1,69 @@
+from src.history_buff.memory import MemoryBudget, MemoryTracker, SpillBuffer, current_memory_budget, iter_text_chunks
+
+
+def test_reserve_fails_without_taking_anything():
+    budget = MemoryBudget(max_bytes=10)
+    assert budget.reserve(8)
+    assert not budget.reserve(5)
+    assert budget.used == 8
+
+
+def test_reserve_up_to_takes_what_is_left():
+    budget = MemoryBudget(max_bytes=10)
+    budget.reserve(8)
+    assert budget.reserve_up_to(5) == 2
+    assert budget.reserve_up_to(5) == 0
+    assert MemoryBudget(max_bytes=0).reserve_up_to(5) == 5
+
+
+def test_small_buffer_stays_in_memory_and_counts_against_the_budget():
+    budget = MemoryBudget(max_bytes=100)
+    buffer = SpillBuffer(budget, threshold=50)
+    buffer.write("abc")
+    buffer.write("def")
+    assert not buffer.spilled
+    assert budget.used == 6
+    assert buffer.getvalue("|") == "abc|def"
+    buffer.close()
+    assert budget.used == 0
+
+
+def test_buffer_over_its_threshold_spills_and_reads_back_in_order():
+    budget = MemoryBudget(max_bytes=1000)
+    with SpillBuffer(budget, threshold=10) as buffer:
+        buffer.write("café ")
+        buffer.write("society in Paris")
+        assert buffer.spilled
+        assert budget.used == 0
+        assert list(buffer.chunks()) == ["café ", "society in Paris"]
+        assert budget.stats()["spills"] == 1
+        assert budget.stats()["spilled_bytes"] == len(buffer)
+
+
+def test_buffer_spills_when_the_run_budget_is_used_up():
+    budget = MemoryBudget(max_bytes=8)
+    other = SpillBuffer(budget, threshold=100)
+    other.write("12345")
+    buffer = SpillBuffer(budget, threshold=100)
+    buffer.write("67890")
+    assert buffer.spilled and not other.spilled
+    assert buffer.getvalue() == "67890"
+
+
+def test_run_budget_is_set_for_the_block_and_totalled():
+    tracker = MemoryTracker(max_bytes=10)
+    with tracker.run_budget() as budget:
+        assert current_memory_budget() is budget
+        with SpillBuffer(threshold=100) as buffer:
+            buffer.write("x" * 20)
+    assert current_memory_budget() is None
+    assert tracker.totals["runs"] == 1
+    assert tracker.totals["spills"] == 1
+
+
+def test_iter_text_chunks_respects_the_size_limit():
+    text = "First paragraph.\n\n" + "A sentence. " * 20 + "\n\nLast."
+    chunks = list(iter_text_chunks(text, 60))
+    assert all(len(chunk) <= 60 for chunk in chunks)
+    assert chunks[0] == "First paragraph."
+    assert chunks[-1].endswith("Last.")
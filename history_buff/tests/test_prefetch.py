@@ -0,0 +1,94 @@
+import threading
+from types import SimpleNamespace
+
+from src.history_buff.prefetch import Prefetcher, current_session, plan_entity_queries, plan_topic_queries
+
+
+def fake_search(query):
+    slug = query.replace(" ", "-")
+    return {"organic": [{"link": f"https://example.com/{slug}/1"}, {"link": f"https://example.com/{slug}/2"}]}
+
+
+class FakeFetcher:
+    def __init__(self):
+        self.fetched = []
+
+    def fetch_many(self, urls):
+        self.fetched.extend(urls)
+        return [SimpleNamespace(url=url, error=None, source="network") for url in urls]
+
+
+def make_prefetcher():
+    prefetcher = Prefetcher(max_workers=2)
+    prefetcher.fetch_page = lambda url: SimpleNamespace(url=url, error=None, source="prefetch")
+    return prefetcher
+
+
+def test_entity_queries_use_years_entities_and_events():
+    queries = plan_entity_queries("Fall of Rome", {
+        "start_year": -27, "end_year": 476, "entities": ["Rome", "Odoacer"],
+        "key_events": [{"date": "476", "event": "Deposition of Romulus Augustulus"}],
+    })
+    assert queries == ["Fall of Rome 27 BC to 476", "Odoacer history", "Deposition of Romulus Augustulus 476"]
+
+
+def test_session_answers_searches_and_pages_it_prefetched():
+    prefetcher = make_prefetcher()
+    with prefetcher.session("Fall of Rome", fake_search) as session:
+        assert current_session() is session
+        assert session.lookup_search("fall of rome timeline") == fake_search("Fall of Rome timeline")
+        # The page fetches are issued once the search has finished
+        session.lookup_search("Fall of Rome")
+        page = session.lookup_page("https://example.com/Fall-of-Rome/1")
+        assert page.source == "prefetch"
+    assert current_session() is None
+    stats = prefetcher.stats()
+    assert stats["hits"] == 3 and stats["used"] == 3
+    assert stats["issued"] >= len(plan_topic_queries("Fall of Rome")) + 2
+
+
+def test_near_identical_query_is_answered_and_unrelated_one_misses():
+    prefetcher = make_prefetcher()
+    with prefetcher.session("Fall of Rome", fake_search) as session:
+        assert session.lookup_search("the Fall of Rome timeline please") is not None
+        assert session.lookup_search("Ming dynasty navy") is None
+    assert prefetcher.stats()["misses"] == 1
+
+
+def test_fetch_pages_fetches_only_what_was_not_prefetched():
+    prefetcher = make_prefetcher()
+    fetcher = FakeFetcher()
+    with prefetcher.session("Fall of Rome", fake_search) as session:
+        session.lookup_search("Fall of Rome")
+        urls = ["https://example.com/Fall-of-Rome/1", "https://other.org/a"]
+        pages = session.fetch_pages(urls, fetcher)
+    assert [p.source for p in pages] == ["prefetch", "network"]
+    assert fetcher.fetched == ["https://other.org/a"]
+
+
+def test_cancel_pending_stops_planning_and_cancels_queued_work():
+    started, release = threading.Event(), threading.Event()
+
+    def slow_search(query):
+        started.set()
+        release.wait(5)
+        return {"organic": []}
+
+    prefetcher = Prefetcher(max_workers=1)
+    with prefetcher.session("Fall of Rome", slow_search) as session:
+        started.wait(5)
+        session.cancel_pending()
+        session.plan(["Odoacer history"])
+        release.set()
+        assert len(session.searches) == len(plan_topic_queries("Fall of Rome"))
+    stats = prefetcher.stats()
+    assert stats["cancelled"] == len(plan_topic_queries("Fall of Rome")) - 1
+    assert stats["unused"] == len(plan_topic_queries("Fall of Rome"))
+
+
+def test_plan_from_understanding_reads_raw_json():
+    prefetcher = make_prefetcher()
+    with prefetcher.session("Fall of Rome", fake_search) as session:
+        session.plan_from_understanding(SimpleNamespace(raw='```json\n{"entities": ["Odoacer"]}\n```'))
+        session.plan_from_understanding(SimpleNamespace(raw="not json"))
+        assert "odoacer history" in session.searches
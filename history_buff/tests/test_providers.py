@@ -0,0 +1,101 @@
+import pytest
+
+from src.history_buff import cache, providers
+from src.history_buff.cache import ResponseCache, cached_generate
+from src.history_buff.providers import ProviderClient, TokenBucket, is_retryable
+
+FAST = {"requests_per_minute": 0, "backoff_base": 0.0, "backoff_max": 0.0, "max_retries": 2}
+
+
+class Flaky(Exception):
+    status_code = 503
+
+
+def test_is_retryable():
+    assert is_retryable(Flaky())
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(ValueError("bad request"))
+
+
+def test_token_bucket_does_not_wait_within_capacity():
+    bucket = TokenBucket(60)
+    assert bucket.acquire(10) == 0.0
+
+
+def test_call_retries_transient_errors():
+    client = ProviderClient("test", FAST)
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Flaky()
+        return "ok"
+
+    assert client.call(fn) == "ok"
+    assert client.metrics()["retries"] == 2
+    with pytest.raises(ValueError):
+        client.call(lambda: (_ for _ in ()).throw(ValueError("no")))
+    assert client.metrics()["failures"] == 1
+
+
+def test_consume_runs_inside_the_call():
+    client = ProviderClient("test", dict(FAST, max_concurrency=1))
+    seen = []
+
+    def consume(stream):
+        for chunk in stream:
+            # The slot is still held while the stream is read
+            seen.append((chunk, client._slots.acquire(blocking=False)))
+        return "".join(c for c, _ in seen)
+
+    assert client.call(lambda: iter(["a", "b"]), consume=consume) == "ab"
+    assert [held for _, held in seen] == [False, False]
+
+
+class Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class StreamingModel:
+    model_name = "fake-stream"
+
+    def __init__(self, streams):
+        self.streams = list(streams)
+
+    def generate_content(self, prompt, stream=False):
+        return self.streams.pop(0)()
+
+
+@pytest.fixture
+def gemini(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "_llm_cache", ResponseCache(str(tmp_path / "llm.sqlite")))
+    monkeypatch.setitem(providers._clients, "gemini", ProviderClient("gemini", FAST))
+
+
+def test_stream_failing_before_first_chunk_is_retried(gemini):
+    def broken():
+        raise Flaky()
+        yield
+
+    def good():
+        yield Chunk("Hel")
+        yield Chunk("lo")
+
+    chunks = []
+    model = StreamingModel([broken, good])
+    assert cached_generate(model, "p", on_chunk=chunks.append) == "Hello"
+    assert chunks == ["Hel", "lo"]
+
+
+def test_stream_failing_after_chunks_is_not_retried(gemini):
+    def partial():
+        yield Chunk("Hel")
+        raise Flaky()
+
+    chunks = []
+    model = StreamingModel([partial, partial])
+    with pytest.raises(RuntimeError, match="interrupted after 1 chunks"):
+        cached_generate(model, "p", on_chunk=chunks.append)
+    assert chunks == ["Hel"]
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from src.history_buff import intent
+from src.history_buff.intent import IntentClassifier, IntentModel
+from src.history_buff.query_understanding import parse_understanding, repair_json, understand_query
+
+REPLY = {"type": "factual", "intent": "academic", "entities": ["Roman Empire"], "start_year": "376 AD",
+         "end_year": 476, "key_events": ["476: Deposition of Romulus Augustulus"]}
+
+
+@pytest.fixture
+def classifier(monkeypatch):
+    classifier = IntentClassifier(IntentModel())
+    monkeypatch.setattr(intent, "_classifier", classifier)
+    monkeypatch.setattr(intent, "log_label", lambda query, labels: None)
+    return classifier
+
+
+def test_repair_json_handles_fences_prose_and_trailing_commas():
+    text = 'Here you go:\n```json\n{"type": "factual", "entities": ["Rome",], "x": None}\n```'
+    assert repair_json(text) == {"type": "factual", "entities": ["Rome"], "x": None}
+
+
+def test_parse_understanding_normalizes_labels_and_years():
+    understanding = parse_understanding(json.dumps({**REPLY, "type": "Factual/Academic"}))
+    assert (understanding.type, understanding.start_year, understanding.end_year) == ("factual", 376, 476)
+    assert understanding.key_events[0].date == "476"
+
+
+@pytest.mark.parametrize("data", [
+    {},
+    {"entities": ["Rome"], "start_year": 376},
+    {"type": "factual", "entities": ["Rome"]},
+    {"type": "maybe", "intent": "academic"},
+])
+def test_replies_missing_labels_are_rejected(data):
+    with pytest.raises(ValueError):
+        parse_understanding(json.dumps(data))
+
+
+def test_open_topics_need_no_entities_or_years():
+    understanding = parse_understanding(json.dumps({"type": "hypothetical", "intent": "casual"}))
+    assert understanding.entities == []
+    assert understanding.start_year is None and understanding.end_year is None
+
+
+def test_confident_local_labels_still_count_as_a_gemini_answer(classifier):
+    reply = json.dumps({**REPLY, "type": "factual", "intent": "academic"})
+    understanding = understand_query("What if Rome had never fallen? Just curious", lambda prompt: reply)
+    assert (understanding.type, understanding.intent) == ("hypothetical", "casual")
+    assert understanding.source == "gemini+rules"
+    assert classifier.stats()["local"] == 0
+    assert classifier.stats()["gemini"] == 1
+
+
+def fail(prompt):
+    raise RuntimeError("Gemini unavailable")
+
+
+@pytest.mark.parametrize("generate", [lambda prompt: "{}", lambda prompt: "no JSON here", fail])
+def test_unusable_or_failed_reply_falls_back_to_local_labels(classifier, generate):
+    understanding = understand_query("What if the printing press was never invented?", generate)
+    assert (understanding.type, understanding.source) == ("hypothetical", "rules")
+    assert understanding.entities == [] and understanding.start_year is None
+    assert classifier.stats() == {"local": 1, "gemini": 0, "local_rate": 1.0}
+
+
+def test_first_stage_survives_a_failed_gemini_call(classifier, monkeypatch):
+    from src.history_buff.scheduler import ToolTask
+    from src.history_buff.tools import custom_tool
+
+    monkeypatch.setattr(custom_tool, "generate", lambda name, prompt, validate=None: fail(prompt))
+    output = ToolTask(custom_tool.QueryUnderstandingTool(),
+                      {"query": "What if the printing press was never invented?"}).execute_sync()
+    assert output.data["type"] == "hypothetical"
+    assert output.data["entities"] == []
@@ -0,0 +1,87 @@
+import json
+import os
+import time
+
+import pytest
+import yaml
+
+from src.history_buff.report_store import (
+    CONFIG_PATH, ReportStore, entity_terms, jaccard, topic_numerals, topic_terms, years_match,
+)
+from src.history_buff.scheduler import task_dependencies
+
+OUTPUTS = {
+    "query_understanding": json.dumps({"type": "factual", "intent": "academic", "entities": ["Rome"],
+                                       "start_year": 376, "end_year": 476}),
+    "research": "Research notes",
+    "timeline_creation": "Timeline",
+    "reporting": "Report",
+}
+
+with open(os.path.join(os.path.dirname(CONFIG_PATH), "tasks.yaml"), "r") as f:
+    DEPS = task_dependencies(yaml.safe_load(f))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ReportStore(str(tmp_path), settings={
+        "reuse_threshold": 0.8, "seed_threshold": 0.7, "reuse_max_age_days": 7,
+        "seed_max_age_days": 30, "seed_stages": ["query_understanding", "research"],
+    })
+
+
+def test_numerals_are_read_from_ordinals_and_roman_numerals():
+    assert topic_numerals("World War II") == {"ii": 2}
+    assert topic_numerals("Second Punic War") == {"second": 2}
+    assert topic_numerals("Rome in the 5th century") == {"5th": 5}
+    assert topic_numerals("Louis XIV of France") == {"xiv": 14}
+    assert topic_numerals("I wonder about Rome") == {}
+
+
+def test_second_and_2nd_give_the_same_terms():
+    assert topic_terms("Second Punic War") == topic_terms("2nd Punic War")
+
+
+@pytest.mark.parametrize("first,second", [
+    ("World War I", "World War II"),
+    ("First Punic War", "Second Punic War"),
+])
+def test_numbered_topics_have_different_entities(first, second):
+    assert entity_terms(topic_terms(first)) != entity_terms(topic_terms(second))
+
+
+@pytest.mark.parametrize("stored,topic", [
+    ("World War I", "World War II"),
+    ("First Punic War", "Second Punic War"),
+    ("Fall of Rome", "Rise of Rome"),
+])
+def test_different_subjects_are_not_seeded(store, stored, topic):
+    store.add(stored, OUTPUTS)
+    assert store.find(topic) is None
+
+
+def test_rephrased_topic_is_reused(store):
+    store.add("Fall of Rome", OUTPUTS)
+    match = store.find("why did Rome fall")
+    assert match is not None and match.action == "reuse"
+    # What HistoryBuff checks before returning the stored report without running any stage
+    assert set(DEPS) <= set(match.outputs)
+
+
+def test_similar_topic_with_same_entities_is_seeded(store):
+    store.add("Fall of Rome", OUTPUTS)
+    match = store.find("causes of the fall of Rome")
+    assert match.action == "seed"
+    assert set(match.outputs) == {"query_understanding", "research"}
+
+
+def test_fall_and_rise_score_below_the_seed_threshold():
+    assert jaccard(topic_terms("Fall of Rome"), topic_terms("Rise of Rome")) < 0.7
+
+
+def test_year_range_must_cover_the_topic_period():
+    entry = {"topic": "Rome in 410", "created": time.time()}
+    assert years_match("Rome in 410", entry, OUTPUTS)
+    stale = dict(OUTPUTS, query_understanding=json.dumps({"start_year": 1, "end_year": 100}))
+    assert not years_match("Rome in 410", entry, stale)
+    assert not years_match("Rome", entry, OUTPUTS)
@@ -0,0 +1,92 @@
+import pytest
+
+from src.history_buff.routing import Router
+
+TIERS = {
+    "gemini": {
+        "fast": {"model": "small", "prompt_cost_per_1k": 0.001, "completion_cost_per_1k": 0.002,
+                 "typical_seconds": 1},
+        "strong": {"model": "large", "prompt_cost_per_1k": 0.01, "completion_cost_per_1k": 0.02,
+                   "typical_seconds": 10},
+    }
+}
+
+
+def make_router(budget=None):
+    return Router(TIERS, {"ReportTool": "strong", "SearchTool": "fast"}, budget or {})
+
+
+def validate_long(text):
+    if len(text) < 5:
+        raise ValueError("too short")
+
+
+def test_configured_tier_is_used_without_a_budget():
+    route = make_router().route("gemini", "ReportTool", 100)
+    assert route.model == "large"
+    assert route.reason == "configured"
+
+
+def test_unknown_target_uses_the_default_tier():
+    assert make_router().route("gemini", "Unlisted").model == "small"
+
+
+def test_unknown_provider_falls_back_to_a_default_model():
+    assert make_router().tier("openai").model == "gpt-3.5-turbo"
+
+
+def test_exhausted_budget_downgrades_to_the_cheapest_tier():
+    router = make_router({"max_cost_usd": 1.0})
+    with router.request_budget() as budget:
+        budget.spend(0.9)
+        route = router.route("gemini", "ReportTool", 100)
+    assert route.model == "small"
+    assert route.reason.startswith("budget")
+
+
+def test_call_that_costs_more_than_is_left_is_downgraded():
+    router = make_router({"max_cost_usd": 1.0})
+    with router.request_budget():
+        route = router.route("gemini", "ReportTool", 200_000)
+    assert route.model == "small"
+    assert route.reason.startswith("cost")
+
+
+def test_invalid_output_escalates_once_to_the_bigger_tier():
+    router = make_router()
+    models = []
+
+    def call(model):
+        models.append(model)
+        return "ok" if model == "small" else "a valid answer"
+
+    assert router.generate("gemini", "SearchTool", call, "prompt", validate=validate_long) == "a valid answer"
+    assert models == ["small", "large"]
+    assert router.stats()["escalations"] == 1
+
+
+def test_invalid_output_on_the_biggest_tier_is_returned_as_is():
+    router = make_router()
+    assert router.generate("gemini", "ReportTool", lambda model: "bad", "prompt", validate=validate_long) == "bad"
+    assert router.stats()["escalations"] == 0
+
+
+def test_no_escalation_when_the_budget_is_nearly_spent():
+    router = make_router({"max_cost_usd": 1.0})
+    with router.request_budget() as budget:
+        budget.spend(0.95)
+        route = router.route("gemini", "SearchTool")
+        assert router.escalate(route) is None
+
+
+def test_record_spends_the_budget_and_counts_downgrades():
+    router = make_router({"max_cost_usd": 1.0})
+    with router.request_budget() as budget:
+        budget.spend(0.9)
+        route = router.route("gemini", "ReportTool", 1000)
+        cost = router.record(route, 0.5, 1000, 500)
+        assert budget.spent_usd == pytest.approx(0.9 + cost)
+    stats = router.stats()
+    assert stats["downgrades"] == 1
+    assert stats["downgrade_saved_usd"] > 0
+    assert stats["tiers"]["gemini:fast"]["calls"] == 1
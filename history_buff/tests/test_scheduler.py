@@ -0,0 +1,209 @@
+import json
+import time
+
+import pytest
+
+from src.history_buff.checkpoints import RunCheckpoints
+from src.history_buff.scheduler import (CONTEXT_DIVIDER, DagScheduler, ToolTask, critical_path, downstream_of,
+                                        is_static_graph, task_dependencies, topological_order)
+
+
+DEPS = {
+    "query_understanding": [],
+    "research": ["query_understanding"],
+    "timeline_creation": ["research"],
+    "reporting": ["research", "timeline_creation"],
+}
+
+
+def test_task_dependencies_accepts_a_single_string():
+    config = {"a": {"depends_on": []}, "b": {"depends_on": "a"}}
+    assert task_dependencies(config) == {"a": [], "b": ["a"]}
+
+
+def test_is_static_graph_needs_depends_on_everywhere():
+    assert is_static_graph({"a": {"depends_on": []}, "b": {"depends_on": ["a"]}})
+    assert not is_static_graph({"a": {"depends_on": []}, "b": {}})
+
+
+def test_topological_order_puts_dependencies_first():
+    order = topological_order({"reporting": ["research", "timeline_creation"], "timeline_creation": ["research"],
+                                "research": []})
+    assert order == ["research", "timeline_creation", "reporting"]
+
+
+def test_topological_order_keeps_config_order_for_independent_tasks():
+    assert topological_order({"b": [], "a": [], "c": ["a"]}) == ["b", "a", "c"]
+
+
+def test_topological_order_rejects_cycles():
+    with pytest.raises(ValueError, match="cycle"):
+        topological_order({"a": ["b"], "b": ["a"]})
+
+
+def test_topological_order_rejects_unknown_tasks():
+    with pytest.raises(ValueError, match="unknown"):
+        topological_order({"a": ["missing"]})
+
+
+def test_downstream_of():
+    assert downstream_of(DEPS, "timeline_creation") == ["timeline_creation", "reporting"]
+    assert downstream_of(DEPS, "query_understanding") == list(DEPS)
+
+
+def test_critical_path_follows_the_slowest_chain():
+    length, path = critical_path(DEPS, {"query_understanding": 1, "research": 5, "timeline_creation": 2,
+                                        "reporting": 3})
+    assert length == 11
+    assert path == ["query_understanding", "research", "timeline_creation", "reporting"]
+
+
+class FakeAgent:
+    def __init__(self, role):
+        self.role = role
+
+
+class FakeTask:
+    """Task with the execute_sync interface the scheduler calls; records its context and timing."""
+
+    def __init__(self, name, agent=None, seconds=0.0, fail=False, log=None):
+        self.name = name
+        self.agent = agent or FakeAgent(name)
+        self.seconds = seconds
+        self.fail = fail
+        self.log = log if log is not None else []
+        self.context = None
+        self.calls = 0
+
+    def execute_sync(self, agent=None, context=None):
+        self.calls += 1
+        self.context = context
+        self.log.append(("start", self.name, time.perf_counter()))
+        time.sleep(self.seconds)
+        if self.fail:
+            raise RuntimeError(f"{self.name} failed")
+        self.log.append(("end", self.name, time.perf_counter()))
+        return f"{self.name} output"
+
+
+def make_tasks(deps, **kwargs):
+    log = []
+    return {name: FakeTask(name, log=log, **kwargs.get(name, {})) for name in deps}, log
+
+
+def window(log, name):
+    start = next(t for kind, n, t in log if kind == "start" and n == name)
+    end = next(t for kind, n, t in log if kind == "end" and n == name)
+    return start, end
+
+
+def test_run_passes_upstream_outputs_as_context():
+    tasks, _ = make_tasks(DEPS)
+    result = DagScheduler().run(tasks, DEPS)
+    assert tasks["query_understanding"].context is None
+    assert tasks["research"].context == "query_understanding output"
+    assert tasks["reporting"].context == CONTEXT_DIVIDER.join(["research output", "timeline_creation output"])
+    assert result.raw == "reporting output"
+    assert set(result.timings) == set(DEPS)
+
+
+def test_independent_tasks_overlap():
+    deps = {"a": [], "b": [], "c": ["a", "b"]}
+    tasks, log = make_tasks(deps, a={"seconds": 0.2}, b={"seconds": 0.2})
+    result = DagScheduler(max_workers=2).run(tasks, deps)
+    a, b = window(log, "a"), window(log, "b")
+    assert a[0] < b[1] and b[0] < a[1]
+    assert result.wall_time < result.serial_time
+
+
+def test_tasks_sharing_an_agent_never_overlap():
+    deps = {"a": [], "b": []}
+    agent = FakeAgent("shared")
+    tasks, log = make_tasks(deps, a={"seconds": 0.1, "agent": agent}, b={"seconds": 0.1, "agent": agent})
+    DagScheduler(max_workers=2).run(tasks, deps)
+    a, b = window(log, "a"), window(log, "b")
+    assert a[1] <= b[0] or b[1] <= a[0]
+
+
+def test_failure_stops_scheduling_and_is_raised():
+    deps = {"a": [], "b": [], "c": ["a"], "d": ["b"]}
+    tasks, _ = make_tasks(deps, a={"fail": True}, b={"seconds": 0.2})
+    with pytest.raises(RuntimeError, match="a failed"):
+        DagScheduler(max_workers=2).run(tasks, deps)
+    # Nothing downstream starts once a task has failed, even when its own inputs are ready
+    assert tasks["c"].calls == tasks["d"].calls == 0
+    assert tasks["b"].calls == 1
+
+
+def test_precomputed_outputs_feed_downstream_tasks():
+    tasks, _ = make_tasks(DEPS)
+    result = DagScheduler().run(tasks, DEPS, precomputed={"query_understanding": "stored understanding",
+                                                          "research": "stored research"})
+    assert tasks["query_understanding"].calls == tasks["research"].calls == 0
+    assert tasks["timeline_creation"].context == "stored research"
+    assert result.outputs["research"] == "stored research"
+
+
+def test_compact_hook_builds_the_context():
+    calls = []
+
+    def compact(name, upstream):
+        calls.append((name, upstream))
+        return f"compacted for {name}"
+
+    tasks, _ = make_tasks(DEPS)
+    DagScheduler(compact=compact).run(tasks, DEPS)
+    assert ("research", ["query_understanding output"]) in calls
+    assert tasks["research"].context == "compacted for research"
+    assert all(name != "query_understanding" for name, _ in calls)
+
+
+def test_checkpoints_are_saved_and_restored(tmp_path):
+    inputs = {"topic": "Fall of Rome"}
+    first, _ = make_tasks(DEPS)
+    checkpoints = RunCheckpoints(str(tmp_path), inputs, {})
+    DagScheduler().run(first, DEPS, checkpoints=checkpoints)
+    assert sorted(checkpoints.saved) == sorted(DEPS)
+
+    second, _ = make_tasks(DEPS)
+    restored = RunCheckpoints(str(tmp_path), inputs, {})
+    restored.invalidate(["reporting"])
+    result = DagScheduler().run(second, DEPS, checkpoints=restored)
+    assert sorted(restored.restored) == ["query_understanding", "research", "timeline_creation"]
+    assert [name for name, task in second.items() if task.calls] == ["reporting"]
+    assert result.raw == "reporting output"
+
+
+def test_on_finish_sees_every_task():
+    finished = []
+    tasks, _ = make_tasks(DEPS)
+    DagScheduler().run(tasks, DEPS, on_finish=lambda name, output: finished.append(name))
+    assert sorted(finished) == sorted(DEPS)
+
+
+class FakeTool:
+    name = "FakeTool"
+
+    def __init__(self, result):
+        self.result = result
+        self.arguments = None
+
+    def run(self, **arguments):
+        self.arguments = arguments
+        return self.result
+
+
+def test_tool_task_returns_json_and_writes_the_output_file(tmp_path):
+    tool = FakeTool({"type": "factual", "entities": ["Rome"]})
+    path = tmp_path / "understanding.json"
+    output = ToolTask(tool, {"query": "Fall of Rome"}, str(path)).execute_sync()
+    assert tool.arguments == {"query": "Fall of Rome"}
+    assert output.data == {"type": "factual", "entities": ["Rome"]}
+    assert json.loads(output.raw) == output.data
+    assert path.read_text() == output.raw
+
+
+@pytest.mark.parametrize("result", [{"error": "bad reply"}, "Error: bad reply"])
+def test_tool_task_raises_on_tool_errors(result):
+    with pytest.raises(RuntimeError, match="FakeTool failed: bad reply"):
+        ToolTask(FakeTool(result), {}).execute_sync()
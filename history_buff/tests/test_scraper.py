@@ -0,0 +1,162 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.history_buff.memory import MemoryBudget, _budget
+from src.history_buff.scraper import (ExtractedPage, PageCache, PageExtractor, PageFetcher, extract_article,
+                                      format_pages, is_supported)
+
+ARTICLE = """
+<html><head><title>Battle of Hastings</title></head><body>
+<nav><a href="/">Home</a> <a href="/wars">Wars</a></nav>
+<article>
+<h1>Battle of Hastings</h1>
+<p>The Battle of Hastings was fought on 14 October 1066 between the Norman-French army of William,
+the Duke of Normandy, and an English army under the Anglo-Saxon King Harold Godwinson.</p>
+<p>It began the Norman Conquest of England and is remembered as a decisive Norman victory.</p>
+</article>
+<footer>Copyright notice and some other links that are long enough to count as a block</footer>
+</body></html>
+"""
+
+PAGES = {
+    "/article": ("text/html; charset=utf-8", ARTICLE.encode("utf-8")),
+    "/plain": ("text/plain", b"First paragraph of the notes.\n\nSecond paragraph of the notes."),
+    "/xhtml": ("application/xhtml+xml", ARTICLE.encode("utf-8")),
+    "/report.pdf": ("application/pdf", b"%PDF-1.4 binary"),
+    "/data": ("application/json", b'{"year": 1066}'),
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        content_type, body = PAGES[self.path]
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+def test_extract_article_keeps_main_text_only():
+    title, passages = extract_article(ARTICLE)
+    assert title == "Battle of Hastings"
+    assert passages[0] == "Battle of Hastings"
+    assert any("14 October 1066" in p for p in passages)
+    assert not any("Copyright" in p or "Home" in p for p in passages)
+
+
+def test_extractor_decodes_chunks_split_inside_characters():
+    extractor = PageExtractor("text/plain; charset=utf-8")
+    data = "Café society in 1920s Paris.\n\nSecond passage.".encode("utf-8")
+    for i in range(len(data)):
+        extractor.feed(data[i:i + 1])
+    assert extractor.close() == ("", ["Café society in 1920s Paris.", "Second passage."])
+
+
+def test_extractor_caps_kept_text():
+    extractor = PageExtractor("text/plain", max_chars=20)
+    extractor.feed_text("a" * 15 + "\n\n" + "b" * 15 + "\n\n" + "c" * 15)
+    _, passages = extractor.close()
+    assert passages == ["a" * 15, "b" * 15]
+    assert extractor.truncated
+
+
+@pytest.mark.parametrize("content_type, supported", [
+    ("text/html; charset=utf-8", True),
+    ("application/xhtml+xml", True),
+    ("TEXT/PLAIN", True),
+    ("", True),
+    ("application/pdf", False),
+    ("application/json", False),
+    ("image/png", False),
+])
+def test_is_supported(content_type, supported):
+    assert is_supported(content_type) == supported
+
+
+def test_from_passages_offsets_and_format():
+    page = ExtractedPage.from_passages("https://example.com", "Title", ["one two", "three"])
+    assert list(page.passages()) == [(0, 7, "one two"), (9, 14, "three")]
+    assert page.text == "one two\n\nthree"
+    assert "[9-14] three" in format_pages([page])
+
+
+def test_fetch_extracts_and_caches_text_types(server, tmp_path):
+    fetcher = PageFetcher(PageCache(str(tmp_path)))
+    html, plain, xhtml = fetcher.fetch_many([f"{server}/article", f"{server}/plain", f"{server}/xhtml"])
+    assert html.error is None and html.title == "Battle of Hastings"
+    assert plain.text == "First paragraph of the notes.\n\nSecond paragraph of the notes."
+    assert xhtml.text == html.text
+    again = fetcher.fetch(f"{server}/article")
+    assert again.from_cache and again.text == html.text
+
+
+@pytest.mark.parametrize("path", ["/report.pdf", "/data"])
+def test_fetch_rejects_other_types_without_caching(server, tmp_path, path):
+    cache = PageCache(str(tmp_path))
+    page = PageFetcher(cache).fetch(f"{server}{path}")
+    assert page.error.startswith("unsupported content type")
+    assert page.text == ""
+    assert cache.get(f"{server}{path}") is None
+
+
+def test_cache_entries_store_passages_and_old_text_entries_still_load(server, tmp_path):
+    cache = PageCache(str(tmp_path))
+    fetcher = PageFetcher(cache)
+    page = fetcher.fetch(f"{server}/plain")
+    entry = cache.get(f"{server}/plain")
+    assert entry["passages"] == ["First paragraph of the notes.", "Second paragraph of the notes."]
+    assert "text" not in entry
+
+    old = {key: value for key, value in entry.items() if key != "passages"}
+    old["text"] = page.text
+    cache.put(f"{server}/plain", old)
+    again = fetcher.fetch(f"{server}/plain")
+    assert again.from_cache
+    assert list(again.passages()) == list(page.passages())
+
+
+def test_page_cache_streams_passages_into_an_empty_entry(tmp_path):
+    cache = PageCache(str(tmp_path))
+    cache.put("https://example.com", {}, iter(['quote " and \\ backslash', "two"]))
+    assert cache.get("https://example.com") == {"passages": ['quote " and \\ backslash', "two"]}
+
+
+def test_body_read_is_reserved_from_the_run_budget(server, tmp_path):
+    budget = MemoryBudget(max_bytes=20)
+    token = _budget.set(budget)
+    try:
+        page = PageFetcher(PageCache(str(tmp_path))).fetch(f"{server}/plain")
+    finally:
+        _budget.reset(token)
+    # Only the text the reservation covered is kept, and the reservation is given back
+    assert list(page.passages()) == [(0, 29, "First paragraph of the notes.")]
+    assert page.truncated
+    assert budget.peak >= 20 and budget.used == 0
+
+
+def test_fetch_with_the_budget_used_up_is_an_error_and_not_cached(server, tmp_path):
+    budget = MemoryBudget(max_bytes=10)
+    budget.reserve(10)
+    cache = PageCache(str(tmp_path))
+    token = _budget.set(budget)
+    try:
+        page = PageFetcher(cache).fetch(f"{server}/plain")
+    finally:
+        _budget.reset(token)
+    assert "memory budget" in page.error
+    assert cache.get(f"{server}/plain") is None
@@ -0,0 +1,64 @@
+import threading
+
+from src.history_buff.cache import ResponseCache
+from src.history_buff.search_cache import SearchCache, canonical_url, dedupe_results, normalize_query
+
+
+def test_normalize_query_keeps_word_order():
+    assert normalize_query("Causes of World War I") != normalize_query("World War I causes of")
+    assert normalize_query("  The   Fall of ROME! ") == "fall of rome"
+
+
+def test_normalize_query_keeps_question_words():
+    assert normalize_query("Who started the Thirty Years War?") == "who started thirty years war"
+    assert normalize_query("why did rome fall") != normalize_query("how did rome fall")
+    assert normalize_query("the") == "the"
+
+
+def test_canonical_url_drops_tracking_and_host_prefix():
+    assert canonical_url("https://www.example.com/a/?utm_source=x&b=2&gclid=1") == "//example.com/a?b=2"
+    assert canonical_url("http://m.example.com/a") == canonical_url("https://example.com/a/")
+
+
+def test_dedupe_results_by_canonical_url():
+    results = [{"link": "https://example.com/a"}, {"link": "https://www.example.com/a/"}, {"link": "https://example.com/b"}]
+    unique, removed = dedupe_results(results)
+    assert [r["link"] for r in unique] == ["https://example.com/a", "https://example.com/b"]
+    assert removed == 1
+
+
+def test_fetch_caches_by_normalized_query(tmp_path):
+    search = SearchCache(ResponseCache(str(tmp_path / "s.sqlite")))
+    calls = []
+
+    def fetcher():
+        calls.append(1)
+        return {"organic": [{"link": "https://example.com/a"}, {"link": "https://example.com/a?utm_medium=x"}]}
+
+    first = search.fetch("The Fall of Rome", fetcher)
+    second = search.fetch("fall of  rome", fetcher)
+    assert first == second and len(first["organic"]) == 1
+    assert len(calls) == 1
+    search.fetch("rome of fall", fetcher)
+    assert len(calls) == 2
+
+
+def test_concurrent_fetches_share_one_request(tmp_path):
+    search = SearchCache(ResponseCache(str(tmp_path / "s.sqlite")))
+    release = threading.Event()
+    calls = []
+
+    def fetcher():
+        calls.append(1)
+        release.wait(5)
+        return {"organic": []}
+
+    threads = [threading.Thread(target=search.fetch, args=("battle of hastings", fetcher)) for _ in range(3)]
+    for t in threads:
+        t.start()
+    while search.coalesced < 2:
+        pass
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+import pytest
+
+from src.history_buff.service import ReportService, StubHistoryBuff, coalesce_key
+
+
+async def request(port, method, path, body=b""):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: x\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+    await writer.drain()
+    # The server closes the connection after every response
+    raw = await asyncio.wait_for(reader.read(), 5)
+    writer.close()
+    head, _, payload = raw.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(payload)
+
+
+def run_service(tmp_path, scenario, **kwargs):
+    async def main():
+        service = ReportService(factory=lambda: StubHistoryBuff(delay=0.05), pool_size=1,
+                                output_dir=str(tmp_path), **kwargs)
+        await service.start()
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        try:
+            return await scenario(service, server.sockets[0].getsockname()[1])
+        finally:
+            server.close()
+            await service.stop()
+    return asyncio.run(main())
+
+
+def test_coalesce_key_normalizes_topic():
+    assert coalesce_key("  Fall of  ROME ", "2025") == coalesce_key("fall of rome", "2025")
+    assert coalesce_key("fall of rome", "2024") != coalesce_key("fall of rome", "2025")
+
+
+@pytest.mark.parametrize("body", [b"[]", b'"x"', b"1", b"null", b"{not json"])
+def test_non_object_bodies_are_rejected(tmp_path, body):
+    status, payload = run_service(tmp_path, lambda service, port: request(port, "POST", "/reports", body))
+    assert status == 400
+    assert "error" in payload
+
+
+def test_report_round_trip(tmp_path):
+    async def scenario(service, port):
+        status, job = await request(port, "POST", "/reports", json.dumps({"topic": "Fall of Rome"}).encode())
+        assert status == 202
+        status, done = await request(port, "POST", "/reports?wait=true", json.dumps({"topic": "fall of rome"}).encode())
+        return job, status, done
+
+    job, status, done = run_service(tmp_path, scenario)
+    assert status == 200 and done["coalesced"] and done["id"] == job["id"]
+    assert done["result"].startswith("# Fall of Rome")
+
+
+def test_unexpected_errors_return_500(tmp_path, capsys):
+    async def scenario(service, port):
+        async def broken(body, query):
+            raise RuntimeError("boom")
+        service._create_report = broken
+        return await request(port, "POST", "/reports", b'{"topic": "Rome"}')
+
+    status, payload = run_service(tmp_path, scenario)
+    assert status == 500
+    assert payload == {"error": "Internal server error"}
+    assert "RuntimeError: boom" in capsys.readouterr().out
+
+
+def test_unknown_paths_and_methods(tmp_path):
+    async def scenario(service, port):
+        return [(await request(port, "GET", "/nope"))[0], (await request(port, "GET", "/reports"))[0],
+                (await request(port, "GET", "/jobs/missing"))[0]]
+
+    assert run_service(tmp_path, scenario) == [404, 405, 404]
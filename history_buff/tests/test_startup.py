@@ -0,0 +1,25 @@
+import subprocess
+import sys
+
+from src.history_buff.startup import ImportProfiler
+
+
+def test_crew_module_does_not_import_crewai():
+    code = ("import sys; import src.history_buff.crew; "
+            "print(sorted(m for m in ('crewai', 'crewai_tools', 'src.history_buff.tools.custom_tool') "
+            "if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
+
+
+def test_import_profiler_attributes_time_to_packages():
+    for name in [m for m in sys.modules if m == "json.tool"]:
+        del sys.modules[name]
+    profiler = ImportProfiler().start()
+    try:
+        import json.tool  # noqa: F401
+    finally:
+        profiler.stop()
+    assert "json.tool" in profiler.self_times
+    assert "json" in profiler.by_package()
+    assert profiler.report().startswith("Startup:")
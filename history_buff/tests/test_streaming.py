@@ -0,0 +1,58 @@
+import os
+
+from src.history_buff.streaming import AtomicFileWriter, StageStreamer, current_chunk_callback, write_atomic
+
+
+class Output:
+    def __init__(self, raw):
+        self.raw = raw
+
+
+def test_writer_only_replaces_target_on_commit(tmp_path):
+    target = tmp_path / "report.md"
+    target.write_text("old", encoding="utf-8")
+    writer = AtomicFileWriter(str(target))
+    writer.write("new ")
+    writer.write("text")
+    assert target.read_text() == "old"
+    writer.commit()
+    assert target.read_text() == "new text"
+    assert os.listdir(tmp_path) == ["report.md"]
+
+
+def test_commit_with_final_text_replaces_streamed_chunks(tmp_path):
+    writer = AtomicFileWriter(str(tmp_path / "report.md"))
+    writer.write("draft")
+    writer.commit("final")
+    assert (tmp_path / "report.md").read_text() == "final"
+
+
+def test_abort_keeps_existing_target(tmp_path):
+    target = tmp_path / "report.md"
+    write_atomic(str(target), "old")
+    writer = AtomicFileWriter(str(target))
+    writer.write("partial")
+    writer.abort()
+    assert target.read_text() == "old"
+    assert os.listdir(tmp_path) == ["report.md"]
+
+
+def test_stage_streamer_routes_chunks_to_stage_files(tmp_path, capsys):
+    timeline = tmp_path / "timeline.md"
+    streamer = StageStreamer({"timeline": str(timeline)})
+    streamer.start_stage("timeline")
+    callback = current_chunk_callback()
+    callback("- 1066: ")
+    callback("Hastings")
+    assert capsys.readouterr().out == "\n[timeline] - 1066: Hastings"
+    streamer.finish_stage("timeline", output=Output("- **1066**: Hastings"))
+    assert timeline.read_text() == "- **1066**: Hastings"
+    assert current_chunk_callback() is None
+
+
+def test_failed_stage_leaves_no_file(tmp_path):
+    streamer = StageStreamer({"report": str(tmp_path / "report.md")}, echo=False)
+    streamer.start_stage("report")
+    streamer.write("report", "partial")
+    streamer.fail_stage("report")
+    assert os.listdir(tmp_path) == []
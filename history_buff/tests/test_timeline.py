@@ -0,0 +1,80 @@
+import pytest
+
+from src.history_buff.timeline import build_timeline, format_date, normalize_event, parse_date
+
+
+def span(text):
+    date = parse_date(text)
+    return None if date is None else (date.start, date.end)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1066", (1066, 1066)),
+    ("44 BC", (-44, -44)),
+    ("c. 500 BCE", (-500, -500)),
+    ("500-400 BC", (-500, -400)),
+    ("27 BC - AD 14", (-27, 14)),
+    ("1939-1945", (1939, 1945)),
+    ("From 1789 to 1799", (1789, 1799)),
+    ("the 1960s", (1960, 1969)),
+    ("5th century BC", (-500, -401)),
+    ("2000 BC", (-2000, -2000)),
+])
+def test_parse_date_forms(text, expected):
+    assert span(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("The Armada had 130 ships when it sailed in 1588", (1588, 1588)),
+    ("About 2000 people died in the fire of 1666", (1666, 1666)),
+    ("Population reached 1200 by 1850", (1850, 1850)),
+    ("around 1200 soldiers fought in 1346", (1346, 1346)),
+    ("In 1914 some 300 ships sailed", (1914, 1914)),
+])
+def test_parse_date_skips_counts(text, expected):
+    assert span(text) == expected
+
+
+def test_parse_date_ignores_numbers_with_separators():
+    assert parse_date("1,500 soldiers") is None
+    assert parse_date("3,000 years ago") is None
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("the 1800s", (1800, 1899)),
+    ("the 100s BC", (-199, -100)),
+    ("the 2000s", (2000, 2009)),
+    ("1914–18", (1914, 1918)),
+    ("1861-65", (1861, 1865)),
+    ("10,000 BC", (-10000, -10000)),
+    ("12,000 BCE", (-12000, -12000)),
+    ("14th-century", (1301, 1400)),
+    ("14th-century BC", (-1400, -1301)),
+])
+def test_parse_date_periods_and_abbreviations(text, expected):
+    assert span(text) == expected
+
+
+def test_full_dates_keep_month_and_day():
+    date = parse_date("July 4, 1776")
+    assert (date.start, date.month, date.day) == (1776, 7, 4)
+    assert format_date(date) == "July 4, 1776"
+    assert format_date(parse_date("the 1800s")) == "1800s"
+    assert format_date(parse_date("500-400 BC")) == "500–400 BCE"
+
+
+def test_normalize_event_reads_date_prefix():
+    event = normalize_event("1588: The Armada sails with 130 ships")
+    assert (event.title, event.date.start) == ("The Armada sails with 130 ships", 1588)
+
+
+def test_build_timeline_asks_only_for_undated_events():
+    prompts = []
+
+    def resolve(prompt):
+        prompts.append(prompt)
+        return '[{"index": 0, "date": "1215"}]'
+
+    markdown = build_timeline([{"title": "Magna Carta"}, {"title": "Battle of Hastings", "date": "1066"}], resolve)
+    assert len(prompts) == 1 and "Magna Carta" in prompts[0] and "Hastings" not in prompts[0]
+    assert markdown.index("1066") < markdown.index("1215")